@@ -1,3 +1,6 @@
+import asyncio
+import os
+from anyio import to_thread
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from firebase_configuration import initialize_firebase
@@ -7,6 +10,11 @@ from routers.post import post_router
 from routers.stock import stock_router
 from routers.image import profile_image_router
 from routers.comment import comment_router
+from routers.jobs import jobs_router
+from services.hot_tickers import run_refresher
+from services.pagination import NEXT_CURSOR_HEADER
+from services.tombstones import run_sweeper
+from services.username_index import run_username_index_loader
 
 #
 # This is a class to simply create our app instance and add the routers to it
@@ -15,6 +23,36 @@ from routers.comment import comment_router
 # Create FastAPI instance
 app = FastAPI()
 
+# The endpoints are plain functions, so FastAPI runs each request on a worker thread instead of the event loop.
+# This bounds how many requests can be blocked on Firestore or yfinance at once per worker process.
+REQUEST_WORKER_THREADS = int(os.getenv('REQUEST_WORKER_THREADS', '40'))
+
+@app.on_event("startup")
+async def configure_request_threads():
+    to_thread.current_default_thread_limiter().total_tokens = REQUEST_WORKER_THREADS
+
+# Deleted posts and users are only tombstoned by the endpoints, and removed by this background sweeper
+SWEEPER_ENABLED = os.getenv('SWEEPER_ENABLED', 'true').lower() == 'true'
+
+@app.on_event("startup")
+async def start_deletion_sweeper():
+    if SWEEPER_ENABLED:
+        # Keep a reference to the task, so it is not garbage collected while it runs
+        app.state.deletion_sweeper = asyncio.ensure_future(run_sweeper())
+
+# Quotes of the tickers in users' stock lists are kept warm by this background refresher
+HOT_TICKER_REFRESH_ENABLED = os.getenv('HOT_TICKER_REFRESH_ENABLED', 'true').lower() == 'true'
+
+@app.on_event("startup")
+async def start_hot_ticker_refresher():
+    if HOT_TICKER_REFRESH_ENABLED:
+        app.state.hot_ticker_refresher = asyncio.ensure_future(run_refresher())
+
+# User search is answered from an in-memory username index, loaded in the background
+@app.on_event("startup")
+async def start_username_index_loader():
+    app.state.username_index_loader = asyncio.ensure_future(run_username_index_loader())
+
 # # List of origins that are allowed to make requests
 # origins = [
 #     "http://localhost",
@@ -31,6 +69,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],  # Let clients read the pagination cursor
 )
 
 # Include routers, which allow us to modularize our code among different files
@@ -40,3 +79,4 @@ app.include_router(post_router)
 app.include_router(stock_router)
 app.include_router(profile_image_router)
 app.include_router(comment_router)
+app.include_router(jobs_router)
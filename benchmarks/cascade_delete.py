@@ -0,0 +1,64 @@
+import argparse
+import uuid
+from datetime import datetime
+import pytz
+from firebase_configuration import db
+from services.cascade import delete_user_tree
+
+#
+# Measures cascade-delete throughput for a user whose post has many likes.
+# This writes to the Firestore project in GOOGLE_APPLICATION_CREDENTIALS, so point it at a test project:
+#
+#   GOOGLE_APPLICATION_CREDENTIALS=<test project key> python -m benchmarks.cascade_delete --likes 10000
+#
+
+
+def seed_user(likes: int) -> str:
+    """
+    Create a throwaway user with one post that has the given number of likes, and return the user's ID
+    """
+    user_id = f'cascade-benchmark-{uuid.uuid4().hex[:8]}'
+    user_ref = db.collection('users').document(user_id)
+    post_ref = db.collection('posts').document()
+
+    writer = db.bulk_writer()
+    writer.set(user_ref, {
+        'id': user_id,
+        'name': 'Cascade Benchmark',
+        'username': user_id,
+        'bio': '',
+        'profile_image_url': '',
+        'followers_count': 0,
+        'following_count': 0,
+    })
+    writer.set(post_ref, {
+        'id': post_ref.id,
+        'userId': user_id,
+        'content': 'benchmark',
+        'timestamp': datetime.now(pytz.UTC),
+        'likes_count': likes,
+        'comments_count': 0,
+    })
+
+    # Each like lives under the post and under the liking user's likedPosts subcollection
+    for index in range(likes):
+        liker_id = f'{user_id}-liker-{index}'
+        writer.set(post_ref.collection('likes').document(liker_id), {'liked_at': datetime.now()})
+        writer.set(db.collection('users').document(liker_id).collection('likedPosts').document(post_ref.id),
+                   {'liked_at': datetime.now()})
+    writer.close()
+
+    return user_id
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cascade-delete throughput")
+    parser.add_argument('--likes', type=int, default=10000, help="Number of likes on the seeded user's post")
+    args = parser.parse_args()
+
+    user_id = seed_user(args.likes)
+    print(f"Seeded {user_id} with {args.likes} likes")
+
+    result = delete_user_tree(user_id)
+    print(f"writes={result.writes} failed={result.failed_writes} "
+          f"seconds={result.seconds:.2f} writes/second={result.writes_per_second:.0f}")
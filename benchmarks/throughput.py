@@ -0,0 +1,66 @@
+import argparse
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+#
+# Measures concurrent-request throughput of a running backend, e.g. one uvicorn worker:
+#
+#   uvicorn main:app --workers 1 --port 8080
+#   python benchmarks/throughput.py --url http://localhost:8080/posts/fetch --token <ID token> --concurrency 50
+#
+# Compare the requests/second at concurrency 1 and at higher concurrency. When requests block the
+# event loop, throughput stays flat as concurrency grows; when they don't, it grows with concurrency.
+#
+
+
+def send_request(url: str, token: str) -> tuple:
+    """
+    Send one GET request and return (succeeded, latency in seconds)
+    """
+    request = urllib.request.Request(url, headers={'Authorization': f'Bearer {token}'} if token else {})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+            succeeded = response.status < 400
+    except (urllib.error.URLError, OSError):
+        succeeded = False
+    return succeeded, time.perf_counter() - started
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def run(url: str, token: str, concurrency: int, total_requests: int) -> None:
+    """
+    Send the requests with the given number in flight at once and print the throughput and latencies
+    """
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: send_request(url, token), range(total_requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for _, latency in results)
+    failures = sum(1 for succeeded, _ in results if not succeeded)
+
+    print(f"concurrency={concurrency} requests={total_requests} failures={failures}")
+    print(f"throughput: {total_requests / elapsed:.1f} requests/second")
+    print(f"latency p50={percentile(latencies, 0.50) * 1000:.1f}ms "
+          f"p95={percentile(latencies, 0.95) * 1000:.1f}ms "
+          f"p99={percentile(latencies, 0.99) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure concurrent-request throughput of the backend")
+    parser.add_argument('--url', required=True, help="Endpoint to request, e.g. http://localhost:8080/posts/fetch")
+    parser.add_argument('--token', default='', help="Firebase ID token sent as the Authorization header")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50], help="Requests in flight at once")
+    parser.add_argument('--requests', type=int, default=500, help="Requests to send per concurrency level")
+    args = parser.parse_args()
+
+    for level in args.concurrency:
+        run(args.url, args.token, level, args.requests)
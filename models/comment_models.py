@@ -1,6 +1,7 @@
 from datetime import datetime
 from typing import Optional
 from pydantic import BaseModel
+from models.user_models import AuthorModel
 
 class CommentModel(BaseModel):
     id: str
@@ -9,6 +10,7 @@ class CommentModel(BaseModel):
     timestamp: datetime
     likes_count: int
     isLikedByUser: Optional[bool] = False
+    author: Optional[AuthorModel] = None  # Only set when the request asks for authors
 
 
 class CreateCommentModel(BaseModel):
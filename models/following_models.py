@@ -1,4 +1,5 @@
 # Pydantic model for the follow request
+from typing import List
 from pydantic import BaseModel
 
 class FollowRequest(BaseModel):
@@ -6,3 +7,15 @@ class FollowRequest(BaseModel):
 
 class UnfollowRequest(BaseModel):
     userIdToUnfollow: str
+
+class IsFollowingBatchRequest(BaseModel):
+    userIds: List[str]
+
+# A user in a followers or following list, with their relationship to the current user
+class FollowListUserModel(BaseModel):
+    id: str
+    username: str
+    name: str
+    profile_image_url: str
+    followsYou: bool
+    youFollow: bool
@@ -0,0 +1,14 @@
+from datetime import datetime
+from typing import Optional
+from pydantic import BaseModel
+
+class DeletionJobModel(BaseModel):
+    id: str
+    kind: str
+    targetId: str
+    status: str
+    writes: int
+    failed_writes: int
+    seconds: Optional[float] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
@@ -1,5 +1,6 @@
 from typing import Optional
 from pydantic import BaseModel 
+from models.user_models import AuthorModel
 from datetime import datetime 
 
 # this is the pydantic model (or object) for a post, needed for data validation
@@ -11,6 +12,7 @@ class PostModel(BaseModel):
     likes_count: int
     comments_count: int  # New field for comments count
     isLikedByUser: Optional[bool] = False
+    author: Optional[AuthorModel] = None  # Only set when the request asks for authors
 
 # New model for post creation that only requires the content field
 # This ensures that the ID and timestamp are generated server-side
@@ -38,6 +38,17 @@ class UserModel(BaseModel):
     following_count: int = 0
     stockLists: Optional[Dict[str, List[str]]] = None  # Set default to None
 
+# Compact view of a user, embedded as the author of posts and comments
+class AuthorModel(BaseModel):
+    id: str
+    username: str
+    name: str
+    profile_image_url: str
+
+# Model for fetching several users at once
+class UserBatchRequest(BaseModel):
+    userIds: List[str]
+
 # Model for user creation that only requires the name and username fields
 class CreateUserModel(BaseModel):
     name: str
@@ -1,17 +1,52 @@
 from datetime import datetime
 from typing import List, Optional
 import pytz
-from fastapi import HTTPException, APIRouter, Depends, Query, status
+from fastapi import HTTPException, APIRouter, Depends, Query, Response, status
 from models.comment_models import CommentModel, CreateCommentModel
 from routers.user_interactions import get_current_user_id
+from services import counters
+from services.batches import commit_chunked
+from services.db_executor import run_concurrently
+from services.feed_cache import feed_cache
+from services.likes import get_liked_ids
+from services.pagination import cursor_for_page, order_newest_first, resolve_start_position, set_next_cursor
+from services.profile_cache import attach_authors
+from services.tombstones import is_tombstoned
 from firebase_configuration import db
 from firebase_admin import firestore
 
 # Create a router for the comment-related requests
 comment_router = APIRouter()
 
+@firestore.transactional
+def create_comment_in_transaction(transaction, post_ref, comment_data, user_id):
+    """
+    Helper function to check that the post exists and write the comment in one transaction,
+    so a comment cannot be added to a post that is being deleted
+    """
+    post_doc = post_ref.get(transaction=transaction)
+    if not post_doc.exists or is_tombstoned(post_doc):
+        raise HTTPException(status_code=404, detail="Post not found")
+
+    # Save the comment to Firestore under the post's comments subcollection
+    comment_ref = post_ref.collection('comments').document(comment_data['id'])
+    transaction.set(comment_ref, comment_data)
+
+    # Initialize the likes sub-collection with the user ID of the comment creator
+    likes_ref = comment_ref.collection('likes')
+    transaction.set(likes_ref.document(user_id), {'liked_at': firestore.SERVER_TIMESTAMP})
+
+    # Increment the comment count of the post, on one of its counter shards if the snapshot shows it is sharded
+    counters.increment(post_ref, 'comments_count', 1, transaction, post_doc)
+
+    # Add the post to the user's commentedPosts subcollection
+    user_ref = db.collection('users').document(user_id)
+    commented_posts_ref = user_ref.collection('commentedPosts').document(post_ref.id)
+    transaction.set(commented_posts_ref, {'commented_at': firestore.SERVER_TIMESTAMP})
+
+
 @comment_router.post("/comments/create", response_model=CommentModel)
-async def create_comment(comment: CreateCommentModel, user_id: str = Depends(get_current_user_id)):
+def create_comment(comment: CreateCommentModel, user_id: str = Depends(get_current_user_id)):
     """
     Endpoint to create a new comment
     """
@@ -26,20 +61,15 @@ async def create_comment(comment: CreateCommentModel, user_id: str = Depends(get
     }
 
     try:
-        # Save the comment to Firestore under the post's comments subcollection
-        post_ref.collection('comments').document(comment_id).set(comment_data)
+        # Check the post and commit every write of the comment together
+        create_comment_in_transaction(db.transaction(), post_ref, comment_data, user_id)
 
-        # Initialize the likes sub-collection with the user ID of the comment creator
-        likes_ref = post_ref.collection('comments').document(comment_id).collection('likes')
-        likes_ref.document(user_id).set({'liked_at': firestore.SERVER_TIMESTAMP})
+        # Patch the new comment count into the cached counts and any cached feed pages
+        counters.note_increment(post_ref, 'comments_count', 1)
+        feed_cache.apply_comment_count(comment.postId, 1)
 
-        # Increment the comment count in the post document
-        post_ref.update({'comments_count': firestore.Increment(1)})
-
-        # Add the post to the user's commentedPosts subcollection
-        user_ref = db.collection('users').document(user_id)
-        commented_posts_ref = user_ref.collection('commentedPosts').document(comment.postId)
-        commented_posts_ref.set({'commented_at': firestore.SERVER_TIMESTAMP})
+    except HTTPException:
+        raise
 
     except Exception as e:
         raise HTTPException(
@@ -52,15 +82,28 @@ async def create_comment(comment: CreateCommentModel, user_id: str = Depends(get
 
 
 @comment_router.delete("/comments/delete/{post_id}/{comment_id}", status_code=status.HTTP_200_OK)
-async def delete_comment(post_id: str, comment_id: str, user_id: str = Depends(get_current_user_id)):
+def delete_comment(post_id: str, comment_id: str, user_id: str = Depends(get_current_user_id)):
     """
     Endpoint to delete a comment
     """
     post_ref = db.collection('posts').document(post_id)
     comment_ref = post_ref.collection('comments').document(comment_id)
 
+    # Fetch the post, the comment and the user's comments on the same post concurrently
+    post_doc, comment, user_comments_on_post = run_concurrently([
+        post_ref.get,
+        comment_ref.get,
+        lambda: list(post_ref.collection('comments').where('userId', '==', user_id).limit(2).stream()),
+    ])
+
+    # The comments of a deleted post are being removed by the sweeper, and its count can no longer be updated
+    if not post_doc.exists or is_tombstoned(post_doc):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Post not found"
+        )
+
     # Check if the comment exists and belongs to the current user
-    comment = comment_ref.get()
     if not comment.exists:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -75,38 +118,43 @@ async def delete_comment(post_id: str, comment_id: str, user_id: str = Depends(g
         )
 
     try:
+        # Check if the user has any other comments on the same post
+        has_other_comments = any(user_comment.id != comment_id for user_comment in user_comments_on_post)
+
         # Start a Firestore batch
         batch = db.batch()
 
-        # Delete comment's likes and remove from users' likedComments subcollections
-        likes_ref = comment_ref.collection('likes')
-        likes = likes_ref.stream()
-        for like in likes:
-            user_ref = db.collection('users').document(like.id)
-            liked_comment_ref = user_ref.collection('likedComments').document(comment_id)
-            batch.delete(liked_comment_ref)
-            batch.delete(like.reference)
-
-        # Delete the comment document
+        # Delete the comment document and its counter shards
+        shard_refs = counters.shard_refs(comment_ref)
+        for shard_ref in shard_refs:
+            batch.delete(shard_ref)
         batch.delete(comment_ref)
 
-        # Commit the deletion of the comment and its likes
-        batch.commit()
+        # Decrement the comment count of the post, on one of its counter shards if the snapshot shows it is sharded
+        counters.increment(post_ref, 'comments_count', -1, batch, post_doc)
+        batch_size = len(shard_refs) + 2
 
-        # Decrement the comment count in the post document
-        post_ref.update({'comments_count': firestore.Increment(-1)})
-
-        # Check if the user has any other comments on the same post
-        user_comments_on_post = List(post_ref.collection('comments').where('userId', '==', user_id).stream())
-
-        if not any(user_comments_on_post):
+        if not has_other_comments:
             # If no other comments by the user, remove the post from the user's commentedPosts subcollection
             user_ref = db.collection('users').document(user_id)
             commented_posts_ref = user_ref.collection('commentedPosts').document(post_id)
             batch.delete(commented_posts_ref)
+            batch_size += 1
 
-        # Commit the batch after checking user's comments on post
-        batch.commit()
+        # Delete comment's likes and remove from users' likedComments subcollections
+        likes_ref = comment_ref.collection('likes')
+        operations = []
+        for like in likes_ref.stream():
+            user_ref = db.collection('users').document(like.id)
+            operations.append(('delete', user_ref.collection('likedComments').document(comment_id), None))
+            operations.append(('delete', like.reference, None))
+
+        # Commit the comment with the first chunk of like deletions in one round trip
+        commit_chunked(operations, batch, batch_size)
+
+        counters.note_increment(post_ref, 'comments_count', -1)
+        counters.forget(comment_ref)
+        feed_cache.apply_comment_count(post_id, -1)
 
         return {"message": "Comment deleted successfully"}
 
@@ -118,10 +166,13 @@ async def delete_comment(post_id: str, comment_id: str, user_id: str = Depends(g
 
 
 @comment_router.get("/comments/fetch", response_model=List[CommentModel])
-async def fetch_comments(
+def fetch_comments(
     post_id: str,
+    response: Response,
     limit: int = Query(10, description="Limit the number of comments returned"),
-    start_after: Optional[str] = Query(None, description="Start after this comment ID"),
+    cursor: Optional[str] = Query(None, description="Cursor returned in the X-Next-Cursor header of the previous page"),
+    start_after: Optional[str] = Query(None, description="Start after this comment ID", deprecated=True),
+    include_authors: bool = Query(False, description="Embed each comment author's username, name and profile image"),
     user_id: str = Depends(get_current_user_id),
 ) -> List[CommentModel]:
     """
@@ -129,115 +180,158 @@ async def fetch_comments(
     """
     try:
         post_ref = db.collection('posts').document(post_id)
-        comments_query = post_ref.collection('comments').order_by('timestamp', direction=firestore.Query.DESCENDING).limit(limit)
 
-        if start_after:
-            start_after_doc = post_ref.collection('comments').document(start_after).get()
-            if start_after_doc.exists:
-                comments_query = comments_query.start_after(start_after_doc)
-            else:
-                raise HTTPException(status_code=404, detail="Start after comment not found")
+        # Resolve where the page starts, which needs no read when a cursor is given
+        position = resolve_start_position(cursor, start_after, post_ref.collection('comments'), "Start after comment not found")
+        comments_query = order_newest_first(post_ref.collection('comments'), position).limit(limit)
+
+        # Fetch the post and the page of comments concurrently
+        post_doc, comments_docs = run_concurrently([
+            post_ref.get,
+            lambda: list(comments_query.stream()),
+        ])
+
+        # A deleted post's comments are hidden until the sweeper removes them
+        if is_tombstoned(post_doc):
+            return []
+
+        set_next_cursor(response, cursor_for_page(comments_docs, limit))
 
-        comments_docs = comments_query.stream()
+        # Resolve the like state and the sharded like counts for the whole page concurrently
+        liked_ids, counts = run_concurrently([
+            lambda: get_liked_ids([comment.reference for comment in comments_docs], user_id),
+            lambda: counters.get_totals(comments_docs, ('likes_count',)),
+        ])
         comments = []
 
         for comment in comments_docs:
             comment_data = comment.to_dict()
-            is_liked = post_ref.collection('comments').document(comment.id).collection('likes').document(user_id).get().exists
             comments.append(CommentModel(
                 id=comment.id,
                 postId=post_id,
                 userId=comment_data['userId'],
                 content=comment_data['content'],
                 timestamp=comment_data['timestamp'],
-                likes_count=comment_data.get('likes_count', 0),
-                isLikedByUser=is_liked,
+                likes_count=counts[comment.id]['likes_count'],
+                isLikedByUser=comment.id in liked_ids,
             ))
 
+        # Resolve the authors of the whole page in one read
+        if include_authors:
+            attach_authors(comments)
+
         return comments
 
+    except HTTPException:
+        raise
+
     except Exception as e:
         print(f"An error occurred while fetching comments: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
     
 
-def increment_comment_likes(post_ref, comment_id, user_id):
-    try:
-        comment_ref = post_ref.collection('comments').document(comment_id)
-        comment_snapshot = comment_ref.get()
-        if not comment_snapshot.exists:
-            raise HTTPException(status_code=404, detail="Comment not found")
-
-        likes_count = comment_snapshot.get('likes_count') + 1
-        comment_ref.update({'likes_count': likes_count})
+def increment_comment_likes(batch, comment_ref, user_id, comment_snapshot=None):
+    """
+    Helper function to add the writes that increment a comment's likes and add the like document to a batch or transaction
+    """
+    counters.increment(comment_ref, 'likes_count', 1, batch, comment_snapshot)
 
-        likes_ref = comment_ref.collection('likes').document(user_id)
-        likes_ref.set({'liked_at': datetime.now()})
+    likes_ref = comment_ref.collection('likes').document(user_id)
+    batch.set(likes_ref, {'liked_at': datetime.now()})
 
-        user_liked_comments_ref = db.collection('users').document(user_id).collection('likedComments').document(comment_ref.id)
-        user_liked_comments_ref.set({'liked_at': datetime.now()})
+    # Keep the post ID alongside the like, since the comment's path cannot be rebuilt without it
+    user_liked_comments_ref = db.collection('users').document(user_id).collection('likedComments').document(comment_ref.id)
+    batch.set(user_liked_comments_ref, {'liked_at': datetime.now(), 'postId': comment_ref.parent.parent.id})
 
-        print("Comment likes incremented successfully")
 
-    except Exception as e:
-        print(f"Failed to increment comment likes: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to increment comment likes: {e}")
+@firestore.transactional
+def like_comment_in_transaction(transaction, comment_ref, user_id):
+    """
+    Helper function to check and record a comment like in one transaction, so concurrent requests cannot double count it
+    """
+    post_ref = comment_ref.parent.parent
+    likes_ref = comment_ref.collection('likes').document(user_id)
+    snapshots = {snapshot.reference.path: snapshot for snapshot in transaction.get_all([post_ref, comment_ref, likes_ref])}
 
+    # The comments of a deleted post are being removed by the sweeper
+    post_doc = snapshots[post_ref.path]
+    if not post_doc.exists or is_tombstoned(post_doc):
+        raise HTTPException(status_code=404, detail="Post not found")
 
-@comment_router.post("/comments/like/{post_id}/{comment_id}", status_code=status.HTTP_200_OK)
-async def like_comment(post_id: str, comment_id: str, user_id: str = Depends(get_current_user_id)):
-    post_ref = db.collection('posts').document(post_id)
+    if not snapshots[comment_ref.path].exists:
+        raise HTTPException(status_code=404, detail="Comment not found")
 
-    likes_ref = post_ref.collection('comments').document(comment_id).collection('likes').document(user_id)
-    if likes_ref.get().exists:
+    if snapshots[likes_ref.path].exists:
         raise HTTPException(status_code=400, detail="Comment already liked by user")
 
+    increment_comment_likes(transaction, comment_ref, user_id, snapshots[comment_ref.path])
+
+
+@comment_router.post("/comments/like/{post_id}/{comment_id}", status_code=status.HTTP_200_OK)
+def like_comment(post_id: str, comment_id: str, user_id: str = Depends(get_current_user_id)):
+    comment_ref = db.collection('posts').document(post_id).collection('comments').document(comment_id)
+
     try:
-        increment_comment_likes(post_ref, comment_id, user_id)
+        like_comment_in_transaction(db.transaction(), comment_ref, user_id)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Failed to like comment: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to like comment: {e}")
 
+    counters.note_increment(comment_ref, 'likes_count', 1)
+
     return {"message": "Comment liked successfully"}
 
 
-def decrement_comment_likes(post_ref, comment_id, user_id):
-    try:
-        comment_ref = post_ref.collection('comments').document(comment_id)
-        comment_snapshot = comment_ref.get()
-        if not comment_snapshot.exists:
-            raise HTTPException(status_code=404, detail="Comment not found")
+def decrement_comment_likes(batch, comment_ref, user_id, comment_snapshot=None):
+    """
+    Helper function to add the writes that decrement a comment's likes and delete the like document to a batch or transaction
+    """
+    counters.increment(comment_ref, 'likes_count', -1, batch, comment_snapshot)
 
-        likes_count = comment_snapshot.get('likes_count') - 1
-        if likes_count < 0:
-            likes_count = 0
-        comment_ref.update({'likes_count': likes_count})
+    likes_ref = comment_ref.collection('likes').document(user_id)
+    batch.delete(likes_ref)
 
-        likes_ref = comment_ref.collection('likes').document(user_id)
-        likes_ref.delete()
+    user_liked_comments_ref = db.collection('users').document(user_id).collection('likedComments').document(comment_ref.id)
+    batch.delete(user_liked_comments_ref)
 
-        user_liked_comments_ref = db.collection('users').document(user_id).collection('likedComments').document(comment_ref.id)
-        user_liked_comments_ref.delete()
 
-        print("Comment likes decremented successfully")
+@firestore.transactional
+def unlike_comment_in_transaction(transaction, comment_ref, user_id):
+    """
+    Helper function to check and remove a comment like in one transaction, so concurrent requests cannot double count it
+    """
+    post_ref = comment_ref.parent.parent
+    likes_ref = comment_ref.collection('likes').document(user_id)
+    snapshots = {snapshot.reference.path: snapshot for snapshot in transaction.get_all([post_ref, comment_ref, likes_ref])}
 
-    except Exception as e:
-        print(f"Failed to decrement comment likes: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to decrement comment likes: {e}")
+    # The comments of a deleted post are being removed by the sweeper
+    post_doc = snapshots[post_ref.path]
+    if not post_doc.exists or is_tombstoned(post_doc):
+        raise HTTPException(status_code=404, detail="Post not found")
 
+    if not snapshots[comment_ref.path].exists:
+        raise HTTPException(status_code=404, detail="Comment not found")
 
-@comment_router.post("/comments/unlike/{post_id}/{comment_id}", status_code=status.HTTP_200_OK)
-async def unlike_comment(post_id: str, comment_id: str, user_id: str = Depends(get_current_user_id)):
-    post_ref = db.collection('posts').document(post_id)
-
-    likes_ref = post_ref.collection('comments').document(comment_id).collection('likes').document(user_id)
-    if not likes_ref.get().exists:
+    if not snapshots[likes_ref.path].exists:
         raise HTTPException(status_code=400, detail="Comment not liked by user")
 
+    decrement_comment_likes(transaction, comment_ref, user_id, snapshots[comment_ref.path])
+
+
+@comment_router.post("/comments/unlike/{post_id}/{comment_id}", status_code=status.HTTP_200_OK)
+def unlike_comment(post_id: str, comment_id: str, user_id: str = Depends(get_current_user_id)):
+    comment_ref = db.collection('posts').document(post_id).collection('comments').document(comment_id)
+
     try:
-        decrement_comment_likes(post_ref, comment_id, user_id)
+        unlike_comment_in_transaction(db.transaction(), comment_ref, user_id)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Failed to unlike comment: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to unlike comment: {e}")
 
+    counters.note_increment(comment_ref, 'likes_count', -1)
+
     return {"message": "Comment unliked successfully"}
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException
-from firebase_admin import firestore
+from firebase_configuration import db
 from pydantic import BaseModel
 from routers.user_interactions import get_current_user_id
+from services.profile_cache import profile_cache
 
 # Create a router for the profile image related requests
 profile_image_router = APIRouter()
@@ -11,7 +12,7 @@ class UpdateProfileImageModel(BaseModel):
     profile_image_url: str
 
 @profile_image_router.put("/user/updateProfileImage")
-async def update_profile_image(
+def update_profile_image(
     update_data: UpdateProfileImageModel,
     user_id: str = Depends(get_current_user_id)
 ):
@@ -19,8 +20,11 @@ async def update_profile_image(
     Endpoint to update a user's profile image
     """
     try:
-        user_ref = firestore.client().collection('users').document(user_id)
+        user_ref = db.collection('users').document(user_id)
         user_ref.update({'profile_image_url': update_data.profile_image_url})
+
+        # Patch the cached profile with the new image
+        profile_cache.update_profile(user_id, profile_image_url=update_data.profile_image_url)
         
         return {"message": "Profile image updated successfully"}
     except Exception as e:
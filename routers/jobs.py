@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Depends, HTTPException, Path
+from firebase_configuration import db
+from models.job_models import DeletionJobModel
+from routers.user_interactions import get_current_user_id
+from services.tombstones import JOBS_COLLECTION
+
+# Create a router for the background job related requests
+jobs_router = APIRouter()
+
+
+@jobs_router.get("/jobs/deletion/{job_id}", response_model=DeletionJobModel)
+def get_deletion_job(
+    job_id: str = Path(..., description="The job ID returned by a delete endpoint"),
+    user_id: str = Depends(get_current_user_id)
+) -> DeletionJobModel:
+    """
+    Endpoint to check the progress of a deferred post or user deletion
+    """
+    job_doc = db.collection(JOBS_COLLECTION).document(job_id).get()
+
+    # Only the user who requested the deletion can see its job
+    if not job_doc.exists or job_doc.to_dict().get('userId') != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return DeletionJobModel(**job_doc.to_dict())
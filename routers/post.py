@@ -1,17 +1,49 @@
 from datetime import datetime
 import pytz
-from fastapi import HTTPException, APIRouter, Depends, Query, status
+from fastapi import BackgroundTasks, HTTPException, APIRouter, Depends, Query, Response, status
 from routers.user_interactions import get_current_user_id
 from firebase_configuration import db
 from firebase_admin import firestore
 from models.post_models import PostModel, CreatePostModel
+from services import counters
+from services.db_executor import run_concurrently
+from services.feed_cache import feed_cache
+from services.follow_graph import following_sets
+from services.following_feed import fetch_merged_page
+from services.likes import get_liked_ids
+from services.pagination import cursor_for_page, order_newest_first, resolve_start_position, set_next_cursor
+from services.profile_cache import author_snippet, get_profile, without_deleted_authors
+from services.timeline import FANOUT_ON_WRITE, add_timeline_entry, fan_out_post, fetch_timeline_page, get_follower_ids
+from services.tombstones import is_tombstoned, tombstone
 from typing import List, Optional
 
 # Create a router for the post-related requests
 post_router = APIRouter()
 
+def finish_post_fan_out(post_id: str, user_id: str, timestamp) -> None:
+    """
+    Helper function to add a committed post to its author's followers' timelines and drop their cached feeds.
+    It runs after the response is sent, so a failure here is logged rather than failing a post that exists.
+    """
+    try:
+        if FANOUT_ON_WRITE:
+            follower_ids = fan_out_post(post_id, user_id, timestamp)
+        else:
+            follower_ids = get_follower_ids(user_id)
+
+        # Drop the cached feeds that should now show the new post
+        feed_cache.invalidate_users(follower_ids)
+
+    except Exception as e:
+        print(f"Failed to fan out post {post_id}: {e}")
+
+
 @post_router.post("/posts/create", response_model=PostModel)
-async def create_post(post: CreatePostModel, user_id: str = Depends(get_current_user_id)) -> PostModel:
+def create_post(
+    post: CreatePostModel,
+    background_tasks: BackgroundTasks,
+    user_id: str = Depends(get_current_user_id),
+) -> PostModel:
     """
     Endpoint to create a new post
     """
@@ -26,25 +58,40 @@ async def create_post(post: CreatePostModel, user_id: str = Depends(get_current_
     }
 
     try:
+        # Start a Firestore batch so the post and its first like are written together
+        batch = db.batch()
+
         # Save the post to Firestore
-        db.collection('posts').document(post_id).set(post_data)
+        post_ref = db.collection('posts').document(post_id)
+        batch.set(post_ref, post_data)
 
         # Initialize the likes sub-collection with the user ID of the post creator
-        likes_ref = db.collection('posts').document(post_id).collection('likes')
-        likes_ref.document(user_id).set({'liked_at': firestore.SERVER_TIMESTAMP})
+        likes_ref = post_ref.collection('likes')
+        batch.set(likes_ref.document(user_id), {'liked_at': firestore.SERVER_TIMESTAMP})
+
+        # The creator sees the post in their own timeline right away
+        if FANOUT_ON_WRITE:
+            add_timeline_entry(batch, user_id, post_id, user_id, post_data['timestamp'])
+
+        batch.commit()
 
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Failed to create post: {e}",
         )
-    
+
+    feed_cache.invalidate_users([user_id])
+
+    # Add the post to the followers' timelines once the response is sent
+    background_tasks.add_task(finish_post_fan_out, post_id, user_id, post_data['timestamp'])
+
     # return a post model, while ensuring that the current user likes their own post
     return PostModel(**post_data, isLikedByUser=True)
 
 
 @post_router.delete("/posts/delete/{post_id}", status_code=status.HTTP_200_OK)
-async def delete_post(post_id: str, user_id: str = Depends(get_current_user_id)):
+def delete_post(post_id: str, user_id: str = Depends(get_current_user_id)):
     """
     Endpoint to delete a post
     """
@@ -52,7 +99,7 @@ async def delete_post(post_id: str, user_id: str = Depends(get_current_user_id))
 
     # Check if the post exists and belongs to the current user
     post = post_ref.get()
-    if not post.exists:
+    if not post.exists or is_tombstoned(post):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Post not found"
@@ -66,49 +113,14 @@ async def delete_post(post_id: str, user_id: str = Depends(get_current_user_id))
         )
 
     try:
-        # Start a Firestore batch
-        batch = db.batch()
+        # Hide the post right away, and leave deleting its subtree to the background sweeper
+        job_id = tombstone(post_ref, 'post', user_id)
 
-        # Delete post's likes and remove from users' likedPosts subcollections
-        likes_ref = post_ref.collection('likes')
-        likes = likes_ref.stream()
-        for like in likes:
-            user_ref = db.collection('users').document(like.id)
-            liked_post_ref = user_ref.collection('likedPosts').document(post_id)
-            batch.delete(liked_post_ref)
-            batch.delete(like.reference)
-
-        # Delete post's comments and their likes, and remove from users' commentedPosts subcollections
-        comments_ref = post_ref.collection('comments')
-        comments = comments_ref.stream()
-        for comment in comments:
-            comment_ref = comment.reference
-            comment_data = comment.to_dict()
-
-            # Delete comment's likes and remove from users' likedComments subcollections
-            comment_likes_ref = comment_ref.collection('likes')
-            comment_likes = comment_likes_ref.stream()
-            for comment_like in comment_likes:
-                user_ref = db.collection('users').document(comment_like.id)
-                liked_comment_ref = user_ref.collection('likedComments').document(comment_ref.id)
-                batch.delete(liked_comment_ref)
-                batch.delete(comment_like.reference)
-
-            # Remove the post from the user's commentedPosts subcollection
-            user_ref = db.collection('users').document(comment_data['userId'])
-            commented_post_ref = user_ref.collection('commentedPosts').document(post_id)
-            batch.delete(commented_post_ref)
-
-            # Delete the comment document
-            batch.delete(comment_ref)
-
-        # Delete the post document
-        batch.delete(post_ref)
-
-        # Commit the batch
-        batch.commit()
+        # Remove the post from any cached feeds and counts
+        feed_cache.invalidate_post(post_id)
+        counters.forget(post_ref)
 
-        return {"message": "Post deleted successfully"}
+        return {"message": "Post deleted successfully", "jobId": job_id}
     
     except Exception as e:
         raise HTTPException(
@@ -236,53 +248,81 @@ async def delete_post(post_id: str, user_id: str = Depends(get_current_user_id))
 
 
 @post_router.get("/posts/fetch", response_model=List[PostModel])
-async def get_posts(
+def get_posts(
+    response: Response,
     user_id: str = Depends(get_current_user_id),
     limit: int = Query(10, description="Limit the number of posts returned"),
-    start_after: Optional[str] = Query(None, description="Start after this post ID")
+    cursor: Optional[str] = Query(None, description="Cursor returned in the X-Next-Cursor header of the previous page"),
+    start_after: Optional[str] = Query(None, description="Start after this post ID", deprecated=True),
+    include_authors: bool = Query(False, description="Embed each post author's username, name and profile image")
 ) -> List[PostModel]:
     """
     Method to return posts for the current user's following list with pagination
     """
     print("Request received at /posts/fetch")
-    try:
-        # Fetch the current user's following subcollection
-        following_ref = db.collection('users').document(user_id).collection('following')
-        following_docs = following_ref.stream()
-        
-        following_ids = [doc.id for doc in following_docs]
-
-        # Add the current user's ID to the list of IDs to include their own posts
-        following_ids.append(user_id)
 
-        # Fetch posts from users that the current user is following with pagination
-        posts_query = db.collection('posts').where('userId', 'in', following_ids).order_by('timestamp', direction=firestore.Query.DESCENDING).limit(limit)
+    # Serve repeated requests for the same page from the feed cache
+    use_cache = start_after is None
+    if use_cache:
+        cached_page = feed_cache.get(user_id, cursor, limit)
+        if cached_page is not None:
+            posts, next_cursor = cached_page
+            set_next_cursor(response, next_cursor)
+            return without_deleted_authors(posts, include_authors)
 
-        # If start_after is provided, add it to the query
-        if start_after:
-            start_after_doc = db.collection('posts').document(start_after).get()
-            if start_after_doc.exists:
-                posts_query = posts_query.start_after(start_after_doc)
-            else:
-                raise HTTPException(status_code=404, detail="Start after post not found")
-
-        posts_docs = posts_query.stream()
+    try:
+        # Resolve where the page starts, which needs no read when a cursor is given
+        position = resolve_start_position(cursor, start_after, db.collection('posts'), "Start after post not found")
+
+        if FANOUT_ON_WRITE:
+            # Read the page straight from the user's materialized timeline
+            posts_docs, next_cursor = fetch_timeline_page(user_id, limit, position)
+        else:
+            # Take the current user's (usually cached) following set
+            following_ids = list(following_sets.get(user_id))
+
+            # Add the current user's ID to the list of IDs to include their own posts
+            following_ids.append(user_id)
+
+            # Fetch posts from users that the current user is following with pagination,
+            # merging chunked queries so that any number of followed users is supported
+            posts_docs = fetch_merged_page(following_ids, limit, position)
+            next_cursor = cursor_for_page(posts_docs, limit)
+
+        set_next_cursor(response, next_cursor)
+
+        # Skip posts that were deleted but not yet swept, after the cursor is taken so paging is unaffected
+        posts_docs = [post for post in posts_docs if not is_tombstoned(post)]
+
+        # Resolve the like state and the sharded counts for the whole page concurrently
+        liked_ids, counts = run_concurrently([
+            lambda: get_liked_ids([post.reference for post in posts_docs], user_id),
+            lambda: counters.get_totals(posts_docs, ('likes_count', 'comments_count')),
+        ])
         posts = []
 
         # Convert each post document to a PostModel object and add it to the list of posts
         for post in posts_docs:
             post_data = post.to_dict()
-            is_liked = db.collection('posts').document(post.id).collection('likes').document(user_id).get().exists
             posts.append(PostModel(
                 id=post.id,
                 userId=post_data['userId'],
                 content=post_data['content'],
                 timestamp=post_data['timestamp'],
-                likes_count=post_data.get('likes_count', 0),
-                comments_count=post_data.get('comments_count', 0),  # Add comments_count
-                isLikedByUser=is_liked
+                likes_count=counts[post.id]['likes_count'],
+                comments_count=counts[post.id]['comments_count'],
+                isLikedByUser=post.id in liked_ids
             ))
-        return posts
+
+        if use_cache:
+            feed_cache.put(user_id, cursor, limit, posts, next_cursor)
+
+        # Hide the posts of deleted users, which stay in timelines until the sweeper reaches them.
+        # This and the authors are applied after caching, so the cached page never holds stale profiles.
+        return without_deleted_authors(posts, include_authors)
+
+    except HTTPException:
+        raise
 
     except Exception as e:
         # Handle any unexpected errors and return an appropriate response
@@ -290,11 +330,22 @@ async def get_posts(
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
+@post_router.get("/posts/feed_cache/stats")
+def get_feed_cache_stats(user_id: str = Depends(get_current_user_id)) -> dict:
+    """
+    Endpoint to return the hit/miss metrics of the home feed cache
+    """
+    return feed_cache.stats()
+
+
 @post_router.get("/posts/user", response_model=List[PostModel])
-async def get_user_posts(
+def get_user_posts(
+    response: Response,
     user_id: str = Query(..., description="ID of the user whose posts to fetch"),
     limit: int = Query(10, description="Limit the number of posts returned"), 
-    start_after: Optional[str] = Query(None, description="Start after this post ID"),
+    cursor: Optional[str] = Query(None, description="Cursor returned in the X-Next-Cursor header of the previous page"),
+    start_after: Optional[str] = Query(None, description="Start after this post ID", deprecated=True),
+    include_authors: bool = Query(False, description="Embed the author's username, name and profile image in each post"),
     current_user_id: str = Depends(get_current_user_id)
 ) -> List[PostModel]:
     """
@@ -302,146 +353,178 @@ async def get_user_posts(
     """
     print("Request received at /posts/user")
     try:
-        # Fetch the specified user's data
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
+        # Resolve where the page starts, which needs no read when a cursor is given
+        position = resolve_start_position(cursor, start_after, db.collection('posts'), "Start after post not found")
+
+        # Fetch posts for the specified user with pagination
+        posts_query = order_newest_first(db.collection('posts').where('userId', '==', user_id), position).limit(limit)
+
+        # Fetch the specified user's (usually cached) profile and the page of posts concurrently
+        profile, posts_docs = run_concurrently([
+            lambda: get_profile(user_id),
+            lambda: list(posts_query.stream()),
+        ])
 
-        # Handle the case that the user does not exist
-        if not user_doc.exists:
+        # Handle the case that the user does not exist or was deleted
+        if profile is None:
             raise HTTPException(status_code=404, detail="User not found")
 
-        # Fetch posts for the specified user with pagination
-        posts_query = db.collection('posts').where('userId', '==', user_id).order_by('timestamp', direction=firestore.Query.DESCENDING).limit(limit)
+        set_next_cursor(response, cursor_for_page(posts_docs, limit))
 
-        # If start_after is provided, add it to the query
-        if start_after:
-            start_after_doc = db.collection('posts').document(start_after).get()
-            if start_after_doc.exists:
-                posts_query = posts_query.start_after(start_after_doc)
-            else:
-                raise HTTPException(status_code=404, detail="Start after post not found")
+        # Skip posts that were deleted but not yet swept
+        posts_docs = [post for post in posts_docs if not is_tombstoned(post)]
 
-        posts_docs = posts_query.stream()
+        # Resolve the like state and the sharded counts for the whole page concurrently
+        liked_ids, counts = run_concurrently([
+            lambda: get_liked_ids([post.reference for post in posts_docs], current_user_id),
+            lambda: counters.get_totals(posts_docs, ('likes_count', 'comments_count')),
+        ])
         posts = []
 
         # Convert each post document to a PostModel object and add it to the list of posts
         for post in posts_docs:
             post_data = post.to_dict()
-            is_liked = db.collection('posts').document(post.id).collection('likes').document(current_user_id).get().exists
             posts.append(PostModel(
                 id=post.id, 
                 userId=post_data['userId'], 
                 content=post_data['content'], 
                 timestamp=post_data['timestamp'],
-                likes_count=post_data.get('likes_count', 0),
-                comments_count=post_data.get('comments_count', 0),  # Add comments_count
-                isLikedByUser=is_liked
+                likes_count=counts[post.id]['likes_count'],
+                comments_count=counts[post.id]['comments_count'],
+                isLikedByUser=post.id in liked_ids
             ))
+
+        # Every post has the same author, whose profile is already at hand
+        if include_authors:
+            author = author_snippet(profile)
+            for post in posts:
+                post.author = author
         return posts
 
+    except HTTPException:
+        raise
+
     except Exception as e:
         # Handle any unexpected errors and return an appropriate response
         print(f"An error occurred: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
-def increment_likes(post_ref, user_id):
+def increment_likes(batch, post_ref, user_id, post_snapshot=None):
     """
-    Helper function to increment likes and add like document
+    Helper function to add the writes that increment likes and add the like document to a batch or transaction
     """
-    try:
-        # Update the likes count of the post
-        post_snapshot = post_ref.get()
-        likes_count = post_snapshot.get('likes_count') + 1
-        post_ref.update({'likes_count': likes_count})
-
-        # Add the like by creating a document in the likes subcollection
-        likes_ref = post_ref.collection('likes').document(user_id)
-        likes_ref.set({'liked_at': datetime.now()})
+    # Update the likes count of the post, on one of its counter shards if the snapshot shows it is sharded
+    counters.increment(post_ref, 'likes_count', 1, batch, post_snapshot)
 
-        # Add the post to the user's liked posts subcollection
-        user_liked_posts_ref = db.collection('users').document(user_id).collection('likedPosts').document(post_ref.id)
-        user_liked_posts_ref.set({'liked_at': datetime.now()})
+    # Add the like by creating a document in the likes subcollection
+    likes_ref = post_ref.collection('likes').document(user_id)
+    batch.set(likes_ref, {'liked_at': datetime.now()})
 
-        print("Likes incremented successfully")
+    # Add the post to the user's liked posts subcollection
+    user_liked_posts_ref = db.collection('users').document(user_id).collection('likedPosts').document(post_ref.id)
+    batch.set(user_liked_posts_ref, {'liked_at': datetime.now()})
 
-    except Exception as e:
-        print(f"Failed to increment likes: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to increment likes: {e}")
 
-@post_router.post("/posts/like/{post_id}", status_code=status.HTTP_200_OK)
-async def like_post(post_id: str, user_id: str = Depends(get_current_user_id)):
+@firestore.transactional
+def like_post_in_transaction(transaction, post_ref, user_id):
     """
-    Endpoint to like a post
+    Helper function to check and record a like in one transaction, so concurrent requests cannot double count it
     """
-    post_ref = db.collection('posts').document(post_id)
-    post_snapshot = post_ref.get()
+    # Read the post and the user's like document together
+    likes_ref = post_ref.collection('likes').document(user_id)
+    snapshots = {snapshot.reference.path: snapshot for snapshot in transaction.get_all([post_ref, likes_ref])}
 
-    if not post_snapshot.exists:
+    post_snapshot = snapshots[post_ref.path]
+    if not post_snapshot.exists or is_tombstoned(post_snapshot):
         raise HTTPException(status_code=404, detail="Post not found")
 
-    likes_ref = post_ref.collection('likes').document(user_id)
-    if likes_ref.get().exists:
+    if snapshots[likes_ref.path].exists:
         raise HTTPException(status_code=400, detail="Post already liked by user")
 
+    increment_likes(transaction, post_ref, user_id, post_snapshot)
+
+
+@post_router.post("/posts/like/{post_id}", status_code=status.HTTP_200_OK)
+def like_post(post_id: str, user_id: str = Depends(get_current_user_id)):
+    """
+    Endpoint to like a post
+    """
+    post_ref = db.collection('posts').document(post_id)
+
     try:
         # Increment the likes count and add the like
-        increment_likes(post_ref, user_id)
-        
+        like_post_in_transaction(db.transaction(), post_ref, user_id)
+
+    except HTTPException:
+        raise
+
     except Exception as e:
         # Log the exception for debugging
         print(f"Failed to like post: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to like post: {e}")
 
+    # Patch the like into the cached counts and any cached feed pages
+    counters.note_increment(post_ref, 'likes_count', 1)
+    feed_cache.apply_like(post_id, user_id, True)
+
     return {"message": "Post liked successfully"}
 
-def decrement_likes(post_ref, user_id):
+def decrement_likes(batch, post_ref, user_id, post_snapshot=None):
     """
-    Helper function to decrement likes and delete like document
+    Helper function to add the writes that decrement likes and delete the like document to a batch or transaction
     """
-    try:
-        # Update the likes count of the post
-        post_snapshot = post_ref.get()
-        likes_count = post_snapshot.get('likes_count') - 1
-        if likes_count < 0:
-            likes_count = 0  # Ensure likes_count doesn't go negative
-        post_ref.update({'likes_count': likes_count})
-
-        # Remove the like document from the likes subcollection
-        likes_ref = post_ref.collection('likes').document(user_id)
-        likes_ref.delete()
-
-        # Remove the post from the user's liked posts subcollection
-        user_liked_posts_ref = db.collection('users').document(user_id).collection('likedPosts').document(post_ref.id)
-        user_liked_posts_ref.delete()
-        
-        print("Likes decremented successfully")
+    # Update the likes count of the post, on one of its counter shards if the snapshot shows it is sharded
+    counters.increment(post_ref, 'likes_count', -1, batch, post_snapshot)
 
-    except Exception as e:
-        print(f"Failed to decrement likes: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to decrement likes: {e}")
+    # Remove the like document from the likes subcollection
+    likes_ref = post_ref.collection('likes').document(user_id)
+    batch.delete(likes_ref)
 
-@post_router.post("/posts/unlike/{post_id}", status_code=status.HTTP_200_OK)
-async def unlike_post(post_id: str, user_id: str = Depends(get_current_user_id)):
+    # Remove the post from the user's liked posts subcollection
+    user_liked_posts_ref = db.collection('users').document(user_id).collection('likedPosts').document(post_ref.id)
+    batch.delete(user_liked_posts_ref)
+
+
+@firestore.transactional
+def unlike_post_in_transaction(transaction, post_ref, user_id):
     """
-    Endpoint to unlike a post
+    Helper function to check and remove a like in one transaction, so concurrent requests cannot double count it
     """
-    post_ref = db.collection('posts').document(post_id)
-    post_snapshot = post_ref.get()
+    # Read the post and the user's like document together
+    likes_ref = post_ref.collection('likes').document(user_id)
+    snapshots = {snapshot.reference.path: snapshot for snapshot in transaction.get_all([post_ref, likes_ref])}
 
+    post_snapshot = snapshots[post_ref.path]
     if not post_snapshot.exists:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    likes_ref = post_ref.collection('likes').document(user_id)
-    if not likes_ref.get().exists:
+    if not snapshots[likes_ref.path].exists:
         raise HTTPException(status_code=400, detail="Post not liked by user")
 
+    decrement_likes(transaction, post_ref, user_id, post_snapshot)
+
+
+@post_router.post("/posts/unlike/{post_id}", status_code=status.HTTP_200_OK)
+def unlike_post(post_id: str, user_id: str = Depends(get_current_user_id)):
+    """
+    Endpoint to unlike a post
+    """
+    post_ref = db.collection('posts').document(post_id)
+
     try:
         # Decrement the likes count and remove the like
-        decrement_likes(post_ref, user_id)
-        
+        unlike_post_in_transaction(db.transaction(), post_ref, user_id)
+
+    except HTTPException:
+        raise
+
     except Exception as e:
         # Log the exception for debugging
         print(f"Failed to unlike post: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to unlike post: {e}")
 
+    # Patch the unlike into the cached counts and any cached feed pages
+    counters.note_increment(post_ref, 'likes_count', -1)
+    feed_cache.apply_like(post_id, user_id, False)
+
     return {"message": "Post unliked successfully"}
@@ -1,159 +1,347 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from typing import List
-import yfinance as yf
+import asyncio
+import json
+from datetime import datetime
+import pytz
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import List, Optional
 from models.stock_models import StockListCreateRequest, StockListUpdateRequest, StockModel
 from routers.user_interactions import get_current_user_id
 from firebase_configuration import db
+from firebase_admin import firestore
+from services import hot_tickers
+from services.price_history import price_history
+from services.price_stream import price_broadcaster
+from services.profile_cache import get_stock_lists, profile_cache
+from services.quotes import quote_cache
+from services.stock_analytics import list_analytics
+from services.stock_lists import read_stock_lists_for_write, write_stock_lists
+from services.ticker_index import is_symbol_shaped, ticker_index
 
 # Create a router for the stock related requests
 stock_router = APIRouter()
 
 @stock_router.get("/search/stocks", response_model=List[StockModel])
-async def search_stock(ticker: str):
+def search_stock(
+    ticker: str,
+    limit: int = Query(5, ge=1, le=20, description="Maximum number of results to return")
+):
     """
-    Endpoint to retrieve stock information.
-    Currently, it can only look for a single stock ticker.
-    May be able to get around this if you make sure that the search query whenever the user changes the text they input.
+    Endpoint to search for stocks by ticker symbol or company name.
+    The client calls this on every keystroke, so matches come from the in-memory ticker index,
+    and prices are only fetched for the returned results.
     """
+    matches = ticker_index.search(ticker, limit)
+
+    # Only a symbol-shaped query that matches nothing in the listing is looked up upstream, at most once per
+    # symbol while it stays unknown, and concurrent lookups of the same symbol share one fetch in the quote cache
+    query_symbol = ticker.strip().upper()
+    lookup_symbol = not matches and is_symbol_shaped(query_symbol) and not ticker_index.is_unknown(query_symbol)
+
     try:
-        stock_ticker = yf.Ticker(ticker)
-        info = stock_ticker.info
-        
-        # # Print info to debug
-        # print(f"Stock info for {ticker}: {info}")
-        
-        # Attempt to retrieve price from multiple possible fields
-        price = info.get('currentPrice') or info.get('previousClose') or info.get('lastClose', 0.0)
-        
-        if price == 0.0:
-            print(f"Price not found for {ticker}, info: {info}")
-        
-        stock = StockModel(
-            symbol=info.get('symbol', 'N/A'),
-            name=info.get('shortName', 'N/A'),
-            price=price
-        )
-        
-        return [stock]
+        if lookup_symbol:
+            quote = quote_cache.get_many([query_symbol])[query_symbol]
+            if quote is None or quote.symbol == 'N/A':
+                # Only remember an answer from the upstream, not a failed fetch
+                if quote is not None:
+                    ticker_index.mark_unknown(query_symbol)
+                raise KeyError(ticker)
+
+            # Remember the confirmed symbol, so the next search finds it in the index
+            ticker_index.add(quote.symbol, quote.name)
+            matches = [(quote.symbol, quote.name)]
+            quotes = {quote.symbol: quote}
+        elif not matches:
+            raise KeyError(ticker)
+        else:
+            quotes = quote_cache.get_many([symbol for symbol, _ in matches])
+
+        return [
+            StockModel(symbol=symbol, name=name, price=quotes[symbol].price if quotes[symbol] is not None else 0.0)
+            for symbol, name in matches
+        ]
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"Stock not found: {e}")
 
 
 @stock_router.get("/stock/info/{ticker}")
-async def get_stock_info(ticker: str):
+def get_stock_info(ticker: str):
     """
     Endpoint to return detailed stock information for a given ticker
     """
     try:
-        # Fetch stock info using yfinance
-        stock_ticker = yf.Ticker(ticker)
-        info = stock_ticker.info
-        
-        # Extract required statistics
-        required_info = {
-            "current_price": info.get("currentPrice"),
-            "open_price": info.get("open"),
-            "volume": info.get("volume"),
-            "high": info.get("dayHigh"),
-            "low": info.get("dayLow"),
-            "market_cap": info.get("marketCap"),
-            "average_volume": info.get("averageVolume"),
-            "52_week_high": info.get("fiftyTwoWeekHigh"),
-            "52_week_low": info.get("fiftyTwoWeekLow"),
-            "pe_ratio": info.get("trailingPE"),
-            "overnight_volume": info.get("regularMarketVolume"),
-            "description": info.get("longBusinessSummary"),
-            "price": info.get('currentPrice') or info.get('previousClose') or info.get('lastClose', 0.0)
-        }
-        return required_info
+        # Fetch stock info through the quote cache and extract required statistics
+        return quote_cache.get(ticker).to_info()
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"Stock data not found: {e}")
 
 
 @stock_router.get("/stock/prices")
-async def get_stock_prices(tickers: List[str] = Query(...)):
+def get_stock_prices(tickers: List[str] = Query(...)):
     """
     Endpoint to return the prices of a given list of stock tickers
     """
+    # Fetch all of the stock prices through the quote cache at once, so that
+    # one unknown or failing ticker does not fail the whole list
+    quotes = quote_cache.get_many(tickers)
+    return {ticker: quote.price if quote is not None else 0.0 for ticker, quote in quotes.items()}
+
+
+@stock_router.get("/stock/quote_cache/stats")
+def get_quote_cache_stats(user_id: str = Depends(get_current_user_id)) -> dict:
+    """
+    Endpoint to return the hit/miss metrics of the quote cache
+    """
+    return quote_cache.stats()
+
+
+@stock_router.get("/stock/hot_tickers/stats")
+def get_hot_ticker_stats(user_id: str = Depends(get_current_user_id)) -> dict:
+    """
+    Endpoint to return the metrics of the background hot-ticker refresher
+    """
+    return hot_tickers.stats()
+
+
+def to_epoch_seconds(moment: Optional[datetime]) -> Optional[int]:
+    """
+    Helper function to convert a query datetime to epoch seconds, treating naive datetimes as UTC
+    """
+    if moment is None:
+        return None
+    if moment.tzinfo is None:
+        moment = pytz.UTC.localize(moment)
+    return int(moment.timestamp())
+
+
+@stock_router.get("/stock/history/{ticker}")
+def get_stock_history(
+    ticker: str,
+    start: Optional[datetime] = Query(None, description="Earliest bar to return"),
+    end: Optional[datetime] = Query(None, description="Latest bar to return"),
+    points: Optional[int] = Query(None, ge=2, le=10000, description="Maximum number of bars, evenly spaced over the range")
+):
+    """
+    Endpoint to return the daily OHLCV bars of a ticker as columns, with timestamps in epoch seconds
+    """
     try:
-        prices = {}
-        for ticker in tickers:
-            # Fetch stock info using yfinance
-            stock_ticker = yf.Ticker(ticker)
-            info = stock_ticker.info
-            # print(f'yfinance.Ticker object <{ticker}>')
-            # print(info)
-            prices[ticker] = info.get('currentPrice') or info.get('previousClose') or info.get('lastClose', 0.0)
-        return prices
+        history = price_history.get(ticker)
     except Exception as e:
-        raise HTTPException(status_code=404, detail=f"Stock data not found: {e}")
+        raise HTTPException(status_code=404, detail=f"Stock history not found: {e}")
+
+    # Slice the memory-mapped columns, which only copies when the response is serialized
+    bars = history.view(to_epoch_seconds(start), to_epoch_seconds(end), points)
+    content = {'ticker': ticker.upper()}
+    content.update((name, column.tolist()) for name, column in bars.items())
+
+    # The columns are plain lists of numbers, so skip FastAPI's per-item encoding
+    return JSONResponse(content=content)
+
+
+# Seconds between keep-alive comments on an idle price stream
+STREAM_HEARTBEAT_SECONDS = 15
+
+
+def get_stock_list_tickers(user_id: str) -> List[str]:
+    """
+    Helper function to return the tickers across all of a user's stock lists
+    """
+    tickers = set()
+    for list_tickers in get_stock_lists(user_id).values():
+        tickers.update(list_tickers)
+    return sorted(tickers)
+
+
+@stock_router.get("/stock/stream")
+async def stream_stock_prices(
+    request: Request,
+    tickers: Optional[List[str]] = Query(None, description="Tickers to watch, defaulting to those in the user's stock lists"),
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    Endpoint to stream live prices as Server-Sent Events.
+    The first event holds the current price of every ticker, and each later event only holds the prices that changed.
+    """
+    if tickers is None:
+        # Reading the stock lists blocks, so run it off the event loop
+        tickers = await run_in_threadpool(get_stock_list_tickers, user_id)
+
+    async def events():
+        subscription = await price_broadcaster.subscribe(tickers)
+        try:
+            while not await request.is_disconnected():
+                try:
+                    await asyncio.wait_for(subscription.event.wait(), timeout=STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Keep proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+
+                delta = price_broadcaster.take(subscription)
+                if delta:
+                    yield f"data: {json.dumps(delta)}\n\n"
+        finally:
+            price_broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@stock_router.get("/stock/stream/stats")
+async def get_stream_stats(user_id: str = Depends(get_current_user_id)) -> dict:
+    """
+    Endpoint to return the connection and fan-out metrics of the price stream.
+    This runs on the event loop, which is where the stream's state lives.
+    """
+    return price_broadcaster.stats()
+
+
+@stock_router.get("/stock/stockLists/analytics/{list_name}")
+def get_stock_list_analytics(
+    list_name: str,
+    days: int = Query(252, ge=2, le=2520, description="Number of trading days to analyze"),
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    Endpoint to return the returns, annualized volatility, maximum drawdown and return correlations
+    of the tickers in one of the user's stock lists, along with those of an equal-weight portfolio of them
+    """
+    # Find the stock list with the specified name among the user's (usually cached) lists
+    tickers = get_stock_lists(user_id).get(list_name)
+    if tickers is None:
+        raise HTTPException(status_code=404, detail="Stock list not found")
+
+    try:
+        return list_analytics(user_id, list_name, tickers, days)
+    except Exception as e:
+        print(f"Failed to compute stock list analytics: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+def validate_tickers(tickers: List[str]) -> None:
+    """
+    Helper function to reject tickers that are neither in the ticker index nor known to the upstream
+    """
+    unknown = [ticker for ticker in tickers if not ticker_index.is_known(ticker)]
+    if not unknown:
+        return
+
+    # Check the symbols missing from the listing against the upstream, unless it recently did not know them,
+    # and remember the answers
+    invalid = [ticker for ticker in unknown if ticker_index.is_unknown(ticker)]
+    unchecked = [ticker for ticker in unknown if ticker not in invalid]
+    for ticker, quote in quote_cache.get_many(unchecked).items():
+        if quote is None or quote.symbol == 'N/A':
+            if quote is not None:
+                ticker_index.mark_unknown(ticker)
+            invalid.append(ticker)
+        else:
+            ticker_index.add(ticker, quote.name)
+
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Unknown tickers: {', '.join(invalid)}")
+
+
+@firestore.transactional
+def change_stock_lists_in_transaction(transaction, user_ref, changes, required_list: Optional[str] = None) -> bool:
+    """
+    Helper function to apply changes of list name -> tickers, or None to delete the list, in one transaction.
+    Returns False without writing if required_list is given and the user has no list with that name.
+    """
+    stock_lists, legacy_docs = read_stock_lists_for_write(transaction, user_ref)
+    if stock_lists is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    if required_list is not None and required_list not in stock_lists:
+        return False
+
+    write_stock_lists(transaction, user_ref, stock_lists, legacy_docs, changes)
+    return True
 
 
 @stock_router.delete("/stock/stockLists/delete/{list_name}", status_code=204)
-async def delete_stock_list(list_name: str, user_id: str = Depends(get_current_user_id)):
+def delete_stock_list(list_name: str, user_id: str = Depends(get_current_user_id)):
     """
     Endpoint to delete a stock list from a user's document
     """
     try:
         print(list_name)
-        # Reference to the user's stockLists subcollection
-        stocklists_ref = db.collection('users').document(user_id).collection('stockLists')
+        # Reference to the user document, which holds the stock lists
+        user_ref = db.collection('users').document(user_id)
 
-        # Query to find the stock list document with the specified name
-        query = stocklists_ref.where('name', '==', list_name).stream()
+        # Remove the list's field from the user document
+        change_stock_lists_in_transaction(db.transaction(), user_ref, {list_name: None})
 
-        # Iterate over the query results and delete the matching document
-        for doc in query:
-            doc.reference.delete()
+        # Remove the list from the cached stock lists
+        profile_cache.remove_stock_list(user_id, list_name)
 
         return
 
+    except HTTPException:
+        raise
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @stock_router.put("/stock/stockLists/update/{list_name}")
-async def update_stock_list(list_name: str, request: StockListUpdateRequest, user_id: str = Depends(get_current_user_id)):
+def update_stock_list(list_name: str, request: StockListUpdateRequest, user_id: str = Depends(get_current_user_id)):
     """
     Endpoint to update a stock list for a user
     """
+    if not request.name:
+        raise HTTPException(status_code=400, detail="Stock list name is required")
+    validate_tickers(request.tickers)
+
     try:
-        # Reference to the user's stockLists subcollection
-        stocklists_ref = db.collection('users').document(user_id).collection('stockLists')
+        # Reference to the user document, which holds the stock lists
+        user_ref = db.collection('users').document(user_id)
 
-        # Query to find the stock list document with the specified name
-        query = stocklists_ref.where('name', '==', list_name).stream()
+        # Replace the list's field, moving it to a new field when the list is renamed
+        updated = change_stock_lists_in_transaction(
+            db.transaction(), user_ref, {list_name: None, request.name: request.tickers}, required_list=list_name
+        )
 
-        # Update the first matching document with new data
-        for doc in query:
-            doc.reference.update({
-                'name': request.name,
-                'tickers': request.tickers,
-            })
+        # Patch the cached stock lists with the renamed or edited list
+        if updated:
+            profile_cache.set_stock_list(user_id, request.name, request.tickers, replaces=list_name)
 
         return
 
+    except HTTPException:
+        raise
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @stock_router.post("/stock/stockLists/create")
-async def create_stock_list(request: StockListCreateRequest, user_id: str = Depends(get_current_user_id)):
+def create_stock_list(request: StockListCreateRequest, user_id: str = Depends(get_current_user_id)):
     """
     Endpoint to create a new stock list for a user
     """
+    if not request.name:
+        raise HTTPException(status_code=400, detail="Stock list name is required")
+    validate_tickers(request.tickers)
+
     try:
-        # Reference to the user's stockLists subcollection
-        stocklists_ref = db.collection('users').document(user_id).collection('stockLists')
+        # Reference to the user document, which holds the stock lists
+        user_ref = db.collection('users').document(user_id)
+
+        # Add the new list's field, replacing any list with the same name
+        change_stock_lists_in_transaction(db.transaction(), user_ref, {request.name: request.tickers})
 
-        # Add new stock list document
-        stocklists_ref.add({
-            'name': request.name,
-            'tickers': request.tickers,
-        })
+        # Add the new list to the cached stock lists
+        profile_cache.set_stock_list(user_id, request.name, request.tickers)
 
         return {"message": "Stock list created successfully"}
 
+    except HTTPException:
+        raise
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-
@@ -1,16 +1,39 @@
 from typing import List
 from fastapi import APIRouter, Body, Depends, HTTPException, Header, Path, Query
 from firebase_configuration import db
-from firebase_admin import firestore
+from firebase_admin import auth, firestore
 from models.user_models import UpdateUserModel, UserModel, CreateUserModel
 from routers.user_interactions import get_current_user_id
+from services.feed_cache import feed_cache
+from services.follow_graph import follower_sets, following_sets
+from services.profile_cache import profile_cache
+from services.stock_lists import STOCK_LISTS_FIELD
+from services.tombstones import is_tombstoned, tombstone
+from services.token_cache import token_cache
+from services.username_index import normalize_username, username_index
+from services.username_reservations import is_username_available, reservation_data, reservation_ref
 
 # Create a router for the user account related requests
 user_account_router = APIRouter()
 
 
+@firestore.transactional
+def create_user_in_transaction(transaction, user_ref, user_data):
+    """
+    Helper function to reserve the username and create the user in one transaction,
+    so two signups can never end up with the same username
+    """
+    username_ref = reservation_ref(user_data['username'])
+    reservation = username_ref.get(transaction=transaction)
+    if reservation.exists and reservation.get('userId') != user_ref.id:
+        raise HTTPException(status_code=409, detail="Username is already taken")
+
+    transaction.set(username_ref, reservation_data(user_data['username'], user_ref.id))
+    transaction.set(user_ref, user_data)
+
+
 @user_account_router.post("/user/create", response_model=UserModel)
-async def create_user(
+def create_user(
     user: CreateUserModel, 
     user_id: str = Depends(get_current_user_id)
 ) -> UserModel:
@@ -34,19 +57,28 @@ async def create_user(
         # Log user data before saving
         print(f'User data to be saved: {user_data}')
 
-        # Save the user data to the database
+        # Initialize the stock lists on the user document with the default list
         user_ref = db.collection('users').document(user_id)
-        user_ref.set(user_data)
-
-        # Initialize the stockLists subcollection with the default list
-        default_stock_list = {
-            'name': 'First List',
-            'tickers': ["AAPL", "MSFT", "TSLA", "AMZN", "NVDA"]
+        user_data[STOCK_LISTS_FIELD] = {
+            'First List': ["AAPL", "MSFT", "TSLA", "AMZN", "NVDA"]
         }
-        user_ref.collection('stockLists').add(default_stock_list)
 
-        # Return the newly created user data
-        return UserModel(**user_data)
+        # Save the user data, with the default list, and the username reservation to the database together
+        create_user_in_transaction(db.transaction(), user_ref, user_data)
+
+        # Make the new user searchable
+        username_index.add(user_id, user_data['username'])
+
+        # Cache the new profile and its default list, which the app reads right after signing up
+        new_user = UserModel(**user_data)
+        profile_cache.put_profile(user_id, new_user)
+        profile_cache.put_stock_lists(user_id, user_data[STOCK_LISTS_FIELD])
+
+        # Return the newly created user data, without the stock lists as before
+        return new_user.model_copy(update={'stockLists': None})
+
+    except HTTPException:
+        raise
 
     except Exception as e:
         # Handle any unexpected errors
@@ -55,26 +87,63 @@ async def create_user(
     
 
 @user_account_router.post("/user/usernameAvailability")
-async def username_availability(
+def username_availability(
     username: str = Body(..., embed=True)
 ) -> dict:
     """
     Endpoint to check the availability of a username
     """
     try:
-        # Check if username is already taken
-        username_query = db.collection('users').where('username', '==', username).get()
-        if username_query:
-            return {"available": False}
-        else:
-            return {"available": True}
+        # Check if username is already taken, which usually needs no Firestore read
+        return {"available": is_username_available(username)}
     except Exception as e:
         print(f'Error occurred while checking username availability: {e}')
         raise HTTPException(status_code=500, detail="Failed to check username availability: {}".format(str(e)))
 
 
+@firestore.transactional
+def update_user_in_transaction(transaction, user_ref, user_data) -> dict:
+    """
+    Helper function to update the user and move their username reservation in one transaction.
+    Returns the updated user data.
+    """
+    new_username_ref = reservation_ref(user_data['username'])
+
+    # Read the user first, to find the reservation of their current username
+    user_doc = user_ref.get(transaction=transaction)
+    if not user_doc.exists:
+        raise HTTPException(status_code=404, detail="User not found")
+    current_username = user_doc.to_dict().get('username', '')
+
+    if normalize_username(current_username) != normalize_username(user_data['username']):
+        old_username_ref = reservation_ref(current_username)
+        snapshots = {
+            snapshot.reference.path: snapshot
+            for snapshot in transaction.get_all([old_username_ref, new_username_ref])
+        }
+
+        new_reservation = snapshots[new_username_ref.path]
+        if new_reservation.exists and new_reservation.get('userId') != user_ref.id:
+            raise HTTPException(status_code=409, detail="Username is already taken")
+
+        # Release the old username only if it is reserved by this user
+        old_reservation = snapshots[old_username_ref.path]
+        if old_reservation.exists and old_reservation.get('userId') == user_ref.id:
+            transaction.delete(old_username_ref)
+        transaction.set(new_username_ref, reservation_data(user_data['username'], user_ref.id))
+
+    transaction.update(user_ref, user_data)
+
+    updated_user = user_doc.to_dict()
+    updated_user.update(user_data)
+
+    # The stock lists stored on the user document are not part of this response
+    updated_user.pop(STOCK_LISTS_FIELD, None)
+    return updated_user
+
+
 @user_account_router.put("/user/update", response_model=UserModel)
-async def update_user(
+def update_user(
     user: UpdateUserModel, 
     user_id: str = Depends(get_current_user_id), 
 ) -> UserModel:
@@ -85,16 +154,22 @@ async def update_user(
         # Reference to the user document
         user_ref = db.collection('users').document(user_id)
 
-        # Update the user data
+        # Update the user data, and move the username reservation if it changed
         user_data = user.model_dump()
+        updated_user = update_user_in_transaction(db.transaction(), user_ref, user_data)
 
-        user_ref.update(user_data)
+        # Keep user search in step with a changed username
+        username_index.add(user_id, updated_user['username'])
 
-        # Fetch the updated user data
-        updated_user = user_ref.get().to_dict()
+        # Write the updated profile through to the cache
+        updated_profile = UserModel(**updated_user)
+        profile_cache.put_profile(user_id, updated_profile)
         
         # Return the updated user data
-        return UserModel(**updated_user)
+        return updated_profile
+
+    except HTTPException:
+        raise
 
     except Exception as e:
         # Handle any unexpected errors
@@ -103,123 +178,60 @@ async def update_user(
 
 
 @user_account_router.delete("/user/delete")
-async def delete_user(user_id: str = Depends(get_current_user_id)):
+def delete_user(user_id: str = Depends(get_current_user_id)):
     """
     Endpoint to delete a user and all of their content on the app
     """
     try:
-        # Start a Firestore batch
-        batch = db.batch()
-
         # Get user document and check if it exists
         user_ref = db.collection('users').document(user_id)
         user_doc = user_ref.get()
 
-        if not user_doc.exists:
+        if not user_doc.exists or is_tombstoned(user_doc):
             raise HTTPException(status_code=404, detail="User not found")
-        
-        # Handle followers
-        followers_ref = user_ref.collection('followers')
-        followers = followers_ref.stream()
-        for follower in followers:
-            follower_ref = db.collection('users').document(follower.id).collection('following').document(user_id)
-            batch.delete(follower_ref)
-            follower_user_ref = db.collection('users').document(follower.id)
-            batch.update(follower_user_ref, {'following_count': firestore.Increment(-1)})
-            batch.delete(follower.reference)
-
-        # Handle following
-        following_ref = user_ref.collection('following')
-        following = following_ref.stream()
-        for followed_user in following:
-            followed_user_ref = db.collection('users').document(followed_user.id).collection('followers').document(user_id)
-            batch.delete(followed_user_ref)
-            target_user_ref = db.collection('users').document(followed_user.id)
-            batch.update(target_user_ref, {'followers_count': firestore.Increment(-1)})
-            batch.delete(followed_user.reference)
-
-        # Delete user's posts and related data
-        posts_ref = db.collection('posts').where('userId', '==', user_id)
-        posts = posts_ref.stream()
-
-        for post in posts:
-            post_ref = post.reference
-
-            # Delete post's likes and remove from users' likedPosts subcollections
-            post_likes_ref = post_ref.collection('likes')
-            post_likes = post_likes_ref.stream()
-
-            for post_like in post_likes:
-                user_like_id = post_like.id
-                user_like_ref = db.collection('users').document(user_like_id).collection('likedPosts').document(post_ref.id)
-                batch.delete(user_like_ref)
-                batch.delete(post_like.reference)
-
-            # Delete post's comments and their likes, and remove from users' commentedPosts subcollections
-            comments_ref = post_ref.collection('comments')
-            comments = comments_ref.stream()
-
-            for comment in comments:
-                comment_ref = comment.reference
-
-                # Delete comment's likes and remove from users' likedComments subcollections
-                comment_likes_ref = comment_ref.collection('likes')
-                comment_likes = comment_likes_ref.stream()
-
-                for comment_like in comment_likes:
-                    user_like_id = comment_like.id
-                    user_like_ref = db.collection('users').document(user_like_id).collection('likedComments').document(comment_ref.id)
-                    batch.delete(user_like_ref)
-                    batch.delete(comment_like.reference)
-
-                # Remove the comment from the user's commentedPosts subcollection
-                comment_data = comment.to_dict()
-                comment_user_id = comment_data['userId']
-                user_commented_ref = db.collection('users').document(comment_user_id).collection('commentedPosts').document(post_ref.id)
-                batch.delete(user_commented_ref)
-
-                # Delete the comment document
-                batch.delete(comment_ref)
-
-            # Delete the post document
-            batch.delete(post_ref)
-
-        # Delete user's likes from posts and comments
-        liked_posts_ref = user_ref.collection('likedPosts')
-        liked_posts = liked_posts_ref.stream()
-
-        for liked_post in liked_posts:
-            liked_post_id = liked_post.id
-            post_ref = db.collection('posts').document(liked_post_id).collection('likes').document(user_id)
-            batch.delete(post_ref)
-            batch.delete(liked_post.reference)
-
-        liked_comments_ref = user_ref.collection('likedComments')
-        liked_comments = liked_comments_ref.stream()
-
-        for liked_comment in liked_comments:
-            liked_comment_data = liked_comment.to_dict()
-            comment_id = liked_comment.id
-            post_id = liked_comment_data['postId']
-            comment_ref = db.collection('posts').document(post_id).collection('comments').document(comment_id).collection('likes').document(user_id)
-            batch.delete(comment_ref)
-            batch.delete(liked_comment.reference)
-
-        # Delete user's stockLists
-        stock_lists_ref = user_ref.collection('stockLists')
-        stock_lists = stock_lists_ref.stream()
-
-        for stock_list in stock_lists:
-            batch.delete(stock_list.reference)
-
-        # Delete user document itself
-        batch.delete(user_ref)
-
-        # Commit the batch
-        batch.commit()
-
-        return {"message": "User and associated data deleted successfully"}
+
+        # Hide the user right away, and leave deleting their content to the background sweeper
+        job_id = tombstone(user_ref, 'user', user_id)
+
+        # Stop returning the user from searches
+        username_index.remove(user_id)
+
+        # Drop the user's cached feed
+        feed_cache.invalidate_users([user_id])
+
+        # Stop serving the deleted user's cached profile and follow sets
+        profile_cache.invalidate(user_id)
+        following_sets.invalidate(user_id)
+        follower_sets.invalidate(user_id)
+
+        # The user's tokens stay valid, so they can poll the deletion job, and the tombstone hides them everywhere else
+
+        return {"message": "User and associated data deleted successfully", "jobId": job_id}
+
+    except HTTPException:
+        raise
 
     except Exception as e:
         print(f"Error deleting user: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@user_account_router.post("/user/revokeTokens")
+def revoke_tokens(user_id: str = Depends(get_current_user_id)):
+    """
+    Endpoint to sign the current user out everywhere, by revoking every token issued to them so far.
+    This instance rejects the user's tokens right away, and other instances once their cached copies expire.
+    """
+    try:
+        # Revoke the refresh tokens, so no new ID tokens can be issued from existing sessions,
+        # and every instance rejects the ID tokens already issued the next time it verifies them
+        auth.revoke_refresh_tokens(user_id)
+
+        # Stop accepting the ID tokens already issued on this instance right away
+        token_cache.revoke_user(user_id)
+
+        return {"message": "Tokens revoked successfully"}
+
+    except Exception as e:
+        print(f"Error revoking tokens: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
@@ -1,93 +1,99 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, Header, Path, Query
-from firebase_admin import auth, firestore
+from typing import Dict, List, Optional, Tuple
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Header, Path, Query, Response
+from firebase_admin import firestore
 import re
 from firebase_configuration import db
-from models.following_models import FollowRequest, UnfollowRequest
-from models.user_models import UserModel, CreateUserModel
+from models.following_models import FollowListUserModel, FollowRequest, IsFollowingBatchRequest, UnfollowRequest
+from models.user_models import UserBatchRequest, UserModel, CreateUserModel
+from services.db_executor import run_concurrently
+from services.feed_cache import feed_cache
+from services.follow_graph import FollowSetCache, follower_sets, following_sets
+from services.pagination import set_next_cursor
+from services.profile_cache import get_profile, get_profile_with_stock_lists, get_profiles, profile_cache
+from services.timeline import FANOUT_ON_WRITE, backfill_author, remove_author
+from services.tombstones import is_tombstoned
+from services.token_cache import token_cache
+from services.username_index import username_index
 
 # Create a router for the user interactions related requests
 user_interactions_router = APIRouter()
 
+# Whitespace anywhere in the header, removed by the slow path
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+def extract_bearer_token(authorization: str) -> str:
+    """
+    Helper function to get the token out of an Authorization header
+    """
+    # Usual "Bearer <token>" form, handled without building intermediate strings
+    scheme, _, token = authorization.partition(' ')
+    if scheme == 'Bearer' and token and not _WHITESPACE_PATTERN.search(token):
+        return token
+
+    # Anything else: remove all whitespace and the "Bearer" prefix wherever they are
+    return _WHITESPACE_PATTERN.sub('', authorization).replace('Bearer', '')
+
 def get_current_user_id(authorization: str = Header(...)) -> str:
     """
     Helper function to get current user ID from token
     """
     try:
-
-        # Remove all whitespace characters
-        cleaned_authorization = re.sub(r'\s+', '', authorization)
-
-        # Extract the token part, excluding "Bearer"
-        token = re.sub(r'Bearer', '', cleaned_authorization)
-        
-        # decodes the token and verifies it
-        decoded_token = auth.verify_id_token(token)
-
-        # Returns the user ID (uid) if the token is valid
-        return decoded_token['uid']
+        # Returns the user ID (uid) if the token is valid, only verifying its signature the first time it is seen
+        return token_cache.verify(extract_bearer_token(authorization))
     except Exception as e:
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
 @user_interactions_router.get("/user/current", response_model=UserModel)
-async def get_current_user(user_id: str = Depends(get_current_user_id)) -> UserModel:
+def get_current_user(user_id: str = Depends(get_current_user_id)) -> UserModel:
     """
     Endpoint to retrieve the profile information of the current user.
     """
-    user_ref = db.collection('users').document(user_id)
-    user_doc = user_ref.get()
-    
-    if user_doc.exists:
-        user_data = user_doc.to_dict()
-
-        # Initialize stockLists dictionary
-        stockLists = {}
-
-        # Fetch stock lists from the subcollection
-        stock_lists_ref = user_ref.collection('stockLists')
-        stock_lists_docs = stock_lists_ref.stream()
-
-        for doc in stock_lists_docs:
-            stock_list_data = doc.to_dict()
-            list_name = stock_list_data.get('name')
-            tickers = stock_list_data.get('tickers', [])
-            if list_name:
-                stockLists[list_name] = tickers
-
-        # Add stockLists to user_data
-        user_data['stockLists'] = stockLists
-
-        return UserModel(**user_data)
-    else:
+    # Read the profile and the stock lists from the cache, fetching whichever is missing concurrently
+    user = get_profile_with_stock_lists(user_id)
+    if user is None:
         raise HTTPException(status_code=404, detail="User not found")
 
+    return user
+
 
 # This registers the function get_user_profile as the handler for GET requests to "/user/{userID}"
 # response_model specifies that the response should be validated against the User Model
 @user_interactions_router.get("/user/{userID}", response_model=UserModel)
 # Path describes how the user ID is a parameter, which is retrieved from the URL
-async def get_user_profile(userID: str = Path(..., description="The ID of the user to retrieve")) -> UserModel:
+def get_user_profile(userID: str = Path(..., description="The ID of the user to retrieve")) -> UserModel:
     """
     Endpoint to get the profile information of a user by their user ID.
     """
-    # db.collection('users') accesses the users collection in the database
-    # .document(userID) retrieves the document corresponding to the given userID
-    user_ref = db.collection('users').document(userID)
+    # Read the profile from the cache, or from the database on a miss, treating deleted users as missing
+    user = get_profile(userID)
 
-    # This fetches the document from the database
-    user_doc = user_ref.get()
+    # If the user does not exist, raise an HTTP 404 error
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
 
-    # if the document exists in the database or not
-    if user_doc.exists:
-        # convert the document to a dictionary
-        user_data = user_doc.to_dict()
+    return user
 
-        # create and return a UserModel object using the extracted data
-        return UserModel(**user_data)
-    else:
-        # If the user does not exist, raise an HTTP 404 error
-        raise HTTPException(status_code=404, detail="User not found")
+
+# Maximum number of users that can be fetched in one batch
+USERS_BATCH_MAX_IDS = 100
+
+@user_interactions_router.post("/users/batch", response_model=List[UserModel])
+def get_users_batch(batch_request: UserBatchRequest, user_id: str = Depends(get_current_user_id)) -> List[UserModel]:
+    """
+    Endpoint to get the profile information of several users at once, in the order requested.
+    Users that do not exist are left out, and every uncached profile is read in one round trip.
+    """
+    if len(batch_request.userIds) > USERS_BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {USERS_BATCH_MAX_IDS} users can be fetched at once")
+
+    try:
+        profiles = get_profiles(batch_request.userIds)
+        return [profiles[requested_id] for requested_id in dict.fromkeys(batch_request.userIds) if requested_id in profiles]
+
+    except Exception as e:
+        print(f"Error fetching users: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
 # @user_interactions_router.post("/user/follow")
@@ -117,41 +123,82 @@ async def get_user_profile(userID: str = Path(..., description="The ID of the us
 
 #     return {"message": "User followed successfully"}
 
-@user_interactions_router.post("/user/follow")
-async def follow_user(follow_request: FollowRequest, user_id: str = Depends(get_current_user_id)):
+@firestore.transactional
+def follow_user_in_transaction(transaction, user_ref, target_user_ref):
     """
-    Endpoint to add the specified user ID to the current user's following list.
+    Helper function to check both users and record a follow in one transaction
     """
-    # Get the current user's document reference
-    user_ref = db.collection('users').document(user_id)
-    user_doc = user_ref.get()
-
-    if not user_doc.exists:
+    # Read both users and the following document together
+    following_ref = user_ref.collection('following').document(target_user_ref.id)
+    snapshots = {
+        snapshot.reference.path: snapshot
+        for snapshot in transaction.get_all([user_ref, target_user_ref, following_ref])
+    }
+
+    if not snapshots[user_ref.path].exists:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Get the target user's document reference
-    target_user_ref = db.collection('users').document(follow_request.userIdToFollow)
-    target_user_doc = target_user_ref.get()
-
-    if not target_user_doc.exists:
+    target_user_snapshot = snapshots[target_user_ref.path]
+    if not target_user_snapshot.exists or is_tombstoned(target_user_snapshot):
         raise HTTPException(status_code=404, detail="Target user not found")
 
     # Check if already following
-    following_ref = user_ref.collection('following').document(follow_request.userIdToFollow)
-    if following_ref.get().exists:
+    if snapshots[following_ref.path].exists:
         raise HTTPException(status_code=400, detail="Already following this user")
 
     # Add target user to following subcollection
-    following_ref.set({})
+    transaction.set(following_ref, {})
 
     # Increment following count for current user
-    user_ref.update({'following_count': firestore.Increment(1)})
+    transaction.update(user_ref, {'following_count': firestore.Increment(1)})
 
     # Add current user to target user's followers subcollection
-    target_user_ref.collection('followers').document(user_id).set({})
+    transaction.set(target_user_ref.collection('followers').document(user_ref.id), {})
 
     # Increment followers count for target user
-    target_user_ref.update({'followers_count': firestore.Increment(1)})
+    transaction.update(target_user_ref, {'followers_count': firestore.Increment(1)})
+
+
+def finish_follow(user_id: str, author_id: str) -> None:
+    """
+    Helper function to copy a newly followed author's recent posts into the user's timeline and drop their cached feed.
+    It runs after the response is sent, so a failure here is logged rather than failing a follow that was committed.
+    """
+    try:
+        if FANOUT_ON_WRITE:
+            backfill_author(user_id, author_id)
+
+    except Exception as e:
+        print(f"Failed to backfill the posts of {author_id} into the timeline of {user_id}: {e}")
+
+    # The user's cached feed no longer matches who they follow
+    feed_cache.invalidate_users([user_id])
+
+
+@user_interactions_router.post("/user/follow")
+def follow_user(
+    follow_request: FollowRequest,
+    background_tasks: BackgroundTasks,
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    Endpoint to add the specified user ID to the current user's following list.
+    """
+    # Get the document references of the current user and the target user
+    user_ref = db.collection('users').document(user_id)
+    target_user_ref = db.collection('users').document(follow_request.userIdToFollow)
+
+    # Apply the follow atomically, so a failure never leaves it half written
+    follow_user_in_transaction(db.transaction(), user_ref, target_user_ref)
+
+    # Keep the cached follow counts and follow sets of both users current
+    profile_cache.add_follow_counts(user_id, following=1)
+    profile_cache.add_follow_counts(follow_request.userIdToFollow, followers=1)
+    following_sets.add(user_id, follow_request.userIdToFollow)
+    follower_sets.add(follow_request.userIdToFollow, user_id)
+
+    # Copy the target user's recent posts into the current user's timeline once the response is sent
+    background_tasks.add_task(finish_follow, user_id, follow_request.userIdToFollow)
 
     return {"message": "User followed successfully"}
 
@@ -184,53 +231,77 @@ async def follow_user(follow_request: FollowRequest, user_id: str = Depends(get_
 
 #     return {"message": "User unfollowed successfully"}
 
-@user_interactions_router.post("/user/unfollow")
-async def unfollow_user(unfollow_request: UnfollowRequest, user_id: str = Depends(get_current_user_id)):
+@firestore.transactional
+def unfollow_user_in_transaction(transaction, user_ref, target_user_ref):
     """
-    Remove the specified user ID from the current user's following list.
+    Helper function to check both users and remove a follow in one transaction
     """
-    # Get the current user's document reference
-    user_ref = db.collection('users').document(user_id)
-    user_doc = user_ref.get()
-
-    if not user_doc.exists:
+    # Read both users and the following document together
+    following_ref = user_ref.collection('following').document(target_user_ref.id)
+    snapshots = {
+        snapshot.reference.path: snapshot
+        for snapshot in transaction.get_all([user_ref, target_user_ref, following_ref])
+    }
+
+    if not snapshots[user_ref.path].exists:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Get the target user's document reference
-    target_user_ref = db.collection('users').document(unfollow_request.userIdToUnfollow)
-    target_user_doc = target_user_ref.get()
-
-    if not target_user_doc.exists:
+    if not snapshots[target_user_ref.path].exists:
         raise HTTPException(status_code=404, detail="Target user not found")
 
     # Check if not following
-    following_ref = user_ref.collection('following').document(unfollow_request.userIdToUnfollow)
-    if not following_ref.get().exists:
+    if not snapshots[following_ref.path].exists:
         raise HTTPException(status_code=400, detail="Not following this user")
 
     # Remove target user from following subcollection
-    following_ref.delete()
+    transaction.delete(following_ref)
 
     # Decrement following count for current user
-    user_ref.update({'following_count': firestore.Increment(-1)})
+    transaction.update(user_ref, {'following_count': firestore.Increment(-1)})
 
     # Remove current user from target user's followers subcollection
-    target_user_ref.collection('followers').document(user_id).delete()
+    transaction.delete(target_user_ref.collection('followers').document(user_ref.id))
 
     # Decrement followers count for target user
-    target_user_ref.update({'followers_count': firestore.Increment(-1)})
+    transaction.update(target_user_ref, {'followers_count': firestore.Increment(-1)})
+
+
+@user_interactions_router.post("/user/unfollow")
+def unfollow_user(unfollow_request: UnfollowRequest, user_id: str = Depends(get_current_user_id)):
+    """
+    Remove the specified user ID from the current user's following list.
+    """
+    # Get the document references of the current user and the target user
+    user_ref = db.collection('users').document(user_id)
+    target_user_ref = db.collection('users').document(unfollow_request.userIdToUnfollow)
+
+    # Apply the unfollow atomically, so a failure never leaves it half written
+    unfollow_user_in_transaction(db.transaction(), user_ref, target_user_ref)
+
+    # Keep the cached follow counts and follow sets of both users current
+    profile_cache.add_follow_counts(user_id, following=-1)
+    profile_cache.add_follow_counts(unfollow_request.userIdToUnfollow, followers=-1)
+    following_sets.discard(user_id, unfollow_request.userIdToUnfollow)
+    follower_sets.discard(unfollow_request.userIdToUnfollow, user_id)
+
+    # Remove the target user's posts from the current user's timeline, which only exists with fan-out on write
+    if FANOUT_ON_WRITE:
+        remove_author(user_id, unfollow_request.userIdToUnfollow)
+
+    # The current user's cached feed no longer matches who they follow
+    feed_cache.invalidate_users([user_id])
 
     return {"message": "User unfollowed successfully"}
 
 
 @user_interactions_router.get("/search/users", response_model=List[UserModel])
-async def search_users(
+def search_users(
     username: str = Query(..., description="The username to search for"),
     limit: int = Query(10, description="Maximum number of results to return")
 ) -> List[UserModel]:
     """
     Endpoint to search for users by username.
-    This performs a case-insensitive search and returns matching users.
+    This performs a case-insensitive prefix and substring search and returns matching users, best matches first.
     
     Args:
     - username (str): The username to search for.
@@ -243,15 +314,25 @@ async def search_users(
         # Reference to the users collection in Firestore
         users_ref = db.collection('users')
 
-        # Query to search for users by username (case-insensitive search) and limit the results
-        query = users_ref.where('username', '>=', username).where('username', '<=', username + '\uf8ff').limit(limit)
+        if username_index.ready:
+            # Rank matching usernames in memory, and read only the matched profiles in one round trip
+            user_ids = username_index.search(username, limit)
+            snapshots = {doc.id: doc for doc in db.get_all([users_ref.document(user_id) for user_id in user_ids])}
+            docs = [snapshots[user_id] for user_id in user_ids if user_id in snapshots and snapshots[user_id].exists]
+        else:
+            # Until the index has loaded, fall back to a (case-sensitive) prefix query
+            query = users_ref.where('username', '>=', username).where('username', '<=', username + '\uf8ff').limit(limit)
 
-        # Retrieve documents that match the search
-        docs = query.stream()
+            # Retrieve documents that match the search
+            docs = query.stream()
 
         # List to hold the search results
         users = []
         for doc in docs:
+            # Skip users that were deleted but not yet swept
+            if is_tombstoned(doc):
+                continue
+
             user_data = doc.to_dict()
             
             # Remove 'stockLists' if it is not needed
@@ -267,17 +348,136 @@ async def search_users(
     
 
 @user_interactions_router.get("/user/is_following/{target_user_id}", response_model=bool)
-async def is_following_user(target_user_id: str, user_id: str = Depends(get_current_user_id)) -> bool:
+def is_following_user(target_user_id: str, user_id: str = Depends(get_current_user_id)) -> bool:
     """
     Check if the current user is following the target user.
     """
     try:
-        # Reference to the subcollection of the current user's 'following' list
-        following_ref = db.collection('users').document(user_id).collection('following').document(target_user_id)
-        following_doc = following_ref.get()
+        # Look the target user up in the current user's cached following set
+        return target_user_id in following_sets.get(user_id)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Return true if the document exists (current user is following target user)
-        return following_doc.exists
+
+@user_interactions_router.post("/user/is_following/batch", response_model=Dict[str, bool])
+def is_following_users(batch_request: IsFollowingBatchRequest, user_id: str = Depends(get_current_user_id)) -> Dict[str, bool]:
+    """
+    Check which of the target users the current user is following, as target user ID -> following
+    """
+    try:
+        # One set lookup per target, against the current user's cached following set
+        return following_sets.contains_many(user_id, batch_request.userIds)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+def get_follow_list_page(
+    sets: FollowSetCache, target_user_id: str, user_id: str, cursor: Optional[str], limit: int
+) -> Tuple[List[FollowListUserModel], Optional[str]]:
+    """
+    Helper function to return one page of a user's followers or following, in user ID order, flagging whether
+    each listed user follows the current user and is followed by them. Returns the page and the next cursor.
+    """
+    # Page through the cached set, and only query a single page of another user's set that is not cached yet
+    listed_ids = sets.get(target_user_id) if target_user_id == user_id else sets.peek(target_user_id)
+    if listed_ids is not None:
+        page_ids = listed_ids.page(cursor, limit)
+    else:
+        query = sets.collection(target_user_id).order_by('__name__').select([]).limit(limit)
+        if cursor:
+            query = query.start_after({'__name__': cursor})
+        page_ids = [doc.id for doc in query.stream()]
+
+    # The relationship flags are lookups in the current user's sets when they are cached, and otherwise reads of
+    # just the page's relationship documents, made concurrently
+    target_profile, profiles, following_ids, follower_ids = run_concurrently([
+        lambda: get_profile(target_user_id),
+        lambda: get_profiles(page_ids),
+        lambda: following_sets.members(user_id, page_ids),
+        lambda: follower_sets.members(user_id, page_ids),
+    ])
+
+    if target_profile is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    # Users that were deleted are left out, but still move the cursor along
+    users = [
+        FollowListUserModel(
+            id=listed_id,
+            username=profiles[listed_id].username,
+            name=profiles[listed_id].name,
+            profile_image_url=profiles[listed_id].profile_image_url,
+            followsYou=listed_id in follower_ids,
+            youFollow=listed_id in following_ids,
+        )
+        for listed_id in page_ids if listed_id in profiles
+    ]
+
+    next_cursor = page_ids[-1] if len(page_ids) == limit else None
+    return users, next_cursor
+
+
+@user_interactions_router.get("/users/{target_user_id}/followers", response_model=List[FollowListUserModel])
+def get_followers(
+    target_user_id: str,
+    response: Response,
+    limit: int = Query(20, ge=1, le=100, description="Limit the number of users returned"),
+    cursor: Optional[str] = Query(None, description="Cursor returned in the X-Next-Cursor header of the previous page"),
+    user_id: str = Depends(get_current_user_id)
+) -> List[FollowListUserModel]:
+    """
+    Endpoint to list the users following a user, with pagination
+    """
+    try:
+        users, next_cursor = get_follow_list_page(follower_sets, target_user_id, user_id, cursor, limit)
+        set_next_cursor(response, next_cursor)
+        return users
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        print(f"Error fetching followers: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@user_interactions_router.get("/users/{target_user_id}/following", response_model=List[FollowListUserModel])
+def get_following(
+    target_user_id: str,
+    response: Response,
+    limit: int = Query(20, ge=1, le=100, description="Limit the number of users returned"),
+    cursor: Optional[str] = Query(None, description="Cursor returned in the X-Next-Cursor header of the previous page"),
+    user_id: str = Depends(get_current_user_id)
+) -> List[FollowListUserModel]:
+    """
+    Endpoint to list the users a user is following, with pagination
+    """
+    try:
+        users, next_cursor = get_follow_list_page(following_sets, target_user_id, user_id, cursor, limit)
+        set_next_cursor(response, next_cursor)
+        return users
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        print(f"Error fetching following: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@user_interactions_router.get("/user/profile_cache/stats")
+def get_profile_cache_stats(user_id: str = Depends(get_current_user_id)) -> dict:
+    """
+    Endpoint to return the hit/miss metrics of the profile cache
+    """
+    return profile_cache.stats()
+
+
+@user_interactions_router.get("/user/follow_cache/stats")
+def get_follow_cache_stats(user_id: str = Depends(get_current_user_id)) -> dict:
+    """
+    Endpoint to return the hit/miss metrics of the following and follower set caches
+    """
+    return {'following': following_sets.stats(), 'followers': follower_sets.stats()}
@@ -25,6 +25,8 @@
 #     # Update the document with the modified following list
 #     user_ref.update({'following': current_following})
 
+import hashlib
+import sys
 import firebase_admin
 from firebase_admin import credentials, firestore
 
@@ -33,15 +35,157 @@ firebase_admin.initialize_app(cred)
 
 db = firestore.client()
 
-# Initialize comments_count for each post document
-posts_ref = db.collection('posts')
-docs = posts_ref.stream()
+def init_comments_count():
+    # Initialize comments_count for each post document
+    posts_ref = db.collection('posts')
+    docs = posts_ref.stream()
 
-for doc in docs:
-    post_id = doc.id
-    post_ref = posts_ref.document(post_id)
+    for doc in docs:
+        post_id = doc.id
+        post_ref = posts_ref.document(post_id)
 
-    # Update the document with the comments_count field set to 0
-    post_ref.update({'comments_count': 0})
+        # Update the document with the comments_count field set to 0
+        post_ref.update({'comments_count': 0})
 
-print("Migration completed: comments_count field initialized to 0 for all posts.")
+    print("Migration completed: comments_count field initialized to 0 for all posts.")
+
+
+def backfill_timelines():
+    # Number of each followed user's most recent posts to copy into a timeline
+    backfill_limit = 50
+
+    # Build each user's materialized home timeline from their own posts and the posts of the users they follow
+    users_ref = db.collection('users')
+    docs = users_ref.stream()
+
+    for doc in docs:
+        user_id = doc.id
+        timeline_ref = users_ref.document(user_id).collection('timeline')
+
+        # Include the user's own posts along with those of everyone they follow
+        author_ids = [user_id] + [following.id for following in users_ref.document(user_id).collection('following').stream()]
+
+        for author_id in author_ids:
+            posts = db.collection('posts').where('userId', '==', author_id) \
+                .order_by('timestamp', direction=firestore.Query.DESCENDING).limit(backfill_limit).stream()
+
+            # Write the timeline entries in a batch, which stays under the 500 operation limit
+            batch = db.batch()
+            for post in posts:
+                batch.set(timeline_ref.document(post.id), {'userId': author_id, 'timestamp': post.get('timestamp')})
+            batch.commit()
+
+    print("Migration completed: timelines backfilled for all users.")
+
+
+def reserve_usernames():
+    # Reserve the username of every existing user in the usernames collection.
+    # Progress is saved after each page, so the migration can be stopped and run again to resume.
+    page_size = 300
+
+    users_ref = db.collection('users')
+    progress_ref = db.collection('migrations').document('usernameReservations')
+
+    progress = progress_ref.get()
+    last_user_id = progress.get('last_user_id') if progress.exists else None
+
+    while True:
+        query = users_ref.order_by('__name__').limit(page_size)
+        if last_user_id:
+            query = query.start_after({'__name__': last_user_id})
+        users = list(query.stream())
+        if not users:
+            break
+
+        # Read the page's reservations at once, and only create the missing ones
+        reservations = {}
+        for user in users:
+            username = (user.to_dict().get('username') or '').strip().casefold()
+            if username:
+                reservation_id = hashlib.sha256(username.encode('utf-8')).hexdigest()
+                reservations[user.id] = (username, db.collection('usernames').document(reservation_id))
+
+        existing = {snapshot.reference.path: snapshot for snapshot in db.get_all([ref for _, ref in reservations.values()])}
+
+        batch = db.batch()
+        reserved_paths = set()
+        for user_id, (username, reservation_ref) in reservations.items():
+            snapshot = existing[reservation_ref.path]
+            if snapshot.exists or reservation_ref.path in reserved_paths:
+                if not snapshot.exists or snapshot.get('userId') != user_id:
+                    print(f"Username {username} of user {user_id} is already reserved by another user")
+                continue
+            reserved_paths.add(reservation_ref.path)
+            batch.set(reservation_ref, {'userId': user_id, 'username': username, 'reserved_at': firestore.SERVER_TIMESTAMP})
+
+        last_user_id = users[-1].id
+        batch.set(progress_ref, {'last_user_id': last_user_id})
+        batch.commit()
+        print(f"Reserved usernames up to user {last_user_id}")
+
+    print("Migration completed: usernames reserved for all users.")
+
+
+@firestore.transactional
+def move_user_stock_lists(transaction, user_ref) -> int:
+    # Move a user's stock list documents into the stockLists map of their user document, unless already moved
+    user_doc = user_ref.get(transaction=transaction)
+    if not user_doc.exists or user_doc.to_dict().get('stockLists') is not None:
+        return 0
+
+    stock_list_docs = list(user_ref.collection('stockLists').stream(transaction=transaction))
+    stock_lists = {}
+    for doc in stock_list_docs:
+        stock_list_data = doc.to_dict()
+        if stock_list_data.get('name'):
+            stock_lists[stock_list_data['name']] = stock_list_data.get('tickers', [])
+
+    transaction.update(user_ref, {'stockLists': stock_lists})
+    for doc in stock_list_docs:
+        transaction.delete(doc.reference)
+    return len(stock_list_docs)
+
+
+def move_stock_lists():
+    # Move every user's stock lists onto their user document.
+    # Progress is saved after each page, so the migration can be stopped and run again to resume.
+    page_size = 100
+
+    users_ref = db.collection('users')
+    progress_ref = db.collection('migrations').document('stockListsOnUsers')
+
+    progress = progress_ref.get()
+    last_user_id = progress.get('last_user_id') if progress.exists else None
+
+    while True:
+        query = users_ref.order_by('__name__').limit(page_size)
+        if last_user_id:
+            query = query.start_after({'__name__': last_user_id})
+        users = list(query.stream())
+        if not users:
+            break
+
+        for user in users:
+            move_user_stock_lists(db.transaction(), user.reference)
+
+        last_user_id = users[-1].id
+        progress_ref.set({'last_user_id': last_user_id})
+        print(f"Moved stock lists onto user documents up to user {last_user_id}")
+
+    print("Migration completed: stock lists moved onto all user documents.")
+
+
+# Migrations by the name they are run with, as in: python script.py reserve_usernames
+MIGRATIONS = {
+    'init_comments_count': init_comments_count,
+    'backfill_timelines': backfill_timelines,
+    'reserve_usernames': reserve_usernames,
+    'move_stock_lists': move_stock_lists,
+}
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] not in MIGRATIONS:
+        print(f"Usage: python {sys.argv[0]} <{'|'.join(MIGRATIONS)}>")
+        sys.exit(1)
+
+    MIGRATIONS[sys.argv[1]]()
@@ -0,0 +1,42 @@
+from typing import Iterable
+from firebase_configuration import db
+
+#
+# Helpers for committing writes in as few round trips as Firestore's batch limit allows
+#
+
+# Firestore rejects write batches with more than 500 operations
+BATCH_LIMIT = 500
+
+
+def commit_chunked(operations: Iterable, batch=None, batch_size: int = 0) -> int:
+    """
+    Helper function to apply ('set' | 'update' | 'delete', ref, data) operations in batches under the limit.
+    When a batch already holding batch_size writes is given, the first operations are added to it,
+    so they commit atomically with those writes. Returns the number of batches committed.
+    """
+    batch = batch if batch is not None else db.batch()
+    pending = batch_size
+    commits = 0
+
+    for action, ref, data in operations:
+        # Start a new batch once the current one is full
+        if pending == BATCH_LIMIT:
+            batch.commit()
+            commits += 1
+            batch = db.batch()
+            pending = 0
+
+        if action == 'set':
+            batch.set(ref, data)
+        elif action == 'update':
+            batch.update(ref, data)
+        else:
+            batch.delete(ref)
+        pending += 1
+
+    if pending:
+        batch.commit()
+        commits += 1
+
+    return commits
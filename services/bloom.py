@@ -0,0 +1,33 @@
+import hashlib
+import math
+
+#
+# Bloom filter over strings: a compact bit array that can say a value was definitely never added,
+# or that it may have been added, with a configurable false-positive rate
+#
+
+
+class BloomFilter:
+    """
+    Bloom filter sized for an expected number of values and false-positive rate
+    """
+
+    def __init__(self, capacity: int, false_positive_rate: float = 0.01):
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2), 8)
+        self.hash_count = max(int(round(self.size / capacity * math.log(2))), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: str):
+        # Derive every bit position from two 64-bit hashes (Kirsch-Mitzenmacher double hashing)
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + index * second) % self.size for index in range(self.hash_count))
+
+    def add(self, value: str) -> None:
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
@@ -0,0 +1,330 @@
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, List, Optional
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions
+from firebase_admin import firestore
+from firebase_configuration import db
+from services import counters
+from services.timeline import timeline_collection
+
+#
+# Cascade-delete engine for posts and users.
+# The subtrees to delete are traversed as independent tasks on a thread pool, and every write is
+# streamed through a BulkWriter, which batches, rate limits and retries them.
+# A task returns (operations, child_tasks), where each operation is an ('update' | 'delete', ref, data) tuple.
+#
+
+# Number of subtree traversals that stream from Firestore at once
+CASCADE_TRAVERSAL_WORKERS = int(os.getenv('CASCADE_TRAVERSAL_WORKERS', '8'))
+
+# Number of attempts for a failed write before it is reported as failed
+CASCADE_MAX_ATTEMPTS = int(os.getenv('CASCADE_MAX_ATTEMPTS', '5'))
+
+# Error codes that a retry cannot fix, such as updating a document that no longer exists
+_PERMANENT_ERROR_CODES = {3, 5, 7, 9}
+
+# Separate from the shared Firestore executor, since traversals run for a long time
+_traversal_executor = ThreadPoolExecutor(max_workers=CASCADE_TRAVERSAL_WORKERS, thread_name_prefix='cascade')
+
+
+class CascadeResult:
+    """
+    Counts and timing of a finished cascade delete
+    """
+
+    def __init__(self):
+        self.writes = 0
+        self.failed_writes = 0
+        self.seconds = 0.0
+        self.post_ids = []
+        self._lock = threading.Lock()
+
+    def add_writes(self, writes: int = 1, failed_writes: int = 0) -> None:
+        with self._lock:
+            self.writes += writes
+            self.failed_writes += failed_writes
+
+    @property
+    def writes_per_second(self) -> float:
+        return self.writes / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'writes': self.writes,
+            'failed_writes': self.failed_writes,
+            'seconds': round(self.seconds, 3),
+            'writes_per_second': round(self.writes_per_second, 1),
+        }
+
+
+def _with_retries(task: Callable) -> Callable:
+    """
+    Helper function to retry a traversal task with a growing delay when a read fails part way
+    """
+    def retrying_task():
+        for attempt in range(1, CASCADE_MAX_ATTEMPTS + 1):
+            try:
+                return task()
+            except Exception as e:
+                if attempt == CASCADE_MAX_ATTEMPTS:
+                    raise
+                print(f"Cascade delete traversal failed, retrying (attempt {attempt}): {e}")
+                time.sleep(attempt)
+
+    return retrying_task
+
+
+def _stream_task(query, to_operations: Callable, to_children: Optional[Callable] = None) -> Callable:
+    """
+    Helper function to build a task that streams a query and turns each document into operations and child tasks
+    """
+    def task():
+        operations = []
+        children = []
+        for doc in query.stream():
+            operations.extend(to_operations(doc))
+            if to_children is not None:
+                children.extend(to_children(doc))
+        return operations, children
+
+    return task
+
+
+def _static_task(operations: List) -> Callable:
+    """
+    Helper function to build a task whose operations are known without reading anything
+    """
+    return lambda: (operations, [])
+
+
+def _comment_tasks(comment_ref) -> List[Callable]:
+    """
+    Helper function to build the tasks that delete a comment's likes
+    """
+    users_ref = db.collection('users')
+    return [_stream_task(
+        comment_ref.collection('likes'),
+        lambda like: [
+            ('delete', users_ref.document(like.id).collection('likedComments').document(comment_ref.id), None),
+            ('delete', like.reference, None),
+        ],
+    )]
+
+
+@firestore.transactional
+def _remove_relationship(transaction, relationship_ref, counted_ref, field: str) -> int:
+    """
+    Helper function to delete a follow relationship document and decrement the matching count on the other user,
+    only if the relationship still exists, so a cascade that is run again never decrements twice.
+    Returns the number of writes made.
+    """
+    snapshots = {
+        snapshot.reference.path: snapshot for snapshot in transaction.get_all([relationship_ref, counted_ref])
+    }
+    if not snapshots[relationship_ref.path].exists:
+        return 0
+
+    transaction.delete(relationship_ref)
+    if not snapshots[counted_ref.path].exists:
+        return 1
+
+    transaction.update(counted_ref, {field: firestore.Increment(-1)})
+    return 2
+
+
+def post_tasks(post_ref) -> List[Callable]:
+    """
+    Helper function to build the tasks that delete a post, its likes, its comments and their likes
+    """
+    users_ref = db.collection('users')
+    post_id = post_ref.id
+
+    def comment_operations(comment) -> List:
+        # Remove the post from the commenter's commentedPosts subcollection, then the comment and its shards
+        commenter_id = comment.to_dict().get('userId')
+        operations = [('delete', shard_ref, None) for shard_ref in counters.shard_refs(comment.reference)]
+        operations.append(('delete', comment.reference, None))
+        if commenter_id:
+            operations.append(('delete', users_ref.document(commenter_id).collection('commentedPosts').document(post_id), None))
+        return operations
+
+    return [
+        # Delete post's likes and remove from users' likedPosts subcollections
+        _stream_task(
+            post_ref.collection('likes'),
+            lambda like: [
+                ('delete', users_ref.document(like.id).collection('likedPosts').document(post_id), None),
+                ('delete', like.reference, None),
+            ],
+        ),
+        # Delete post's comments, then each comment's likes in its own task
+        _stream_task(
+            post_ref.collection('comments'),
+            comment_operations,
+            lambda comment: _comment_tasks(comment.reference),
+        ),
+        # Delete the post document and its counter shards
+        _static_task(
+            [('delete', shard_ref, None) for shard_ref in counters.shard_refs(post_ref)] + [('delete', post_ref, None)]
+        ),
+    ]
+
+
+def run_cascade(tasks: List[Callable], result: Optional[CascadeResult] = None,
+                max_writes_per_second: Optional[int] = None,
+                on_progress: Optional[Callable[[CascadeResult], None]] = None) -> CascadeResult:
+    """
+    Run the traversal tasks concurrently and stream their writes through a BulkWriter.
+    Returns once every write has been committed or has failed permanently.
+    """
+    result = result or CascadeResult()
+    started = time.perf_counter()
+
+    options = BulkWriterOptions()
+    if max_writes_per_second:
+        options = BulkWriterOptions(initial_ops_per_second=max_writes_per_second, max_ops_per_second=max_writes_per_second)
+    writer = db.bulk_writer(options)
+
+    def on_write_result(reference, write_result, bulk_writer):
+        result.add_writes()
+
+    def on_write_error(failure, bulk_writer) -> bool:
+        # Retry transient failures, and give up on ones a retry cannot fix
+        if failure.code not in _PERMANENT_ERROR_CODES and failure.attempts < CASCADE_MAX_ATTEMPTS:
+            return True
+        result.add_writes(writes=0, failed_writes=1)
+        print(f"Cascade delete write failed after {failure.attempts + 1} attempts: {failure.message}")
+        return False
+
+    writer.on_write_result(on_write_result)
+    writer.on_write_error(on_write_error)
+
+    try:
+        # Apply each task's operations as it finishes, and schedule the subtrees it discovered
+        pending = {_traversal_executor.submit(_with_retries(task)) for task in tasks}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                operations, children = future.result()
+                for action, ref, data in operations:
+                    if action == 'update':
+                        writer.update(ref, data)
+                    else:
+                        writer.delete(ref)
+                pending.update(_traversal_executor.submit(_with_retries(child)) for child in children)
+
+            if on_progress is not None:
+                on_progress(result)
+
+    finally:
+        # Wait for the remaining writes and retries to finish
+        writer.close()
+
+    result.seconds = time.perf_counter() - started
+    if on_progress is not None:
+        on_progress(result)
+    return result
+
+
+def delete_post_tree(post_ref, author_id: str, result: Optional[CascadeResult] = None, **options) -> CascadeResult:
+    """
+    Delete a post with everything that hangs off it, including its timeline entries
+    """
+    result = result or CascadeResult()
+    result.post_ids.append(post_ref.id)
+
+    tasks = post_tasks(post_ref) + [
+        # Remove the post from the timelines of the author and their followers
+        _static_task([('delete', timeline_collection(author_id).document(post_ref.id), None)]),
+        _stream_task(
+            db.collection('users').document(author_id).collection('followers'),
+            lambda follower: [('delete', timeline_collection(follower.id).document(post_ref.id), None)],
+        ),
+    ]
+
+    result = run_cascade(tasks, result, **options)
+    print(f"Deleted post {post_ref.id}: {result.to_dict()}")
+    return result
+
+
+def delete_user_tree(user_id: str, result: Optional[CascadeResult] = None, **options) -> CascadeResult:
+    """
+    Delete a user with all of their content on the app and their relationships to other users
+    """
+    users_ref = db.collection('users')
+    user_ref = users_ref.document(user_id)
+    result = result or CascadeResult()
+
+    def relationship_task(other_user_id: str, collection_name: str, field: str, own_relationship_ref) -> Callable:
+        # Remove the other user's side of the relationship and fix their count in a transaction,
+        # then delete this user's side, which is what marks the relationship as handled
+        def task():
+            other_user_ref = users_ref.document(other_user_id)
+            result.add_writes(_remove_relationship(
+                db.transaction(), other_user_ref.collection(collection_name).document(user_id), other_user_ref, field
+            ))
+            return [('delete', own_relationship_ref, None)], []
+
+        return task
+
+    def follower_children(follower) -> List:
+        return [
+            relationship_task(follower.id, 'following', 'following_count', follower.reference),
+            # Remove the user's posts from the follower's timeline
+            _stream_task(
+                timeline_collection(follower.id).where('userId', '==', user_id),
+                lambda entry: [('delete', entry.reference, None)],
+            ),
+        ]
+
+    def following_children(followed_user) -> List:
+        return [relationship_task(followed_user.id, 'followers', 'followers_count', followed_user.reference)]
+
+    def post_children(post) -> List:
+        result.post_ids.append(post.id)
+        return post_tasks(post.reference)
+
+    def liked_comment_operations(liked_comment) -> List:
+        operations = [('delete', liked_comment.reference, None)]
+
+        # Older likes did not record the post, so their like document cannot be located
+        post_id = liked_comment.to_dict().get('postId')
+        if post_id:
+            comment_ref = db.collection('posts').document(post_id).collection('comments').document(liked_comment.id)
+            operations.append(('delete', comment_ref.collection('likes').document(user_id), None))
+        return operations
+
+    def delete_documents(doc) -> List:
+        return [('delete', doc.reference, None)]
+
+    tasks = [
+        # Handle followers
+        _stream_task(user_ref.collection('followers'), lambda follower: [], follower_children),
+        # Handle following
+        _stream_task(user_ref.collection('following'), lambda followed_user: [], following_children),
+        # Delete user's posts and related data
+        _stream_task(db.collection('posts').where('userId', '==', user_id), lambda post: [], post_children),
+        # Delete user's likes from posts and comments
+        _stream_task(
+            user_ref.collection('likedPosts'),
+            lambda liked_post: [
+                ('delete', db.collection('posts').document(liked_post.id).collection('likes').document(user_id), None),
+                ('delete', liked_post.reference, None),
+            ],
+        ),
+        _stream_task(user_ref.collection('likedComments'), liked_comment_operations),
+        # Delete user's own subcollections
+        _stream_task(user_ref.collection('commentedPosts'), delete_documents),
+        _stream_task(timeline_collection(user_id), delete_documents),
+        _stream_task(user_ref.collection('stockLists'), delete_documents),
+        # Release the user's username
+        _stream_task(db.collection('usernames').where('userId', '==', user_id), delete_documents),
+        # Delete user document itself
+        _static_task([('delete', user_ref, None)]),
+    ]
+
+    result = run_cascade(tasks, result, **options)
+    print(f"Deleted user {user_id}: {result.to_dict()}")
+    return result
@@ -0,0 +1,175 @@
+import os
+import random
+from typing import Dict, Iterable, List, Sequence
+from firebase_admin import firestore
+from firebase_configuration import db
+from services.ttl_cache import TTLCache
+
+#
+# Counters for the likes_count and comments_count fields of posts and comments.
+# Most documents are incremented rarely, so their counts are kept on the document itself and cost no extra reads.
+# A document that takes more increments than one document should is switched to sharded counting: its
+# counter_shards field records the number of shards, later increments land on one of the shard documents in its
+# counterShards subcollection, and its true count is the base value on the document plus the sum of the shards.
+#
+
+# Number of shard documents of a hot counted document
+COUNTER_SHARDS = int(os.getenv('COUNTER_SHARDS', '10'))
+
+# Increments of one document within a minute on this instance that switch it to sharded counting
+COUNTER_HOT_INCREMENTS_PER_MINUTE = int(os.getenv('COUNTER_HOT_INCREMENTS_PER_MINUTE', '30'))
+
+# How long aggregated shard sums are reused before the shards are read again
+COUNTER_CACHE_TTL_SECONDS = float(os.getenv('COUNTER_CACHE_TTL_SECONDS', '5'))
+
+# Maximum number of documents whose shard sums are kept in memory
+COUNTER_CACHE_MAX_ENTRIES = int(os.getenv('COUNTER_CACHE_MAX_ENTRIES', '50000'))
+
+SHARDS_COLLECTION = 'counterShards'
+
+# Field of a counted document that holds its number of shards, once it is switched to sharded counting
+SHARD_COUNT_FIELD = 'counter_shards'
+
+# document path -> {field: shard sum}
+_shard_sums = TTLCache(COUNTER_CACHE_MAX_ENTRIES, COUNTER_CACHE_TTL_SECONDS)
+
+# document path -> number of shards, for the sharded documents this instance has seen, so they are not switched again
+_shard_counts = TTLCache(COUNTER_CACHE_MAX_ENTRIES, 3600)
+
+# document path -> increments committed by this instance since the first one in the last minute
+_recent_increments = TTLCache(COUNTER_CACHE_MAX_ENTRIES, 60)
+
+
+def shard_refs(doc_ref) -> List:
+    """
+    Helper function to get the references to all of a document's counter shards
+    """
+    shards_ref = doc_ref.collection(SHARDS_COLLECTION)
+    return [shards_ref.document(str(index)) for index in range(COUNTER_SHARDS)]
+
+
+def increment(doc_ref, field: str, amount: int, batch=None, snapshot=None) -> None:
+    """
+    Helper function to add an amount to a document's counter, on the document itself or, when the snapshot shows
+    that it is sharded, on a random shard. Callers in a transaction should pass the snapshot they read in it, so the
+    choice matches the document's current state. When a batch or transaction is given, the write is added to it
+    instead of being applied directly, and the caller should call note_increment once it has been committed.
+    """
+    # Without a snapshot the document is incremented directly, which keeps its count right even if it is sharded
+    shard_count = _snapshot_shard_count(snapshot)
+    if shard_count:
+        shard_ref = doc_ref.collection(SHARDS_COLLECTION).document(str(random.randrange(shard_count)))
+        if batch is not None:
+            batch.set(shard_ref, {field: firestore.Increment(amount)}, merge=True)
+        else:
+            shard_ref.set({field: firestore.Increment(amount)}, merge=True)
+    elif batch is not None:
+        batch.update(doc_ref, {field: firestore.Increment(amount)})
+    else:
+        doc_ref.update({field: firestore.Increment(amount)})
+
+    if batch is None:
+        note_increment(doc_ref, field, amount)
+
+
+def note_increment(doc_ref, field: str, amount: int) -> None:
+    """
+    Helper function to keep the cached shard sum in step with this instance's own committed writes,
+    and to switch the document to sharded counting once it is hot
+    """
+    _shard_sums.update(doc_ref.path, lambda sums: {**sums, field: sums.get(field, 0) + amount})
+
+    # The local rate only decides when to set the document's shard count, which every instance then follows
+    with _recent_increments.lock:
+        recent = _recent_increments.peek(doc_ref.path)
+        if recent is None:
+            _recent_increments.put(doc_ref.path, 1)
+            return
+        _recent_increments.update(doc_ref.path, lambda count: count + 1)
+
+    if recent + 1 == COUNTER_HOT_INCREMENTS_PER_MINUTE and not _shard_counts.peek(doc_ref.path):
+        _shard_document(doc_ref)
+
+
+def _snapshot_shard_count(snapshot) -> int:
+    # Returns the number of shards recorded on a document snapshot, or 0 when it is counted on the document itself,
+    # and remembers sharded documents so they are not switched again
+    if snapshot is None or not snapshot.exists:
+        return 0
+
+    shard_count = (snapshot.to_dict() or {}).get(SHARD_COUNT_FIELD) or 0
+    if shard_count and _shard_counts.peek(snapshot.reference.path) != shard_count:
+        _shard_counts.put(snapshot.reference.path, shard_count)
+    return shard_count
+
+
+def _shard_document(doc_ref) -> None:
+    # The shard count is written before any shard, so readers never miss a shard's increments
+    try:
+        doc_ref.update({SHARD_COUNT_FIELD: COUNTER_SHARDS})
+        _shard_counts.put(doc_ref.path, COUNTER_SHARDS)
+    except Exception as e:
+        print(f"Failed to shard the counters of {doc_ref.path}: {e}")
+
+
+def get_totals(snapshots: Sequence, fields: Iterable[str]) -> Dict[str, Dict[str, int]]:
+    """
+    Helper function to return {document ID: {field: count}} for the given document snapshots.
+    Only sharded documents need more reads, and their uncached shard sums are read for the whole page
+    with a single multi-document read.
+    """
+    fields = tuple(fields)
+    load_token = _shard_sums.load_token()
+
+    # Find the sharded documents whose shard sums need to be read
+    sums = {}
+    missing = []
+    for snapshot in snapshots:
+        shard_count = _snapshot_shard_count(snapshot)
+        if not shard_count:
+            continue
+
+        cached = _shard_sums.get(snapshot.reference.path)
+        if cached is not None:
+            sums[snapshot.reference.path] = dict(cached)
+        else:
+            missing.append((snapshot.reference, shard_count))
+
+    if missing:
+        fetched = {doc_ref.path: {field: 0 for field in fields} for doc_ref, _ in missing}
+        refs = [
+            doc_ref.collection(SHARDS_COLLECTION).document(str(index))
+            for doc_ref, shard_count in missing for index in range(shard_count)
+        ]
+        for shard in db.get_all(refs):
+            if not shard.exists:
+                continue
+
+            shard_data = shard.to_dict()
+            doc_sums = fetched[shard.reference.parent.parent.path]
+            for field in fields:
+                doc_sums[field] += shard_data.get(field, 0)
+
+        # Sums of documents that this instance incremented during the read are left uncached
+        for path, doc_sums in fetched.items():
+            _shard_sums.put(path, dict(doc_sums), load_token)
+        sums.update(fetched)
+
+    # Add the shard sums to the base values stored on the documents themselves
+    totals = {}
+    for snapshot in snapshots:
+        snapshot_data = snapshot.to_dict() or {}
+        doc_sums = sums.get(snapshot.reference.path, {})
+        totals[snapshot.id] = {
+            field: max(snapshot_data.get(field, 0) + doc_sums.get(field, 0), 0) for field in fields
+        }
+
+    return totals
+
+
+def forget(doc_ref) -> None:
+    """
+    Helper function to drop a deleted document's cached shard sums
+    """
+    _shard_sums.invalidate(doc_ref.path)
+    _shard_counts.discard(doc_ref.path)
@@ -0,0 +1,25 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+#
+# Shared, bounded thread pool for running independent Firestore calls concurrently
+#
+
+# Upper bound on the number of Firestore calls in flight from this process at once
+FIRESTORE_MAX_WORKERS = int(os.getenv('FIRESTORE_MAX_WORKERS', '16'))
+
+db_executor = ThreadPoolExecutor(max_workers=FIRESTORE_MAX_WORKERS, thread_name_prefix='firestore')
+
+
+def run_concurrently(calls: List[Callable]) -> List:
+    """
+    Helper function to run independent zero-argument calls on the pool and return their results in order.
+    The calls must not themselves submit work to the pool, or they can starve it.
+    """
+    # A single call gains nothing from a thread hop
+    if len(calls) == 1:
+        return [calls[0]()]
+
+    futures = [db_executor.submit(call) for call in calls]
+    return [future.result() for future in futures]
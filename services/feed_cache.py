@@ -0,0 +1,134 @@
+import os
+from collections import defaultdict
+from typing import Callable, Iterable, List, Optional, Tuple
+from models.post_models import PostModel
+from services.ttl_cache import TTLCache
+
+#
+# In-process LRU + TTL cache of home feed pages, keyed by (user_id, cursor, limit).
+# Writes that change a feed invalidate the affected users' pages, and likes patch the cached counts in place.
+#
+
+# Maximum number of feed pages kept in memory
+FEED_CACHE_MAX_ENTRIES = int(os.getenv('FEED_CACHE_MAX_ENTRIES', '5000'))
+
+# How long a cached page may be served, which bounds staleness from writes on other instances
+FEED_CACHE_TTL_SECONDS = float(os.getenv('FEED_CACHE_TTL_SECONDS', '30'))
+
+
+class FeedCache:
+    """
+    Thread-safe cache of feed pages with per-user and per-post indexes for invalidation
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        # (user_id, cursor, limit) -> (posts, next_cursor)
+        self._pages = TTLCache(max_entries, ttl_seconds, on_remove=self._unindex)
+        self._keys_by_user = defaultdict(set)
+        self._keys_by_post = defaultdict(set)
+
+        # Metrics
+        self.invalidations = 0
+
+    def get(self, user_id: str, cursor: Optional[str], limit: int) -> Optional[Tuple[List[PostModel], Optional[str]]]:
+        """
+        Return the cached (posts, next_cursor) for a feed page, or None on a miss
+        """
+        with self._pages.lock:
+            page = self._pages.get((user_id, cursor, limit))
+            if page is None:
+                return None
+
+            # Hand out copies so that in-place patches never race with response serialization
+            posts, next_cursor = page
+            return [post.model_copy() for post in posts], next_cursor
+
+    def put(self, user_id: str, cursor: Optional[str], limit: int, posts: List[PostModel], next_cursor: Optional[str]) -> None:
+        """
+        Store a feed page, evicting the least recently used pages when the cache is full
+        """
+        key = (user_id, cursor, limit)
+        with self._pages.lock:
+            self._pages.put(key, ([post.model_copy() for post in posts], next_cursor))
+            self._keys_by_user[user_id].add(key)
+            for post in posts:
+                self._keys_by_post[post.id].add(key)
+
+    def invalidate_users(self, user_ids: Iterable[str]) -> None:
+        """
+        Drop every cached page of the given users' feeds
+        """
+        with self._pages.lock:
+            for user_id in user_ids:
+                for key in list(self._keys_by_user.get(user_id, ())):
+                    self._pages.invalidate(key)
+                    self.invalidations += 1
+
+    def invalidate_post(self, post_id: str) -> None:
+        """
+        Drop every cached page that contains the given post
+        """
+        with self._pages.lock:
+            for key in list(self._keys_by_post.get(post_id, ())):
+                self._pages.invalidate(key)
+                self.invalidations += 1
+
+    def apply_like(self, post_id: str, user_id: str, liked: bool) -> None:
+        """
+        Patch the like count of a post in every cached page, and its like state in the liker's own pages
+        """
+        delta = 1 if liked else -1
+
+        def patch(key, post):
+            post.likes_count = max(post.likes_count + delta, 0)
+            if key[0] == user_id:
+                post.isLikedByUser = liked
+
+        self._patch(post_id, patch)
+
+    def apply_comment_count(self, post_id: str, delta: int) -> None:
+        """
+        Patch the comment count of a post in every cached page
+        """
+        def patch(key, post):
+            post.comments_count = max(post.comments_count + delta, 0)
+
+        self._patch(post_id, patch)
+
+    def stats(self) -> dict:
+        """
+        Return the cache's hit/miss metrics
+        """
+        with self._pages.lock:
+            stats = self._pages.stats()
+            stats['invalidations'] = self.invalidations
+            return stats
+
+    def _patch(self, post_id: str, patch: Callable) -> None:
+        with self._pages.lock:
+            for key in list(self._keys_by_post.get(post_id, ())):
+                page = self._pages.peek(key)
+                if page is None:
+                    continue
+                for post in page[0]:
+                    if post.id == post_id:
+                        patch(key, post)
+
+    def _unindex(self, key, page) -> None:
+        # Called by the page cache with its lock held, whenever a page leaves it
+        user_keys = self._keys_by_user.get(key[0])
+        if user_keys is not None:
+            user_keys.discard(key)
+            if not user_keys:
+                del self._keys_by_user[key[0]]
+
+        for post in page[0]:
+            post_keys = self._keys_by_post.get(post.id)
+            if post_keys is not None:
+                post_keys.discard(key)
+                if not post_keys:
+                    del self._keys_by_post[post.id]
+
+
+# Shared instance used by the routers
+feed_cache = FeedCache(FEED_CACHE_MAX_ENTRIES, FEED_CACHE_TTL_SECONDS)
@@ -0,0 +1,144 @@
+import bisect
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+from firebase_configuration import db
+from services.ttl_cache import TTLCache
+
+#
+# In-process LRU + TTL cache of the follow graph: each active user's followed and follower user IDs, loaded once
+# from their following and followers subcollections. This instance's follows and unfollows update the cached sets,
+# and the TTL bounds staleness from follows made on other instances, so relationship checks are lookups.
+# Sets are kept as sorted arrays, which are compact for accounts with many followers and can be paged in ID order.
+#
+
+# Maximum number of users whose sets are kept in memory
+FOLLOW_CACHE_MAX_ENTRIES = int(os.getenv('FOLLOW_CACHE_MAX_ENTRIES', '5000'))
+
+# How long a cached set may be served
+FOLLOW_CACHE_TTL_SECONDS = float(os.getenv('FOLLOW_CACHE_TTL_SECONDS', '300'))
+
+
+class IdSet:
+    """
+    Immutable set of user IDs kept as a sorted list, with binary search membership and paging in ID order
+    """
+
+    def __init__(self, sorted_ids: List[str]):
+        self._ids = sorted_ids
+
+    def __contains__(self, user_id: str) -> bool:
+        position = bisect.bisect_left(self._ids, user_id)
+        return position < len(self._ids) and self._ids[position] == user_id
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._ids)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def page(self, after: Optional[str], limit: int) -> List[str]:
+        """
+        Return up to limit IDs that sort after the given ID, or from the start
+        """
+        start = bisect.bisect_right(self._ids, after) if after is not None else 0
+        return self._ids[start:start + limit]
+
+    def with_id(self, user_id: str) -> 'IdSet':
+        if user_id in self:
+            return self
+        ids = list(self._ids)
+        bisect.insort(ids, user_id)
+        return IdSet(ids)
+
+    def without_id(self, user_id: str) -> 'IdSet':
+        if user_id not in self:
+            return self
+        ids = list(self._ids)
+        del ids[bisect.bisect_left(ids, user_id)]
+        return IdSet(ids)
+
+
+class FollowSetCache:
+    """
+    Thread-safe cache of user ID -> set of the user IDs in one of their relationship subcollections.
+    A load that raced with a follow or unfollow of the same user is not cached.
+    """
+
+    def __init__(self, collection_name: str, max_entries: int, ttl_seconds: float):
+        self.collection_name = collection_name
+        self._sets = TTLCache(max_entries, ttl_seconds)
+
+    def get(self, user_id: str) -> IdSet:
+        """
+        Return the user's set, loading it on a miss
+        """
+        user_ids = self._sets.get(user_id)
+        if user_ids is not None:
+            return user_ids
+
+        # Only the document IDs are needed
+        load_token = self._sets.load_token()
+        user_ids = IdSet(sorted(doc.id for doc in self.collection(user_id).select([]).stream()))
+        self._sets.put(user_id, user_ids, load_token)
+        return user_ids
+
+    def peek(self, user_id: str) -> Optional[IdSet]:
+        """
+        Return the user's set if it is cached, without loading it
+        """
+        return self._sets.get(user_id)
+
+    def collection(self, user_id: str):
+        """
+        Return the relationship subcollection of a user that this cache holds
+        """
+        return db.collection('users').document(user_id).collection(self.collection_name)
+
+    def contains_many(self, user_id: str, other_ids: Iterable[str]) -> Dict[str, bool]:
+        """
+        Return whether each of other_ids is in the user's set
+        """
+        user_ids = self.get(user_id)
+        return {other_id: other_id in user_ids for other_id in other_ids}
+
+    def members(self, user_id: str, other_ids: List[str]) -> Set[str]:
+        """
+        Return which of other_ids are in the user's set, from the set if it is cached, and otherwise by reading
+        only their relationship documents in one round trip rather than loading the whole set
+        """
+        user_ids = self.peek(user_id)
+        if user_ids is not None:
+            return {other_id for other_id in other_ids if other_id in user_ids}
+        if not other_ids:
+            return set()
+
+        collection = self.collection(user_id)
+        return {doc.id for doc in db.get_all([collection.document(other_id) for other_id in other_ids]) if doc.exists}
+
+    def add(self, user_id: str, other_id: str) -> None:
+        """
+        Add a user ID to a cached set after this instance wrote the relationship
+        """
+        self._sets.update(user_id, lambda user_ids: user_ids.with_id(other_id))
+
+    def discard(self, user_id: str, other_id: str) -> None:
+        """
+        Remove a user ID from a cached set after this instance deleted the relationship
+        """
+        self._sets.update(user_id, lambda user_ids: user_ids.without_id(other_id))
+
+    def invalidate(self, user_id: str) -> None:
+        self._sets.invalidate(user_id)
+
+    def stats(self) -> dict:
+        """
+        Return the cache's hit/miss metrics
+        """
+        stats = self._sets.stats()
+        stats['ids'] = sum(len(user_ids) for user_ids in self._sets.values())
+        return stats
+
+
+# Shared instance used by the routers
+following_sets = FollowSetCache('following', FOLLOW_CACHE_MAX_ENTRIES, FOLLOW_CACHE_TTL_SECONDS)
+follower_sets = FollowSetCache('followers', FOLLOW_CACHE_MAX_ENTRIES, FOLLOW_CACHE_TTL_SECONDS)
@@ -0,0 +1,50 @@
+import heapq
+from datetime import datetime
+from itertools import islice
+from typing import List, Optional, Tuple
+from firebase_configuration import db
+from services.db_executor import run_concurrently
+from services.pagination import order_newest_first
+
+#
+# Feed reader for when posts are not fanned out to timelines.
+# It queries the posts of the followed users directly, in chunks that fit Firestore's 'in' limit,
+# and merges the chunk results by timestamp.
+#
+
+# Firestore allows at most 30 values in an 'in' filter
+IN_QUERY_LIMIT = 30
+
+
+def _chunks(values: List[str], size: int) -> List[List[str]]:
+    """
+    Helper function to split a list into consecutive chunks of at most the given size
+    """
+    return [values[start:start + size] for start in range(0, len(values), size)]
+
+
+def _sort_key(post_snapshot):
+    """
+    Helper function to order posts the way the feed queries do, newest first and then by document ID
+    """
+    return post_snapshot.get('timestamp'), post_snapshot.id
+
+
+def fetch_merged_page(author_ids: List[str], limit: int, position: Optional[Tuple[datetime, str]] = None) -> List:
+    """
+    Helper function to return a page of post snapshots written by any of the given authors, newest first.
+    Each chunk query fetches at most `limit` rows from the same position, so the merged page is exact.
+    """
+    def fetch_chunk(chunk: List[str]) -> List:
+        # Every chunk continues from the same position in the global ordering
+        query = order_newest_first(db.collection('posts').where('userId', 'in', chunk), position).limit(limit)
+        return list(query.stream())
+
+    # Run the chunk queries concurrently, since they are independent of each other
+    chunk_results = run_concurrently([
+        lambda chunk=chunk: fetch_chunk(chunk) for chunk in _chunks(author_ids, IN_QUERY_LIMIT)
+    ])
+
+    # Each chunk is already sorted, so a lazy k-way merge can stop as soon as the page is full
+    merged = heapq.merge(*chunk_results, key=_sort_key, reverse=True)
+    return list(islice(merged, limit))
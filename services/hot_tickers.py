@@ -0,0 +1,110 @@
+import asyncio
+import os
+import threading
+import time
+from collections import Counter
+from typing import List
+from firebase_configuration import db
+from services.market_hours import market_session
+from services.quotes import quote_cache
+from services.stock_lists import STOCK_LISTS_FIELD
+
+#
+# Background refresher that keeps the quotes of the tickers in users' stock lists warm.
+# The tickers are ranked by how many stock lists contain them, and refreshed in bulk on a cadence that
+# follows the market session, so upstream traffic grows with the number of distinct tickers, not with users.
+#
+
+# Maximum number of tickers kept warm
+HOT_TICKER_LIMIT = int(os.getenv('HOT_TICKER_LIMIT', '500'))
+
+# The most popular tickers are refreshed every cycle, and the rest every few cycles
+HOT_TICKER_TOP_TIER = int(os.getenv('HOT_TICKER_TOP_TIER', '50'))
+HOT_TICKER_TAIL_EVERY = int(os.getenv('HOT_TICKER_TAIL_EVERY', '4'))
+
+# How often the stock lists are scanned again for popularity
+HOT_TICKER_RECOMPUTE_SECONDS = float(os.getenv('HOT_TICKER_RECOMPUTE_SECONDS', '600'))
+
+# Seconds between refresh cycles in each market session
+REFRESH_INTERVAL_SECONDS = {
+    'regular': float(os.getenv('HOT_TICKER_REGULAR_INTERVAL_SECONDS', '15')),
+    'extended': float(os.getenv('HOT_TICKER_EXTENDED_INTERVAL_SECONDS', '60')),
+    'closed': float(os.getenv('HOT_TICKER_CLOSED_INTERVAL_SECONDS', '900')),
+}
+
+# Metrics of the latest cycles
+_stats = {'tickers': 0, 'cycles': 0, 'last_refreshed': 0, 'last_cycle_seconds': 0.0}
+_stats_lock = threading.Lock()
+
+
+def popular_tickers(limit: int = HOT_TICKER_LIMIT) -> List[str]:
+    """
+    Helper function to rank the tickers across all users' stock lists by the number of lists that contain them
+    """
+    popularity = Counter()
+
+    # Lists stored on user documents
+    for user_doc in db.collection('users').select([STOCK_LISTS_FIELD]).stream():
+        stock_lists = (user_doc.to_dict() or {}).get(STOCK_LISTS_FIELD) or {}
+        for tickers in stock_lists.values():
+            popularity.update({ticker.upper() for ticker in tickers})
+
+    # Lists of users that have not been migrated to the user document yet
+    for stock_list in db.collection_group(STOCK_LISTS_FIELD).select(['tickers']).stream():
+        tickers = (stock_list.to_dict() or {}).get('tickers', [])
+        popularity.update({ticker.upper() for ticker in tickers})
+
+    return [ticker for ticker, _ in popularity.most_common(limit)]
+
+
+def refresh_cycle(ranked_tickers: List[str], cycle: int) -> int:
+    """
+    Refresh one cycle's share of the ranked tickers and return the number refreshed
+    """
+    tickers = ranked_tickers[:HOT_TICKER_TOP_TIER]
+    if cycle % HOT_TICKER_TAIL_EVERY == 0:
+        tickers = ranked_tickers
+
+    started = time.perf_counter()
+    refreshed = quote_cache.refresh(tickers)
+
+    with _stats_lock:
+        _stats['tickers'] = len(ranked_tickers)
+        _stats['cycles'] += 1
+        _stats['last_refreshed'] = refreshed
+        _stats['last_cycle_seconds'] = round(time.perf_counter() - started, 3)
+    return refreshed
+
+
+def stats() -> dict:
+    """
+    Return the refresher's metrics
+    """
+    with _stats_lock:
+        return dict(_stats, session=market_session())
+
+
+async def run_refresher() -> None:
+    """
+    Background loop that refreshes the hot tickers off the event loop
+    """
+    loop = asyncio.get_event_loop()
+    ranked_tickers = []
+    ranked_at = None
+    cycle = 0
+
+    while True:
+        session = market_session()
+        try:
+            # Rescan the stock lists only every so often, since it reads every list
+            if ranked_at is None or time.monotonic() - ranked_at >= HOT_TICKER_RECOMPUTE_SECONDS:
+                ranked_tickers = await loop.run_in_executor(None, popular_tickers)
+                ranked_at = time.monotonic()
+
+            await loop.run_in_executor(None, refresh_cycle, ranked_tickers, cycle)
+            cycle += 1
+
+        except Exception as e:
+            print(f"Hot ticker refresh failed: {e}")
+
+        await asyncio.sleep(REFRESH_INTERVAL_SECONDS[session])
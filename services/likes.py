@@ -0,0 +1,26 @@
+from typing import Iterable, Set
+from firebase_configuration import db
+
+#
+# Helpers for resolving like state for whole pages of posts or comments at once
+#
+
+def get_liked_ids(parent_refs: Iterable, user_id: str) -> Set[str]:
+    """
+    Helper function to return the IDs of the given posts or comments that the user has liked.
+    All of the like documents are fetched with a single multi-document read rather than one read per row.
+    """
+    # Build the reference to the user's like document under each post or comment
+    like_refs = [parent_ref.collection('likes').document(user_id) for parent_ref in parent_refs]
+
+    # Avoid a round trip when there is nothing to look up
+    if not like_refs:
+        return set()
+
+    # The snapshots come back in no particular order, so join them back by the parent document ID
+    liked_ids = set()
+    for like_snapshot in db.get_all(like_refs):
+        if like_snapshot.exists:
+            liked_ids.add(like_snapshot.reference.parent.parent.id)
+
+    return liked_ids
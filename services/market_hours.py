@@ -0,0 +1,43 @@
+from datetime import datetime, time as clock_time, timedelta
+from typing import Optional
+import pytz
+
+#
+# US equity market sessions, used to decide how often quotes can change.
+# Exchange holidays are not modelled, so they are treated as regular trading days.
+#
+
+MARKET_TIMEZONE = pytz.timezone('America/New_York')
+
+PRE_MARKET_OPEN = clock_time(4, 0)
+REGULAR_OPEN = clock_time(9, 30)
+REGULAR_CLOSE = clock_time(16, 0)
+AFTER_HOURS_CLOSE = clock_time(20, 0)
+
+
+def market_session(now: Optional[datetime] = None) -> str:
+    """
+    Helper function to return 'regular', 'extended' or 'closed' for the given time, or for now
+    """
+    now = (now or datetime.now(pytz.UTC)).astimezone(MARKET_TIMEZONE)
+
+    # Saturday and Sunday
+    if now.weekday() >= 5:
+        return 'closed'
+
+    current_time = now.time()
+    if REGULAR_OPEN <= current_time < REGULAR_CLOSE:
+        return 'regular'
+    if PRE_MARKET_OPEN <= current_time < AFTER_HOURS_CLOSE:
+        return 'extended'
+    return 'closed'
+
+
+def seconds_until_next_market_day(now: Optional[datetime] = None) -> float:
+    """
+    Helper function to return the number of seconds from the given time, or from now, to the next midnight
+    in the market's timezone
+    """
+    now = (now or datetime.now(pytz.UTC)).astimezone(MARKET_TIMEZONE)
+    next_day = MARKET_TIMEZONE.localize(datetime.combine(now.date() + timedelta(days=1), clock_time(0, 0)))
+    return (next_day - now).total_seconds()
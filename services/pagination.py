@@ -0,0 +1,126 @@
+import base64
+import hashlib
+import hmac
+import os
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+import pytz
+from fastapi import HTTPException, Response
+from firebase_admin import firestore
+
+#
+# Opaque keyset pagination cursors.
+# A cursor encodes the (timestamp, document ID) of the last row of a page and is signed,
+# so the next page query can start after it without reading that document again.
+#
+
+# Response header that carries the cursor for the next page
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+# Secret used to sign cursors. Every instance of the backend must be deployed with the same value, so that a cursor
+# issued by one instance is accepted by the others and survives restarts. It is only required once a cursor is used.
+CURSOR_SECRET = os.getenv('CURSOR_SECRET')
+
+# Number of signature bytes kept in a cursor
+_SIGNATURE_BYTES = 16
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=pytz.UTC)
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _cursor_secret() -> bytes:
+    if not CURSOR_SECRET:
+        raise ValueError("The CURSOR_SECRET environment variable is not set")
+    return CURSOR_SECRET.encode()
+
+
+def _sign(payload: bytes, secret: bytes) -> bytes:
+    return hmac.new(secret, payload, hashlib.sha256).digest()[:_SIGNATURE_BYTES]
+
+
+def encode_cursor(timestamp: datetime, doc_id: str) -> str:
+    """
+    Helper function to encode the position of a row as an opaque, signed cursor
+    """
+    # Integer microseconds keep the exact Firestore timestamp, which a float would not
+    micros = (timestamp - _EPOCH) // timedelta(microseconds=1)
+    payload = f'{micros}:{doc_id}'.encode()
+    return f'{_b64encode(payload)}.{_b64encode(_sign(payload, _cursor_secret()))}'
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """
+    Helper function to decode a cursor back into the (timestamp, document ID) position it encodes
+    """
+    # A missing secret is a deployment error, not a bad cursor
+    secret = _cursor_secret()
+
+    try:
+        encoded_payload, encoded_signature = cursor.split('.', 1)
+        payload = _b64decode(encoded_payload)
+        if not hmac.compare_digest(_sign(payload, secret), _b64decode(encoded_signature)):
+            raise ValueError("signature mismatch")
+
+        micros, doc_id = payload.decode().split(':', 1)
+        return _EPOCH + timedelta(microseconds=int(micros)), doc_id
+
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def cursor_for_page(rows, limit: int) -> Optional[str]:
+    """
+    Helper function to return the cursor for the page after the given rows, or None if this was the last page
+    """
+    if not rows or len(rows) < limit:
+        return None
+
+    last_row = rows[-1]
+    return encode_cursor(last_row.get('timestamp'), last_row.id)
+
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]) -> None:
+    """
+    Helper function to return the next page's cursor in the response headers, when there is a next page
+    """
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+
+def resolve_start_position(cursor: Optional[str], start_after: Optional[str], collection_ref,
+                           not_found_detail: str) -> Optional[Tuple[datetime, str]]:
+    """
+    Helper function to turn the pagination query parameters into a (timestamp, document ID) position.
+    Legacy start_after document IDs still cost one read, while cursors cost none.
+    """
+    if cursor:
+        return decode_cursor(cursor)
+
+    if start_after:
+        start_after_doc = collection_ref.document(start_after).get()
+        if not start_after_doc.exists:
+            raise HTTPException(status_code=404, detail=not_found_detail)
+        return start_after_doc.get('timestamp'), start_after_doc.id
+
+    return None
+
+
+def order_newest_first(query, position: Optional[Tuple[datetime, str]] = None):
+    """
+    Helper function to order a query newest first, breaking ties by document ID, and start it after a position
+    """
+    query = query.order_by('timestamp', direction=firestore.Query.DESCENDING) \
+        .order_by('__name__', direction=firestore.Query.DESCENDING)
+
+    if position is not None:
+        timestamp, doc_id = position
+        query = query.start_after({'timestamp': timestamp, '__name__': doc_id})
+
+    return query
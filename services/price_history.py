@@ -0,0 +1,286 @@
+import math
+import os
+import re
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+import numpy as np
+import pytz
+import yfinance as yf
+from services.ttl_cache import TTLCache
+
+#
+# Columnar store of daily OHLCV bars, with one memory-mapped file per ticker.
+# A file is a small header followed by one fixed-capacity int64/float64 column per field:
+#
+#   header: magic, version, capacity, count, 0...   (8 x int64)
+#   columns: timestamp | open | high | low | close | volume   (capacity x 8 bytes each)
+#
+# Bars are only ever appended (or the latest bar replaced) and the count is written last, so readers always
+# see a consistent prefix. Range slicing and downsampling return views of the mapped columns without copying.
+#
+
+# Directory holding the ticker files
+PRICE_HISTORY_DIR = os.getenv('PRICE_HISTORY_DIR', os.path.join('data', 'price_history'))
+
+# How long a ticker's bars are served before new bars are fetched
+PRICE_HISTORY_REFRESH_SECONDS = float(os.getenv('PRICE_HISTORY_REFRESH_SECONDS', '3600'))
+
+# Maximum number of ticker files kept mapped, each of which holds one file descriptor
+PRICE_HISTORY_MAX_OPEN_FILES = int(os.getenv('PRICE_HISTORY_MAX_OPEN_FILES', '256'))
+
+# How far back the bars of a ticker go when it is first fetched
+PRICE_HISTORY_BACKFILL_PERIOD = os.getenv('PRICE_HISTORY_BACKFILL_PERIOD', '5y')
+
+COLUMNS = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+
+_MAGIC = 0x5453494850  # "PHIST"
+_VERSION = 1
+_HEADER_FIELDS = 8
+_HEADER_BYTES = _HEADER_FIELDS * 8
+_MIN_CAPACITY = 4096
+
+# Tickers become file names, so only symbol characters are allowed
+_TICKER_PATTERN = re.compile(r'^[A-Z0-9.\-^=]{1,20}$')
+
+
+class TickerHistory:
+    """
+    Memory-mapped bars of one ticker. The file is mapped once, and the header and columns are views of that map.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._maps = None
+        self.capacity = self._mapping()[2]
+
+    def _mapping(self) -> Tuple[np.ndarray, np.ndarray, int, Dict[str, np.ndarray]]:
+        # Returns (header, data, capacity, columns), mapping the file again if the history was closed
+        maps = self._maps
+        if maps is not None:
+            return maps
+
+        data = np.memmap(self.path, dtype=np.uint8, mode='r+')
+        header = data[:_HEADER_BYTES].view(np.int64)
+        if header[0] != _MAGIC or header[1] != _VERSION:
+            raise ValueError(f"{self.path} is not a price history file")
+
+        capacity = int(header[2])
+        columns = {}
+        for index, name in enumerate(COLUMNS):
+            offset = _HEADER_BYTES + index * capacity * 8
+            columns[name] = data[offset:offset + capacity * 8].view(np.int64 if name == 'timestamp' else np.float64)
+
+        self._maps = (header, data, capacity, columns)
+        return self._maps
+
+    def close(self) -> None:
+        """
+        Release this object's map of the file, which is unmapped as soon as no views of it are left.
+        A closed history maps the file again if it is used after all.
+        """
+        self._maps = None
+
+    @property
+    def header(self) -> np.ndarray:
+        return self._mapping()[0]
+
+    @property
+    def columns(self) -> Dict[str, np.ndarray]:
+        return self._mapping()[3]
+
+    @property
+    def count(self) -> int:
+        return int(self.header[3])
+
+    @staticmethod
+    def create(path: str, capacity: int) -> 'TickerHistory':
+        """
+        Create an empty file with room for the given number of bars
+        """
+        with open(path, 'wb') as file:
+            file.truncate(_HEADER_BYTES + len(COLUMNS) * capacity * 8)
+
+        header = np.memmap(path, dtype=np.int64, mode='r+', shape=(_HEADER_FIELDS,))
+        header[:4] = (_MAGIC, _VERSION, capacity, 0)
+        header.flush()
+        del header
+        return TickerHistory(path)
+
+    def view(self, start: Optional[int] = None, end: Optional[int] = None,
+             points: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """
+        Return views of the bars with start <= timestamp <= end, thinned out to at most the given number of points.
+        Thinning keeps every k-th bar, ending on the latest one, so no column is copied.
+        """
+        header, _, _, columns = self._mapping()
+        count = int(header[3])
+        timestamps = columns['timestamp'][:count]
+        low = 0 if start is None else int(np.searchsorted(timestamps, start, side='left'))
+        high = count if end is None else int(np.searchsorted(timestamps, end, side='right'))
+
+        window = slice(low, high)
+        length = high - low
+        if points and length > points:
+            step = -(-length // points)
+            window = slice(low + (length - 1) % step, high, step)
+
+        return {name: column[window] for name, column in columns.items()}
+
+    def write(self, bars: Dict[str, np.ndarray]) -> int:
+        """
+        Append bars newer than the latest stored bar, replacing the latest one if it is given again.
+        The caller must make sure there is enough capacity. Returns the number of bars written.
+        """
+        header, data, _, columns = self._mapping()
+        count = int(header[3])
+        timestamps = bars['timestamp']
+        first = 0
+        if count:
+            first = int(np.searchsorted(timestamps, columns['timestamp'][count - 1], side='left'))
+        new_bars = len(timestamps) - first
+        if new_bars <= 0:
+            return 0
+
+        # The first new bar replaces the latest stored bar when it has the same timestamp, e.g. today's partial bar
+        position = count
+        if count and timestamps[first] == columns['timestamp'][count - 1]:
+            position = count - 1
+
+        for name in COLUMNS:
+            columns[name][position:position + new_bars] = bars[name][first:]
+        data.flush()
+
+        # Publish the bars only once they are written
+        header[3] = position + new_bars
+        data.flush()
+        return new_bars
+
+
+class PriceHistoryStore:
+    """
+    Opens the ticker files, keeps the most recently used ones mapped, and tops them up from the upstream
+    """
+
+    def __init__(self, directory: str, max_open: int):
+        self.directory = directory
+
+        # key -> TickerHistory, whose map is released when it is evicted or replaced
+        self._histories = TTLCache(max_open, math.inf, on_remove=lambda key, history: history.close())
+        # Tickers fetched within the refresh interval, including those the upstream had no bars for.
+        # Entries are small, so many more are kept than open files.
+        self._refreshed = TTLCache(max_open * 16, PRICE_HISTORY_REFRESH_SECONDS)
+        # key -> [lock, number of requests using it], dropped once no request uses it
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, ticker: str) -> TickerHistory:
+        """
+        Return the bars of a ticker, fetching new bars first when they are older than the refresh interval
+        """
+        key = ticker.upper()
+        if not _TICKER_PATTERN.match(key):
+            raise KeyError(f"Invalid ticker {ticker}")
+
+        # Only one request per ticker fetches, and the others wait for its bars
+        with self._ticker_lock(key):
+            history = self._open(key)
+            if self._refreshed.get(key) is None:
+                try:
+                    history = self._refresh(key, history)
+                except Exception as e:
+                    # Serve the stored bars when the upstream fails, unless there are none at all
+                    if history is None or not history.count:
+                        raise
+                    print(f"Failed to refresh price history of {key}: {e}")
+                self._refreshed.put(key, True)
+
+        if history is None or not history.count:
+            raise KeyError(f"No price history for {key}")
+        return history
+
+    @contextmanager
+    def _ticker_lock(self, key: str):
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    def _open(self, key: str) -> Optional[TickerHistory]:
+        history = self._histories.get(key)
+        if history is None:
+            path = self._path(key)
+            if os.path.exists(path):
+                history = TickerHistory(path)
+                self._histories.put(key, history)
+        return history
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.bars')
+
+    def _refresh(self, key: str, history: Optional[TickerHistory]) -> Optional[TickerHistory]:
+        # Fetch only the bars since the latest stored one
+        if history is not None and history.count:
+            latest = datetime.fromtimestamp(int(history.columns['timestamp'][history.count - 1]), pytz.UTC)
+            frame = yf.Ticker(key).history(start=latest.strftime('%Y-%m-%d'), interval='1d', auto_adjust=False)
+        else:
+            frame = yf.Ticker(key).history(period=PRICE_HISTORY_BACKFILL_PERIOD, interval='1d', auto_adjust=False)
+
+        if frame.empty:
+            return history
+
+        bars, length = _frame_to_bars(frame)
+        needed = (history.count if history is not None else 0) + length
+        if history is None or needed > history.capacity:
+            history = self._grow(key, history, needed)
+
+        history.write(bars)
+        return history
+
+    def _grow(self, key: str, history: Optional[TickerHistory], needed: int) -> TickerHistory:
+        # Copy the bars into a new file with twice the room and swap it in. Replacing the cached history releases
+        # the old map, which readers that still hold views of it keep alive until they are done.
+        capacity = max(_MIN_CAPACITY, needed * 2)
+        path = self._path(key)
+        os.makedirs(self.directory, exist_ok=True)
+        new_history = TickerHistory.create(path + '.tmp', capacity)
+        if history is not None and history.count:
+            new_history.write({name: np.asarray(column[:history.count]) for name, column in history.columns.items()})
+        new_history.close()
+
+        os.replace(path + '.tmp', path)
+        new_history = TickerHistory(path)
+        self._histories.put(key, new_history)
+        return new_history
+
+
+def _frame_to_bars(frame) -> Tuple[Dict[str, np.ndarray], int]:
+    """
+    Helper function to turn a yfinance history frame into sorted column arrays
+    """
+    # Bars without a close are unusable, and other gaps are stored as zero
+    frame = frame.dropna(subset=['Close']).fillna(0)
+    index = frame.index.tz_convert('UTC').tz_localize(None) if frame.index.tz is not None else frame.index
+    bars = {
+        'timestamp': np.asarray(index, dtype='datetime64[s]').astype(np.int64),
+        'open': frame['Open'].to_numpy(dtype=np.float64),
+        'high': frame['High'].to_numpy(dtype=np.float64),
+        'low': frame['Low'].to_numpy(dtype=np.float64),
+        'close': frame['Close'].to_numpy(dtype=np.float64),
+        'volume': frame['Volume'].to_numpy(dtype=np.float64),
+    }
+    order = np.argsort(bars['timestamp'], kind='stable')
+    return {name: column[order] for name, column in bars.items()}, len(order)
+
+
+# Shared instance used by the routers
+price_history = PriceHistoryStore(PRICE_HISTORY_DIR, PRICE_HISTORY_MAX_OPEN_FILES)
@@ -0,0 +1,152 @@
+import asyncio
+import os
+import time
+from typing import Dict, Iterable
+from services.market_hours import market_session
+from services.quotes import quote_cache
+
+#
+# Shared broadcaster of live prices for the /stock/stream endpoint.
+# One refresh loop reads the union of every subscriber's tickers from the quote cache, and each subscriber
+# only receives the prices that changed since it was last sent them. Everything here runs on the event loop.
+#
+
+# Seconds between broadcasts in each market session
+STREAM_INTERVAL_SECONDS = {
+    'regular': float(os.getenv('STREAM_REGULAR_INTERVAL_SECONDS', '5')),
+    'extended': float(os.getenv('STREAM_EXTENDED_INTERVAL_SECONDS', '30')),
+    'closed': float(os.getenv('STREAM_CLOSED_INTERVAL_SECONDS', '300')),
+}
+
+
+class Subscription:
+    """
+    One connected client, with the price changes not yet delivered to it
+    """
+
+    def __init__(self, tickers: Iterable[str]):
+        self.tickers = {ticker.upper() for ticker in tickers}
+        self.event = asyncio.Event()
+
+        # Latest price sent for each ticker, and the changes waiting to be sent
+        self._sent = {}
+        self._pending = {}
+        self.pending_since = None
+
+    def publish(self, quotes: Dict) -> None:
+        """
+        Queue the prices that differ from what this client was last sent.
+        Changes that arrive before the client reads them are merged, so a slow client only gets the latest prices.
+        """
+        for ticker in self.tickers:
+            quote = quotes.get(ticker)
+            if quote is None or self._sent.get(ticker) == quote.price:
+                continue
+            self._sent[ticker] = quote.price
+            self._pending[ticker] = quote.price
+
+        if self._pending:
+            if self.pending_since is None:
+                self.pending_since = time.perf_counter()
+            self.event.set()
+
+    def take(self) -> Dict[str, float]:
+        """
+        Return and clear the pending price changes
+        """
+        delta = self._pending
+        self._pending = {}
+        self.pending_since = None
+        self.event.clear()
+        return delta
+
+
+class PriceBroadcaster:
+    """
+    Runs the shared refresh loop while at least one client is subscribed, and keeps connection metrics
+    """
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._task = None
+
+        # Metrics
+        self.connections_total = 0
+        self.broadcasts = 0
+        self.messages = 0
+        self.last_fanout_ms = 0.0
+        self._delivery_ms_total = 0.0
+
+    async def subscribe(self, tickers: Iterable[str]) -> Subscription:
+        """
+        Add a client and send it the current prices of its tickers straight away
+        """
+        subscription = Subscription(tickers)
+        self._subscriptions.add(subscription)
+        self.connections_total += 1
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+        quotes = await asyncio.get_event_loop().run_in_executor(None, quote_cache.get_many, subscription.tickers)
+        subscription.publish(quotes)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscriptions.discard(subscription)
+
+    def take(self, subscription: Subscription) -> Dict[str, float]:
+        """
+        Return a client's pending price changes, recording how long they waited to be delivered
+        """
+        pending_since = subscription.pending_since
+        delta = subscription.take()
+        if delta:
+            self.messages += 1
+            if pending_since is not None:
+                self._delivery_ms_total += (time.perf_counter() - pending_since) * 1000
+        return delta
+
+    def stats(self) -> dict:
+        """
+        Return the stream's connection and fan-out metrics
+        """
+        tickers = set()
+        for subscription in self._subscriptions:
+            tickers |= subscription.tickers
+
+        return {
+            'connections': len(self._subscriptions),
+            'connections_total': self.connections_total,
+            'tickers': len(tickers),
+            'broadcasts': self.broadcasts,
+            'messages': self.messages,
+            'last_fanout_ms': round(self.last_fanout_ms, 3),
+            'average_delivery_ms': round(self._delivery_ms_total / self.messages, 3) if self.messages else 0.0,
+        }
+
+    async def _run(self) -> None:
+        loop = asyncio.get_event_loop()
+        while self._subscriptions:
+            # One lookup for the union of all subscribers' tickers, however many subscribers share them
+            tickers = set()
+            for subscription in self._subscriptions:
+                tickers |= subscription.tickers
+
+            try:
+                quotes = await loop.run_in_executor(None, quote_cache.get_many, tickers)
+            except Exception as e:
+                print(f"Price stream refresh failed: {e}")
+                quotes = {}
+
+            started = time.perf_counter()
+            for subscription in list(self._subscriptions):
+                subscription.publish(quotes)
+            self.last_fanout_ms = (time.perf_counter() - started) * 1000
+            self.broadcasts += 1
+
+            await asyncio.sleep(STREAM_INTERVAL_SECONDS[market_session()])
+
+
+# Shared instance used by the routers
+price_broadcaster = PriceBroadcaster()
@@ -0,0 +1,259 @@
+import os
+from typing import Dict, Iterable, List, Optional
+from firebase_configuration import db
+from models.user_models import AuthorModel, UserModel
+from services.stock_lists import STOCK_LISTS_FIELD, stock_lists_of_user
+from services.tombstones import is_tombstoned
+from services.ttl_cache import TTLCache
+
+#
+# In-process LRU + TTL cache of user profiles and stock lists, keyed by user ID.
+# Profiles are kept as validated UserModels without their stock lists, and stock lists separately, since most
+# profile reads do not need them. This instance's own writes update the cached copies in place, and the TTL
+# bounds staleness from writes on other instances.
+#
+
+# Maximum number of profiles, and separately of stock list sets, kept in memory
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv('PROFILE_CACHE_MAX_ENTRIES', '20000'))
+
+# How long a cached profile or stock list set may be served
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv('PROFILE_CACHE_TTL_SECONDS', '60'))
+
+
+class ProfileCache:
+    """
+    Thread-safe cache of user ID -> profile and user ID -> stock lists.
+    A read that raced with a write to the same user is not cached.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        # user_id -> UserModel and user_id -> {list name: tickers}
+        self._profiles = TTLCache(max_entries, ttl_seconds)
+        self._stock_lists = TTLCache(max_entries, ttl_seconds)
+
+    def load_token(self) -> float:
+        """
+        Return a token to pass to put_profile / put_stock_lists, taken before reading from Firestore
+        """
+        return self._profiles.load_token()
+
+    def get_profile(self, user_id: str) -> Optional[UserModel]:
+        """
+        Return a copy of the cached profile, or None on a miss
+        """
+        profile = self._profiles.get(user_id)
+        return profile.model_copy() if profile is not None else None
+
+    def get_stock_lists(self, user_id: str) -> Optional[Dict[str, List[str]]]:
+        """
+        Return a copy of the cached stock lists, or None on a miss
+        """
+        stock_lists = self._stock_lists.get(user_id)
+        return {name: list(tickers) for name, tickers in stock_lists.items()} if stock_lists is not None else None
+
+    def put_profile(self, user_id: str, profile: UserModel, load_token: Optional[float] = None) -> None:
+        """
+        Store a profile, either written by this instance (no load_token) or read from Firestore,
+        unless the user was written since load_token was taken
+        """
+        self._profiles.put(user_id, profile.model_copy(update={'stockLists': None}), load_token)
+
+    def put_stock_lists(self, user_id: str, stock_lists: Dict[str, List[str]], load_token: Optional[float] = None) -> None:
+        """
+        Store a user's stock lists, either written by this instance (no load_token) or read from Firestore,
+        unless the user's lists were written since load_token was taken
+        """
+        self._stock_lists.put(user_id, {name: list(tickers) for name, tickers in stock_lists.items()}, load_token)
+
+    def update_profile(self, user_id: str, **fields) -> None:
+        """
+        Patch fields of a cached profile after this instance wrote them
+        """
+        self._profiles.update(user_id, lambda profile: profile.model_copy(update=fields))
+
+    def add_follow_counts(self, user_id: str, followers: int = 0, following: int = 0) -> None:
+        """
+        Patch the follower and following counts of a cached profile
+        """
+        self._profiles.update(user_id, lambda profile: profile.model_copy(update={
+            'followers_count': max(profile.followers_count + followers, 0),
+            'following_count': max(profile.following_count + following, 0),
+        }))
+
+    def set_stock_list(self, user_id: str, name: str, tickers: List[str], replaces: Optional[str] = None) -> None:
+        """
+        Patch a created or replaced list, or a list renamed from replaces, into a user's cached stock lists
+        """
+        def change(stock_lists):
+            stock_lists = dict(stock_lists)
+            if replaces is not None:
+                stock_lists.pop(replaces, None)
+            stock_lists[name] = list(tickers)
+            return stock_lists
+
+        self._stock_lists.update(user_id, change)
+
+    def remove_stock_list(self, user_id: str, name: str) -> None:
+        """
+        Remove a deleted list from a user's cached stock lists
+        """
+        self._stock_lists.update(
+            user_id, lambda stock_lists: {list_name: tickers for list_name, tickers in stock_lists.items() if list_name != name}
+        )
+
+    def invalidate(self, user_id: str) -> None:
+        """
+        Drop a user's cached profile and stock lists
+        """
+        self._profiles.invalidate(user_id)
+        self._stock_lists.invalidate(user_id)
+
+    def stats(self) -> dict:
+        """
+        Return the cache's hit/miss metrics
+        """
+        profile_stats = self._profiles.stats()
+        stock_list_stats = self._stock_lists.stats()
+        hits = profile_stats['hits'] + stock_list_stats['hits']
+        lookups = hits + profile_stats['misses'] + stock_list_stats['misses']
+        return {
+            'profiles': profile_stats['entries'],
+            'stock_lists': stock_list_stats['entries'],
+            'hits': hits,
+            'misses': lookups - hits,
+            'hit_rate': hits / lookups if lookups else 0.0,
+        }
+
+
+def _cache_profile_doc(user_doc, load_token: float) -> Optional[UserModel]:
+    # Convert and cache a user document, or return None if the user does not exist
+    if not user_doc.exists or is_tombstoned(user_doc):
+        return None
+
+    user_data = user_doc.to_dict()
+    user_data.pop(STOCK_LISTS_FIELD, None)
+    profile = UserModel(**user_data)
+    profile_cache.put_profile(user_doc.id, profile, load_token)
+    return profile
+
+
+def _read_profile(user_id: str) -> Optional[UserModel]:
+    # Read a profile from Firestore and cache it
+    load_token = profile_cache.load_token()
+    return _cache_profile_doc(db.collection('users').document(user_id).get(), load_token)
+
+
+def _read_stock_lists(user_id: str) -> Dict[str, List[str]]:
+    # Read a user's stock lists from their document and cache them
+    load_token = profile_cache.load_token()
+    stock_lists = stock_lists_of_user(db.collection('users').document(user_id).get())
+    profile_cache.put_stock_lists(user_id, stock_lists, load_token)
+    return stock_lists
+
+
+def get_profile(user_id: str) -> Optional[UserModel]:
+    """
+    Helper function to return a user's profile without stock lists, or None if the user does not exist
+    """
+    profile = profile_cache.get_profile(user_id)
+    return profile if profile is not None else _read_profile(user_id)
+
+
+def get_profiles(user_ids: Iterable[str]) -> Dict[str, UserModel]:
+    """
+    Helper function to return the profiles of the existing users among user_ids, by user ID.
+    Every uncached profile is read in one round trip, however many times its ID is repeated.
+    """
+    profiles = {}
+    missing_ids = []
+    for user_id in dict.fromkeys(user_ids):
+        profile = profile_cache.get_profile(user_id)
+        if profile is not None:
+            profiles[user_id] = profile
+        else:
+            missing_ids.append(user_id)
+
+    if missing_ids:
+        load_token = profile_cache.load_token()
+        users_ref = db.collection('users')
+        for user_doc in db.get_all([users_ref.document(user_id) for user_id in missing_ids]):
+            profile = _cache_profile_doc(user_doc, load_token)
+            if profile is not None:
+                profiles[user_doc.id] = profile
+
+    return profiles
+
+
+def author_snippet(profile: UserModel) -> AuthorModel:
+    return AuthorModel(
+        id=profile.id,
+        username=profile.username,
+        name=profile.name,
+        profile_image_url=profile.profile_image_url,
+    )
+
+
+def attach_authors(items: List) -> None:
+    """
+    Helper function to set the author of each post or comment in a page, resolving all of their authors together.
+    Authors that no longer exist are left unset.
+    """
+    profiles = get_profiles(item.userId for item in items)
+    snippets = {user_id: author_snippet(profile) for user_id, profile in profiles.items()}
+    for item in items:
+        item.author = snippets.get(item.userId)
+
+
+def without_deleted_authors(items: List, include_authors: bool = False) -> List:
+    """
+    Helper function to drop the posts or comments of a page whose author was deleted, resolving all of their
+    authors together, so deleted users' content disappears before the sweeper tombstones it.
+    When include_authors is set, the remaining items also get their author.
+    """
+    profiles = get_profiles(item.userId for item in items)
+    visible_items = [item for item in items if item.userId in profiles]
+
+    if include_authors:
+        snippets = {user_id: author_snippet(profile) for user_id, profile in profiles.items()}
+        for item in visible_items:
+            item.author = snippets[item.userId]
+    return visible_items
+
+
+def get_stock_lists(user_id: str) -> Dict[str, List[str]]:
+    """
+    Helper function to return a user's stock lists, as list name -> tickers
+    """
+    stock_lists = profile_cache.get_stock_lists(user_id)
+    return stock_lists if stock_lists is not None else _read_stock_lists(user_id)
+
+
+def get_profile_with_stock_lists(user_id: str) -> Optional[UserModel]:
+    """
+    Helper function to return a user's profile with their stock lists, or None if the user does not exist.
+    Both are kept on the user document, so whatever is missing from the cache takes one read.
+    """
+    profile = profile_cache.get_profile(user_id)
+    stock_lists = profile_cache.get_stock_lists(user_id)
+
+    if profile is None and stock_lists is None:
+        load_token = profile_cache.load_token()
+        user_doc = db.collection('users').document(user_id).get()
+        profile = _cache_profile_doc(user_doc, load_token)
+        if profile is not None:
+            stock_lists = stock_lists_of_user(user_doc)
+            profile_cache.put_stock_lists(user_id, stock_lists, load_token)
+    elif profile is None:
+        profile = _read_profile(user_id)
+    elif stock_lists is None:
+        stock_lists = _read_stock_lists(user_id)
+
+    if profile is None:
+        return None
+
+    profile.stockLists = stock_lists
+    return profile
+
+
+# Shared instance used by the routers
+profile_cache = ProfileCache(PROFILE_CACHE_MAX_ENTRIES, PROFILE_CACHE_TTL_SECONDS)
@@ -0,0 +1,243 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Optional, Tuple
+import yfinance as yf
+from services.market_hours import market_session
+from services.ttl_cache import TTLCache
+
+#
+# In-process cache of stock quotes from yfinance.
+# Ticker.info is a slow scrape of about 150 fields, so each ticker is fetched at most once per TTL and
+# only the fields the endpoints use are kept. Concurrent misses for a ticker share one upstream fetch,
+# and a recently expired quote is served while it is refreshed in the background.
+#
+
+# Maximum number of tickers kept in memory
+QUOTE_CACHE_MAX_ENTRIES = int(os.getenv('QUOTE_CACHE_MAX_ENTRIES', '5000'))
+
+# How long a quote is served without being refreshed
+QUOTE_TTL_SECONDS = float(os.getenv('QUOTE_TTL_SECONDS', '15'))
+
+# How long a quote is served without being refreshed while the market is closed and prices do not move
+QUOTE_CLOSED_TTL_SECONDS = float(os.getenv('QUOTE_CLOSED_TTL_SECONDS', '900'))
+
+# How long after being fetched an expired quote is still served immediately, while it is refreshed in the background
+QUOTE_STALE_SECONDS = float(os.getenv('QUOTE_STALE_SECONDS', '600'))
+
+# How long a request waits for the upstream before falling back to an older quote
+QUOTE_FETCH_TIMEOUT_SECONDS = float(os.getenv('QUOTE_FETCH_TIMEOUT_SECONDS', '10'))
+
+# Number of upstream fetches in flight at once, which also bounds the fan-out of a multi-ticker request
+QUOTE_FETCH_WORKERS = int(os.getenv('QUOTE_FETCH_WORKERS', '16'))
+
+
+class Quote:
+    """
+    The fields of a ticker's info that the stock endpoints use
+    """
+
+    __slots__ = (
+        'symbol', 'name', 'price', 'current_price', 'open_price', 'volume', 'high', 'low', 'market_cap',
+        'average_volume', 'fifty_two_week_high', 'fifty_two_week_low', 'pe_ratio', 'overnight_volume',
+        'description', 'fetched_at',
+    )
+
+    def __init__(self, info: dict, fetched_at: float):
+        self.symbol = info.get('symbol', 'N/A')
+        self.name = info.get('shortName', 'N/A')
+
+        # Attempt to retrieve price from multiple possible fields
+        self.price = info.get('currentPrice') or info.get('previousClose') or info.get('lastClose', 0.0)
+
+        self.current_price = info.get('currentPrice')
+        self.open_price = info.get('open')
+        self.volume = info.get('volume')
+        self.high = info.get('dayHigh')
+        self.low = info.get('dayLow')
+        self.market_cap = info.get('marketCap')
+        self.average_volume = info.get('averageVolume')
+        self.fifty_two_week_high = info.get('fiftyTwoWeekHigh')
+        self.fifty_two_week_low = info.get('fiftyTwoWeekLow')
+        self.pe_ratio = info.get('trailingPE')
+        self.overnight_volume = info.get('regularMarketVolume')
+        self.description = info.get('longBusinessSummary')
+        self.fetched_at = fetched_at
+
+    def to_info(self) -> dict:
+        """
+        Return the detailed statistics served by /stock/info
+        """
+        return {
+            "current_price": self.current_price,
+            "open_price": self.open_price,
+            "volume": self.volume,
+            "high": self.high,
+            "low": self.low,
+            "market_cap": self.market_cap,
+            "average_volume": self.average_volume,
+            "52_week_high": self.fifty_two_week_high,
+            "52_week_low": self.fifty_two_week_low,
+            "pe_ratio": self.pe_ratio,
+            "overnight_volume": self.overnight_volume,
+            "description": self.description,
+            "price": self.price,
+        }
+
+
+class QuoteCache:
+    """
+    Thread-safe LRU + TTL cache of quotes with single-flight upstream fetches
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, closed_ttl_seconds: float, stale_seconds: float,
+                 fetch_timeout: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.closed_ttl_seconds = closed_ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.fetch_timeout = fetch_timeout
+
+        # ticker -> Quote, kept until no lookup could still serve it
+        self._quotes = TTLCache(max_entries, max(ttl_seconds, closed_ttl_seconds, stale_seconds))
+        # ticker -> Future of the upstream fetch in flight
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=QUOTE_FETCH_WORKERS, thread_name_prefix='quotes')
+
+        # Metrics
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.upstream_errors = 0
+        self.stale_fallbacks = 0
+
+    def get(self, ticker: str) -> Quote:
+        """
+        Return the quote of a ticker, fetching it from the upstream only when no usable quote is cached.
+        Raises the upstream error when the fetch fails and no older quote is available.
+        """
+        key = ticker.upper()
+        with self._lock:
+            quote, future = self._lookup(key)
+
+        if future is None:
+            return quote
+        return self._resolve(key, future, quote, self.fetch_timeout)
+
+    def get_many(self, tickers: Iterable[str]) -> Dict[str, Optional[Quote]]:
+        """
+        Return the quotes of several tickers, fetching all of the missing ones concurrently.
+        A ticker whose fetch fails maps to its last known quote, or to None when there is none.
+        """
+        keys = {ticker: ticker.upper() for ticker in tickers}
+        quotes = {}
+        futures = {}
+        with self._lock:
+            for key in set(keys.values()):
+                quotes[key], future = self._lookup(key)
+                if future is not None:
+                    futures[key] = future
+
+        # Wait for the fetches together, so the request takes about as long as the slowest one
+        wait(futures.values(), timeout=self.fetch_timeout)
+
+        for key, future in futures.items():
+            try:
+                quotes[key] = self._resolve(key, future, quotes[key], 0)
+            except Exception as e:
+                print(f"Quote not available for {key}: {e}")
+                quotes[key] = None
+
+        return {ticker: quotes[key] for ticker, key in keys.items()}
+
+    def refresh(self, tickers: Iterable[str]) -> int:
+        """
+        Fetch the given tickers from the upstream now, whatever the age of their cached quotes.
+        Returns the number of tickers that were refreshed.
+        """
+        with self._lock:
+            futures = [self._refresh(key) for key in {ticker.upper() for ticker in tickers}]
+
+        done, _ = wait(futures)
+        return sum(1 for future in done if future.exception() is None)
+
+    def stats(self) -> dict:
+        """
+        Return the cache's hit/miss metrics
+        """
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'entries': len(self._quotes),
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+                'fetches': self.fetches,
+                'inflight': len(self._inflight),
+                'upstream_errors': self.upstream_errors,
+                'stale_fallbacks': self.stale_fallbacks,
+            }
+
+    def _lookup(self, key: str) -> Tuple[Optional[Quote], Optional[Future]]:
+        # Must be called with the lock held. Returns the cached quote, and the fetch to wait for when it is not usable.
+        quote = self._quotes.get(key)
+        age = time.monotonic() - quote.fetched_at if quote is not None else None
+        ttl_seconds = self.closed_ttl_seconds if market_session() == 'closed' else self.ttl_seconds
+
+        if age is not None and age < ttl_seconds:
+            self.hits += 1
+            return quote, None
+
+        if age is not None and age < max(self.stale_seconds, ttl_seconds):
+            # Serve the expired quote now and refresh it for the next request
+            self.stale_hits += 1
+            self._refresh(key)
+            return quote, None
+
+        self.misses += 1
+        return quote, self._refresh(key)
+
+    def _resolve(self, key: str, future: Future, quote: Optional[Quote], timeout: float) -> Quote:
+        try:
+            return future.result(timeout=timeout)
+        except Exception as e:
+            # An old quote is better than no quote when the upstream is slow or failing
+            if quote is None:
+                raise
+            with self._lock:
+                self.stale_fallbacks += 1
+            print(f"Serving stale quote for {key}: {e}")
+            return quote
+
+    def _refresh(self, key: str) -> Future:
+        # Must be called with the lock held, and joins the fetch already in flight for the ticker if there is one
+        future = self._inflight.get(key)
+        if future is None:
+            future = self._executor.submit(self._load, key)
+            self._inflight[key] = future
+            self.fetches += 1
+        return future
+
+    def _load(self, key: str) -> Quote:
+        try:
+            quote = Quote(yf.Ticker(key).info, time.monotonic())
+        except Exception:
+            with self._lock:
+                self._inflight.pop(key, None)
+                self.upstream_errors += 1
+            raise
+
+        with self._lock:
+            self._inflight.pop(key, None)
+            self._quotes.put(key, quote)
+        return quote
+
+
+# Shared instance used by the routers
+quote_cache = QuoteCache(
+    QUOTE_CACHE_MAX_ENTRIES, QUOTE_TTL_SECONDS, QUOTE_CLOSED_TTL_SECONDS, QUOTE_STALE_SECONDS, QUOTE_FETCH_TIMEOUT_SECONDS
+)
@@ -0,0 +1,138 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Sequence
+import numpy as np
+from services.market_hours import seconds_until_next_market_day
+from services.price_history import price_history
+from services.ttl_cache import TTLCache
+
+#
+# Return, volatility, drawdown and correlation metrics of a stock list.
+# The closes of all tickers are aligned into one (days x tickers) matrix, and every metric is computed on
+# the whole matrix at once. Results are cached per list until the next market day, since daily bars only change
+# once a day.
+#
+
+# Number of trading days in a year, used to annualize volatility
+TRADING_DAYS_PER_YEAR = 252
+
+# Maximum number of analytics results kept in memory
+ANALYTICS_CACHE_MAX_ENTRIES = int(os.getenv('ANALYTICS_CACHE_MAX_ENTRIES', '1000'))
+
+# Number of ticker histories loaded at once
+ANALYTICS_LOAD_WORKERS = int(os.getenv('ANALYTICS_LOAD_WORKERS', '8'))
+
+_load_executor = ThreadPoolExecutor(max_workers=ANALYTICS_LOAD_WORKERS, thread_name_prefix='analytics')
+
+# (user_id, list name, tickers, days) -> result, each stored with a TTL that ends at the next market day
+_results = TTLCache(ANALYTICS_CACHE_MAX_ENTRIES, math.inf)
+
+
+def _finite(values) -> List:
+    """
+    Helper function to convert an array to a list, with NaN and infinite values as None
+    """
+    array = np.asarray(values, dtype=np.float64)
+    return np.where(np.isfinite(array), array, None).tolist()
+
+
+def _load_closes(ticker: str):
+    # Returns (timestamps, closes) views, or None when the ticker has no history
+    try:
+        bars = price_history.get(ticker).view()
+    except Exception as e:
+        print(f"No history for {ticker}: {e}")
+        return None
+    return bars['timestamp'], bars['close']
+
+
+def close_matrix(tickers: Sequence[str], days: int):
+    """
+    Load the tickers' histories and align their closes on the trading days they all share.
+    Returns (timestamps, the (days x tickers) close matrix, the tickers in the matrix, the tickers without history).
+    """
+    histories = list(_load_executor.map(_load_closes, tickers))
+    found = [ticker for ticker, history in zip(tickers, histories) if history is not None]
+    missing = [ticker for ticker, history in zip(tickers, histories) if history is None]
+    histories = [history for history in histories if history is not None]
+
+    if not histories:
+        return np.empty(0, dtype=np.int64), np.empty((0, 0)), found, missing
+
+    # Keep only the most recent days that every ticker has a bar for
+    common = histories[0][0]
+    for timestamps, _ in histories[1:]:
+        common = np.intersect1d(common, timestamps, assume_unique=True)
+    common = common[-(days + 1):]
+
+    # Gather each ticker's closes on the common days into one column of the matrix
+    closes = np.empty((len(common), len(histories)))
+    for column, (timestamps, ticker_closes) in enumerate(histories):
+        closes[:, column] = ticker_closes[np.searchsorted(timestamps, common)]
+
+    return common, closes, found, missing
+
+
+def compute_metrics(closes: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Compute the per-ticker metrics of a (days x tickers) close matrix, plus those of an equal-weight portfolio
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = closes[1:] / closes[:-1] - 1
+
+        # Equal-weight portfolio, rebalanced daily, as an extra column
+        portfolio_returns = returns.mean(axis=1, keepdims=True)
+        portfolio_values = np.vstack([np.ones((1, 1)), np.cumprod(1 + portfolio_returns, axis=0)])
+        all_returns = np.hstack([returns, portfolio_returns])
+        all_values = np.hstack([closes, portfolio_values])
+
+        return {
+            'total_return': all_values[-1] / all_values[0] - 1,
+            'volatility': all_returns.std(axis=0, ddof=1) * np.sqrt(TRADING_DAYS_PER_YEAR),
+            'max_drawdown': (all_values / np.maximum.accumulate(all_values, axis=0) - 1).min(axis=0),
+            'correlation': np.corrcoef(returns, rowvar=False).reshape(returns.shape[1], returns.shape[1]),
+        }
+
+
+def list_analytics(user_id: str, list_name: str, tickers: Sequence[str], days: int) -> dict:
+    """
+    Return the analytics of a stock list over its last trading days, cached until the next market day
+    """
+    tickers = list(dict.fromkeys(ticker.upper() for ticker in tickers))
+    key = (user_id, list_name, tuple(tickers), days)
+
+    result = _results.get(key)
+    if result is not None:
+        return result
+
+    timestamps, closes, found, missing = close_matrix(tickers, days)
+    result = {
+        'name': list_name,
+        'days': max(len(timestamps) - 1, 0),
+        'start': int(timestamps[0]) if len(timestamps) else None,
+        'end': int(timestamps[-1]) if len(timestamps) else None,
+        'tickers': {},
+        'portfolio': None,
+        'correlation': {'tickers': found, 'matrix': []},
+        'missing': missing,
+    }
+
+    # Metrics need at least two returns
+    if len(timestamps) >= 3:
+        metrics = compute_metrics(closes)
+        columns = {name: _finite(metrics[name]) for name in ('total_return', 'volatility', 'max_drawdown')}
+        for index, ticker in enumerate(found + [None]):
+            ticker_metrics = {name: values[index] for name, values in columns.items()}
+            if ticker is None:
+                result['portfolio'] = ticker_metrics
+            else:
+                result['tickers'][ticker] = ticker_metrics
+        result['correlation']['matrix'] = [_finite(row) for row in metrics['correlation']]
+
+    # A missing history may be a passing upstream failure, so only complete results are cached
+    if missing:
+        return result
+
+    _results.put(key, result, ttl_seconds=seconds_until_next_market_day())
+    return result
@@ -0,0 +1,86 @@
+from typing import Dict, List, Optional, Tuple
+from firebase_admin import firestore
+from firebase_configuration import db
+
+#
+# Stock lists are stored as one map of list name -> tickers in the stockLists field of the user document,
+# so reading all of a user's lists is a single document read, and one list is changed through its field path.
+# Users whose lists predate the map keep them as documents in the stockLists subcollection until they are
+# migrated, either by the migration in script.py or by their first stock list write.
+#
+
+STOCK_LISTS_FIELD = 'stockLists'
+
+
+def stock_list_path(list_name: str) -> str:
+    """
+    Helper function to get the field path of one list in the user document, quoted since names can contain dots
+    """
+    return db.field_path(STOCK_LISTS_FIELD, list_name)
+
+
+def stock_lists_from_docs(stock_list_docs) -> Dict[str, List[str]]:
+    """
+    Helper function to convert documents of the stockLists subcollection to list name -> tickers
+    """
+    stock_lists = {}
+    for doc in stock_list_docs:
+        stock_list_data = doc.to_dict()
+        list_name = stock_list_data.get('name')
+        if list_name:
+            stock_lists[list_name] = stock_list_data.get('tickers', [])
+    return stock_lists
+
+
+def stock_lists_of_user(user_doc) -> Dict[str, List[str]]:
+    """
+    Helper function to get a user's stock lists from their document,
+    falling back to the stockLists subcollection if they have not been migrated yet
+    """
+    stock_lists = (user_doc.to_dict() or {}).get(STOCK_LISTS_FIELD) if user_doc.exists else {}
+    if stock_lists is None:
+        stock_lists = stock_lists_from_docs(user_doc.reference.collection(STOCK_LISTS_FIELD).stream())
+    return stock_lists
+
+
+def read_stock_lists_for_write(transaction, user_ref) -> Tuple[Optional[Dict[str, List[str]]], Optional[List]]:
+    """
+    Helper function to read a user's stock lists in a transaction that is about to change them.
+    Returns the lists, or None if the user does not exist, and the subcollection documents they were read from,
+    or None if they are already on the user document.
+    """
+    user_doc = user_ref.get(transaction=transaction)
+    if not user_doc.exists:
+        return None, None
+
+    stock_lists = user_doc.to_dict().get(STOCK_LISTS_FIELD)
+    if stock_lists is not None:
+        return stock_lists, None
+
+    legacy_docs = list(user_ref.collection(STOCK_LISTS_FIELD).stream(transaction=transaction))
+    return stock_lists_from_docs(legacy_docs), legacy_docs
+
+
+def write_stock_lists(transaction, user_ref, stock_lists, legacy_docs, changes: Dict[str, Optional[List[str]]]) -> None:
+    """
+    Helper function to apply changes of list name -> tickers, or None to delete the list, in a transaction.
+    Lists that are already on the user document are changed through their field paths; otherwise every list is
+    moved onto the user document together with the changes, and the subcollection documents are deleted.
+    """
+    if legacy_docs is None:
+        transaction.update(user_ref, {
+            stock_list_path(list_name): firestore.DELETE_FIELD if tickers is None else tickers
+            for list_name, tickers in changes.items()
+        })
+        return
+
+    migrated_lists = dict(stock_lists)
+    for list_name, tickers in changes.items():
+        if tickers is None:
+            migrated_lists.pop(list_name, None)
+        else:
+            migrated_lists[list_name] = tickers
+
+    transaction.update(user_ref, {STOCK_LISTS_FIELD: migrated_lists})
+    for doc in legacy_docs:
+        transaction.delete(doc.reference)
@@ -0,0 +1,184 @@
+import bisect
+import csv
+import difflib
+import os
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+from services.ttl_cache import TTLCache
+
+#
+# In-memory index of ticker symbols and company names for autocomplete and validation.
+# It is loaded from a bundled listing file, and can be pointed at a full exchange listing instead, such as
+# NASDAQ's pipe-delimited nasdaqlisted.txt / otherlisted.txt. Symbols confirmed by the upstream are added at runtime.
+#
+
+# Listing files to load, separated by commas
+TICKER_LISTING_PATHS = os.getenv(
+    'TICKER_LISTING_PATHS', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tickers.csv')
+)
+
+# How long a symbol the upstream did not know is remembered, so repeated searches for it do not go upstream
+TICKER_UNKNOWN_TTL_SECONDS = float(os.getenv('TICKER_UNKNOWN_TTL_SECONDS', '3600'))
+
+# Maximum number of unknown symbols remembered
+TICKER_UNKNOWN_MAX_ENTRIES = int(os.getenv('TICKER_UNKNOWN_MAX_ENTRIES', '10000'))
+
+# Queries that could be a ticker symbol on their own, such as AAPL or BRK.B
+_SYMBOL_PATTERN = re.compile(r'^[A-Za-z]{1,5}([.-][A-Za-z]{1,2})?$')
+
+
+def is_symbol_shaped(query: str) -> bool:
+    return bool(_SYMBOL_PATTERN.match(query.strip()))
+
+
+class TickerIndex:
+    """
+    Sorted symbol and name-word arrays searched by binary search, with a fuzzy fallback for typos
+    """
+
+    def __init__(self):
+        self._names = {}
+        # Sorted symbols, and sorted (lowercase name word, symbol) pairs
+        self._symbols = []
+        self._words = []
+        # Symbols grouped by length, for the fuzzy fallback
+        self._symbols_by_length = defaultdict(list)
+        # Symbols the upstream did not know -> True
+        self._unknown = TTLCache(TICKER_UNKNOWN_MAX_ENTRIES, TICKER_UNKNOWN_TTL_SECONDS)
+        self._lock = threading.Lock()
+
+    def load(self, path: str) -> int:
+        """
+        Add the symbols of a comma- or pipe-delimited listing file whose first two columns are symbol and name.
+        Returns the number of symbols added.
+        """
+        with open(path, newline='', encoding='utf-8') as file:
+            first_line = file.readline()
+            delimiter = '|' if '|' in first_line else ','
+            rows = [(row[0], row[1]) for row in csv.reader(file, delimiter=delimiter) if len(row) >= 2]
+
+        # Skip the trailer line of the NASDAQ files
+        rows = [(symbol, name) for symbol, name in rows if not symbol.startswith('File Creation Time')]
+        return self.add_many(rows)
+
+    def add_many(self, rows) -> int:
+        """
+        Add (symbol, name) pairs, keeping the first name seen for each symbol
+        """
+        new_symbols = []
+        new_words = []
+        with self._lock:
+            for symbol, name in rows:
+                symbol = symbol.strip().upper()
+                if not symbol or symbol in self._names:
+                    continue
+
+                name = name.strip()
+                self._names[symbol] = name
+                self._unknown.discard(symbol)
+                new_symbols.append(symbol)
+                new_words.extend((word, symbol) for word in set(name.lower().split()))
+                self._symbols_by_length[len(symbol)].append(symbol)
+
+            # Merge the new entries into the sorted arrays in one pass
+            if new_symbols:
+                self._symbols = sorted(self._symbols + new_symbols)
+                self._words = sorted(self._words + new_words)
+        return len(new_symbols)
+
+    def add(self, symbol: str, name: str) -> None:
+        self.add_many([(symbol, name)])
+
+    def is_known(self, symbol: str) -> bool:
+        return symbol.strip().upper() in self._names
+
+    def mark_unknown(self, symbol: str) -> None:
+        """
+        Remember that the upstream has no such symbol, for a while
+        """
+        self._unknown.put(symbol.strip().upper(), True)
+
+    def is_unknown(self, symbol: str) -> bool:
+        return self._unknown.get(symbol.strip().upper()) is not None
+
+    def name(self, symbol: str) -> Optional[str]:
+        return self._names.get(symbol.strip().upper())
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[str, str]]:
+        """
+        Return up to limit (symbol, name) pairs, ranked as: exact symbol, symbol prefix (shortest first),
+        company name prefix, then symbols within a typo of the query
+        """
+        query = query.strip()
+        if not query or limit <= 0:
+            return []
+
+        symbol_query = query.upper()
+        name_query = query.lower()
+        ranked = []
+        seen = set()
+
+        def take(symbols) -> bool:
+            for symbol in symbols:
+                if symbol not in seen:
+                    seen.add(symbol)
+                    ranked.append(symbol)
+                    if len(ranked) == limit:
+                        return True
+            return False
+
+        with self._lock:
+            # Symbols that start with the query, with the exact match first and shorter symbols next
+            low = bisect.bisect_left(self._symbols, symbol_query)
+            high = bisect.bisect_left(self._symbols, symbol_query + '\uffff')
+            prefix_matches = sorted(self._symbols[low:high], key=lambda symbol: (len(symbol), symbol))
+            if take(prefix_matches):
+                return self._pairs(ranked)
+
+            # Company names with a word starting with the query's first word, that contain the whole query
+            first_word = name_query.split()[0]
+            low = bisect.bisect_left(self._words, (first_word,))
+            high = bisect.bisect_left(self._words, (first_word + '\uffff',))
+            name_matches = sorted(
+                {symbol for _, symbol in self._words[low:high] if name_query in self._names[symbol].lower()},
+                key=lambda symbol: (len(self._names[symbol]), symbol),
+            )
+            if take(name_matches):
+                return self._pairs(ranked)
+
+            # Symbols of about the same length that are close to the query, for typos in longer queries
+            if len(symbol_query) < 3:
+                return self._pairs(ranked)
+
+            candidates = []
+            for length in (len(symbol_query) - 1, len(symbol_query), len(symbol_query) + 1):
+                candidates.extend(self._symbols_by_length.get(length, ()))
+            take(difflib.get_close_matches(symbol_query, candidates, n=limit, cutoff=0.75))
+
+            return self._pairs(ranked)
+
+    def _pairs(self, symbols: List[str]) -> List[Tuple[str, str]]:
+        return [(symbol, self._names[symbol]) for symbol in symbols]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'symbols': len(self._symbols), 'name_words': len(self._words), 'unknown_symbols': len(self._unknown)}
+
+
+def load_default_index() -> TickerIndex:
+    """
+    Helper function to build the index from the configured listing files
+    """
+    index = TickerIndex()
+    for path in TICKER_LISTING_PATHS.split(','):
+        try:
+            index.load(path.strip())
+        except OSError as e:
+            print(f"Failed to load ticker listing {path}: {e}")
+    return index
+
+
+# Shared instance used by the routers
+ticker_index = load_default_index()
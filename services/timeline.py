@@ -0,0 +1,93 @@
+import os
+from datetime import datetime
+from typing import List, Optional, Tuple
+from firebase_admin import firestore
+from firebase_configuration import db
+from services.batches import commit_chunked
+from services.pagination import cursor_for_page, order_newest_first
+
+#
+# Helpers for the materialized home timeline, stored as users/{user_id}/timeline/{post_id}.
+# Each entry holds the post's author and timestamp, so a feed read is one ordered range scan.
+#
+
+# Whether new posts are fanned out to their followers' timelines when they are written
+FANOUT_ON_WRITE = os.getenv('FEED_FANOUT_ON_WRITE', 'true').lower() == 'true'
+
+# Number of a user's most recent posts that get copied into a new follower's timeline
+BACKFILL_LIMIT = 50
+
+
+def timeline_collection(user_id: str):
+    """
+    Helper function to get the reference to a user's timeline subcollection
+    """
+    return db.collection('users').document(user_id).collection('timeline')
+
+
+def get_follower_ids(author_id: str) -> List[str]:
+    """
+    Helper function to get the IDs of the author's followers
+    """
+    followers = db.collection('users').document(author_id).collection('followers').select([]).stream()
+    return [follower.id for follower in followers]
+
+
+def add_timeline_entry(batch, user_id: str, post_id: str, author_id: str, timestamp) -> None:
+    """
+    Helper function to add the write of one timeline entry to a batch or transaction
+    """
+    batch.set(timeline_collection(user_id).document(post_id), {'userId': author_id, 'timestamp': timestamp})
+
+
+def fan_out_post(post_id: str, author_id: str, timestamp) -> List[str]:
+    """
+    Helper function to add a new post to the timelines of all of the author's followers, in chunked batches.
+    The author's own entry is written together with the post. Returns the IDs of the followers.
+    """
+    follower_ids = get_follower_ids(author_id)
+    entry = {'userId': author_id, 'timestamp': timestamp}
+    commit_chunked([('set', timeline_collection(uid).document(post_id), entry) for uid in follower_ids])
+    return follower_ids
+
+
+def backfill_author(user_id: str, author_id: str) -> None:
+    """
+    Helper function to copy an author's most recent posts into a user's timeline after a follow
+    """
+    recent_posts = db.collection('posts').where('userId', '==', author_id) \
+        .order_by('timestamp', direction=firestore.Query.DESCENDING).limit(BACKFILL_LIMIT).stream()
+
+    timeline_ref = timeline_collection(user_id)
+    commit_chunked([
+        ('set', timeline_ref.document(post.id), {'userId': author_id, 'timestamp': post.get('timestamp')})
+        for post in recent_posts
+    ])
+
+
+def remove_author(user_id: str, author_id: str) -> None:
+    """
+    Helper function to remove all of an author's posts from a user's timeline after an unfollow
+    """
+    entries = timeline_collection(user_id).where('userId', '==', author_id).stream()
+    commit_chunked([('delete', entry.reference, None) for entry in entries])
+
+
+def fetch_timeline_page(user_id: str, limit: int, position: Optional[Tuple[datetime, str]] = None) -> Tuple[List, Optional[str]]:
+    """
+    Helper function to return a page of post snapshots from the user's timeline, newest first,
+    along with the cursor for the next page. Entries whose post no longer exists are skipped.
+    """
+    query = order_newest_first(timeline_collection(user_id), position).limit(limit)
+    entries = list(query.stream())
+    if not entries:
+        return [], None
+
+    # Fetch the posts for the whole page in one multi-document read, then restore the timeline order
+    entry_ids = [entry.id for entry in entries]
+    post_refs = [db.collection('posts').document(post_id) for post_id in entry_ids]
+    snapshots = {snapshot.id: snapshot for snapshot in db.get_all(post_refs)}
+    posts = [snapshots[post_id] for post_id in entry_ids if snapshots[post_id].exists]
+
+    # The cursor follows the timeline entries, so skipped posts do not end the feed early
+    return posts, cursor_for_page(entries, limit)
@@ -0,0 +1,89 @@
+import hashlib
+import math
+import os
+import time
+from firebase_admin import auth
+from services.ttl_cache import TTLCache
+
+#
+# Cache of verified Firebase ID tokens.
+# Verifying a token checks its signature, which is far slower than the rest of most requests, and clients resend
+# the same token on every request until it expires. A verified token's uid is therefore kept until the token's
+# own exp, or for a few minutes at most, keyed by a hash of the token so the cache never holds usable credentials.
+# Tokens are checked for revocation whenever they are verified, so revoking a user's tokens on one instance takes
+# effect on every other instance once their cached copies expire.
+#
+
+# Maximum number of verified tokens kept in memory
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv('TOKEN_CACHE_MAX_ENTRIES', '10000'))
+
+# Tokens are dropped from the cache this many seconds before they expire, to allow for clock skew
+TOKEN_CACHE_EXPIRY_MARGIN_SECONDS = float(os.getenv('TOKEN_CACHE_EXPIRY_MARGIN_SECONDS', '30'))
+
+# Longest a verified token is reused before it is checked again, which bounds how long a token revoked through
+# another instance keeps working on this one
+TOKEN_CACHE_MAX_TTL_SECONDS = float(os.getenv('TOKEN_CACHE_MAX_TTL_SECONDS', '300'))
+
+# Longest lifetime of a Firebase ID token, after which a revocation no longer needs to be remembered
+TOKEN_MAX_LIFETIME_SECONDS = float(os.getenv('TOKEN_MAX_LIFETIME_SECONDS', '3600'))
+
+
+class TokenCache:
+    """
+    Thread-safe LRU cache of token hash -> (uid, decoded claims), kept until the token expires or for at most
+    TOKEN_CACHE_MAX_TTL_SECONDS, with per-user revocation
+    """
+
+    def __init__(self, max_entries: int):
+        # Every token is stored with its own TTL
+        self._tokens = TTLCache(max_entries, math.inf)
+        # uid -> time up to which the user's tokens are no longer accepted, kept until every token issued
+        # before it has expired anyway
+        self._revoked_before = TTLCache(max_entries, TOKEN_MAX_LIFETIME_SECONDS + TOKEN_CACHE_EXPIRY_MARGIN_SECONDS)
+
+    def verify(self, token: str) -> str:
+        """
+        Return the uid of a valid token, verifying its signature only the first time it is seen.
+        Raises when the token is invalid, expired or revoked.
+        """
+        key = hashlib.sha256(token.encode('utf-8')).digest()
+        entry = self._tokens.get(key)
+        if entry is not None:
+            return entry[0]
+
+        # Checking for revocation costs a lookup of the user, which the cache makes rare
+        decoded_token = auth.verify_id_token(token, check_revoked=True)
+        uid = decoded_token['uid']
+
+        with self._tokens.lock:
+            # Reject tokens issued up to when the user's tokens were revoked on this instance
+            revoked_at = self._revoked_before.peek(uid)
+            if revoked_at is not None and decoded_token.get('iat', 0) <= revoked_at:
+                raise ValueError("Token has been revoked")
+
+            ttl_seconds = min(
+                decoded_token['exp'] - TOKEN_CACHE_EXPIRY_MARGIN_SECONDS - time.time(), TOKEN_CACHE_MAX_TTL_SECONDS
+            )
+            if ttl_seconds > 0:
+                self._tokens.put(key, (uid, decoded_token), ttl_seconds=ttl_seconds)
+        return uid
+
+    def revoke_user(self, uid: str) -> None:
+        """
+        Drop every cached token of a user and stop accepting tokens issued up to now
+        """
+        with self._tokens.lock:
+            self._revoked_before.put(uid, int(time.time()))
+            for key, (entry_uid, _) in self._tokens.items():
+                if entry_uid == uid:
+                    self._tokens.discard(key)
+
+    def revoke_token(self, token: str) -> None:
+        """
+        Drop one cached token, so that it is verified again on its next use
+        """
+        self._tokens.discard(hashlib.sha256(token.encode('utf-8')).digest())
+
+
+# Shared instance used by the routers
+token_cache = TokenCache(TOKEN_CACHE_MAX_ENTRIES)
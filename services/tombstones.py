@@ -0,0 +1,186 @@
+import asyncio
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+import pytz
+from firebase_admin import firestore
+from firebase_configuration import db
+from services.batches import commit_chunked
+from services.cascade import CascadeResult, delete_post_tree, delete_user_tree
+from services.feed_cache import feed_cache
+
+#
+# Tombstone deletes.
+# Deleting a post or a user only marks its document as deleted and records a job in the deletionJobs collection.
+# Reads skip tombstoned documents, and a background sweeper runs the cascade delete for each job in throttled batches.
+#
+
+JOBS_COLLECTION = 'deletionJobs'
+
+# How often an idle sweeper checks for new jobs
+SWEEPER_INTERVAL_SECONDS = float(os.getenv('SWEEPER_INTERVAL_SECONDS', '10'))
+
+# Upper bound on the sweeper's write rate, so cleanup never competes with user traffic
+SWEEPER_MAX_WRITES_PER_SECOND = int(os.getenv('SWEEPER_MAX_WRITES_PER_SECOND', '200'))
+
+# How long a running job may go without progress before another instance takes it over
+SWEEPER_LEASE_SECONDS = float(os.getenv('SWEEPER_LEASE_SECONDS', '300'))
+
+# Time between lease renewals of a running job, which also record its progress
+_HEARTBEAT_INTERVAL_SECONDS = min(SWEEPER_LEASE_SECONDS / 5, 30.0)
+
+
+def is_tombstoned(snapshot) -> bool:
+    """
+    Helper function to check whether a document snapshot has been marked as deleted
+    """
+    snapshot_data = snapshot.to_dict() or {}
+    return bool(snapshot_data.get('deleted'))
+
+
+def tombstone(doc_ref, kind: str, requested_by: str) -> str:
+    """
+    Helper function to mark a post or user as deleted and queue its cascade delete in one batch.
+    Returns the ID of the deletion job.
+    """
+    job_ref = db.collection(JOBS_COLLECTION).document()
+
+    batch = db.batch()
+    batch.update(doc_ref, {'deleted': True, 'deleted_at': firestore.SERVER_TIMESTAMP})
+    batch.set(job_ref, {
+        'id': job_ref.id,
+        'kind': kind,
+        'targetId': doc_ref.id,
+        'userId': requested_by,
+        'status': 'pending',
+        'writes': 0,
+        'failed_writes': 0,
+        'created_at': firestore.SERVER_TIMESTAMP,
+        'updated_at': firestore.SERVER_TIMESTAMP,
+    })
+    batch.commit()
+
+    return job_ref.id
+
+
+def _lease_expired(job_data: dict) -> bool:
+    updated_at = job_data.get('updated_at')
+    return updated_at is None or updated_at < datetime.now(pytz.UTC) - timedelta(seconds=SWEEPER_LEASE_SECONDS)
+
+
+@firestore.transactional
+def _claim_job(transaction, job_ref) -> Optional[dict]:
+    """
+    Helper function to mark a job as running, unless another instance already holds it
+    """
+    job_doc = job_ref.get(transaction=transaction)
+    if not job_doc.exists:
+        return None
+
+    job_data = job_doc.to_dict()
+    if job_data['status'] == 'pending' or (job_data['status'] == 'running' and _lease_expired(job_data)):
+        transaction.update(job_ref, {'status': 'running', 'updated_at': firestore.SERVER_TIMESTAMP})
+        return job_data
+
+    return None
+
+
+def _tombstone_user_posts(user_id: str) -> None:
+    """
+    Helper function to hide all of a deleted user's posts before their cascade delete starts
+    """
+    post_refs = [post.reference for post in db.collection('posts').where('userId', '==', user_id).stream()]
+    commit_chunked(('update', post_ref, {'deleted': True, 'deleted_at': firestore.SERVER_TIMESTAMP}) for post_ref in post_refs)
+
+    # Drop any cached feed pages that show the posts
+    for post_ref in post_refs:
+        feed_cache.invalidate_post(post_ref.id)
+
+
+def _renew_lease(job_ref, result: CascadeResult, stopped: threading.Event) -> None:
+    """
+    Heartbeat that records the job's progress and renews its lease until the cascade finishes.
+    It runs on its own thread, since writes can block on the rate limiter for longer than the lease.
+    """
+    while not stopped.wait(_HEARTBEAT_INTERVAL_SECONDS):
+        try:
+            job_ref.update({
+                'writes': result.writes,
+                'failed_writes': result.failed_writes,
+                'updated_at': firestore.SERVER_TIMESTAMP,
+            })
+        except Exception as e:
+            print(f"Failed to renew the lease of deletion job {job_ref.id}: {e}")
+
+
+def run_job(job_ref, job_data: dict) -> None:
+    """
+    Run the cascade delete of a claimed job, recording its progress on the job document
+    """
+    result = CascadeResult()
+    stopped = threading.Event()
+    heartbeat = threading.Thread(target=_renew_lease, args=(job_ref, result, stopped), daemon=True)
+    heartbeat.start()
+
+    try:
+        if job_data['kind'] == 'post':
+            post_ref = db.collection('posts').document(job_data['targetId'])
+            delete_post_tree(post_ref, job_data['userId'], result, max_writes_per_second=SWEEPER_MAX_WRITES_PER_SECOND)
+        else:
+            _tombstone_user_posts(job_data['targetId'])
+            delete_user_tree(job_data['targetId'], result, max_writes_per_second=SWEEPER_MAX_WRITES_PER_SECOND)
+
+        stopped.set()
+        heartbeat.join()
+        job_ref.update({
+            'status': 'failed' if result.failed_writes else 'done',
+            'writes': result.writes,
+            'failed_writes': result.failed_writes,
+            'seconds': result.seconds,
+            'updated_at': firestore.SERVER_TIMESTAMP,
+        })
+
+    except Exception as e:
+        # Leave the job running, so that it is picked up again once its lease expires
+        print(f"Deletion job {job_ref.id} failed: {e}")
+
+    finally:
+        stopped.set()
+
+
+def sweep_once() -> bool:
+    """
+    Claim and run one deletion job. Returns whether a job was run.
+    """
+    jobs_ref = db.collection(JOBS_COLLECTION)
+
+    # Pending jobs first, then running jobs whose instance stopped making progress
+    candidates = list(jobs_ref.where('status', '==', 'pending').limit(10).stream())
+    candidates += [
+        job for job in jobs_ref.where('status', '==', 'running').limit(10).stream() if _lease_expired(job.to_dict())
+    ]
+
+    for candidate in candidates:
+        job_data = _claim_job(db.transaction(), candidate.reference)
+        if job_data is not None:
+            run_job(candidate.reference, job_data)
+            return True
+
+    return False
+
+
+async def run_sweeper() -> None:
+    """
+    Background loop that keeps running deletion jobs, off the event loop
+    """
+    loop = asyncio.get_event_loop()
+    while True:
+        try:
+            ran_job = await loop.run_in_executor(None, sweep_once)
+        except Exception as e:
+            print(f"Deletion sweeper failed: {e}")
+            ran_job = False
+
+        if not ran_job:
+            await asyncio.sleep(SWEEPER_INTERVAL_SECONDS)
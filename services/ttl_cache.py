@@ -0,0 +1,163 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Iterator, List, Optional, Tuple
+
+#
+# Thread-safe in-process LRU + TTL map shared by the caches in this package.
+# Values loaded from Firestore are stored with a load token taken before the read, and a value is dropped when
+# its key was written after the token was taken, so a slow read can never overwrite what a write just cached.
+# Write times are tracked per key, so a write to one key never discards loads of other keys.
+#
+
+# Loads that take longer than this are not cached, which bounds how long write times have to be remembered
+CACHE_MAX_LOAD_SECONDS = float(os.getenv('CACHE_MAX_LOAD_SECONDS', '60'))
+
+
+class TTLCache:
+    """
+    Map of key -> value kept in least recently used order, where each entry expires after a TTL
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, on_remove: Optional[Callable] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # Called with (key, value) under the lock whenever an entry leaves the cache, for owners that index entries
+        self.on_remove = on_remove
+
+        # key -> (expires_at, value)
+        self._entries = OrderedDict()
+        # key -> time of its last write, oldest first
+        self._written_at = OrderedDict()
+        # Reentrant, so owners can hold it across several calls
+        self.lock = threading.RLock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def load_token(self) -> float:
+        """
+        Return a token to pass to put, taken before reading the value from Firestore
+        """
+        return time.monotonic()
+
+    def get(self, key: Hashable):
+        """
+        Return the value of a key, or None on a miss
+        """
+        with self.lock:
+            value = self._live_value(key)
+            if value is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key: Hashable):
+        """
+        Return the value of a key without counting a lookup or refreshing its recency
+        """
+        with self.lock:
+            return self._live_value(key)
+
+    def put(self, key: Hashable, value, load_token: Optional[float] = None, ttl_seconds: Optional[float] = None) -> bool:
+        """
+        Store a value, either written by this instance (no load_token) or loaded from Firestore, unless the key was
+        written since load_token was taken. Returns whether the value was stored.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if load_token is None:
+                self._record_write(key, now)
+            elif load_token < now - CACHE_MAX_LOAD_SECONDS or self._written_at.get(key, -math.inf) >= load_token:
+                return False
+
+            self._remove(key)
+            self._entries[key] = (now + (self.ttl_seconds if ttl_seconds is None else ttl_seconds), value)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            return True
+
+    def update(self, key: Hashable, change: Callable) -> None:
+        """
+        Replace the cached value of a key with change(value) after this instance wrote it, keeping its expiry.
+        Values are replaced rather than changed, since readers may hold the current one.
+        """
+        with self.lock:
+            self._record_write(key, time.monotonic())
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], change(entry[1]))
+
+    def invalidate(self, key: Hashable) -> None:
+        """
+        Drop a key after this instance wrote it
+        """
+        with self.lock:
+            self._record_write(key, time.monotonic())
+            self._remove(key)
+
+    def discard(self, key: Hashable) -> None:
+        """
+        Drop a key without recording a write, for entries that are known to be wrong rather than outdated
+        """
+        with self.lock:
+            self._remove(key)
+
+    def items(self) -> List[Tuple[Hashable, object]]:
+        """
+        Return the live entries as (key, value) pairs
+        """
+        now = time.monotonic()
+        with self.lock:
+            return [(key, entry[1]) for key, entry in self._entries.items() if entry[0] >= now]
+
+    def values(self) -> Iterator:
+        return (value for _, value in self.items())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """
+        Return the cache's hit/miss metrics
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+            }
+
+    def _live_value(self, key: Hashable):
+        # Must be called with the lock held
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._remove(key)
+            return None
+        return entry[1]
+
+    def _record_write(self, key: Hashable, now: float) -> None:
+        # Must be called with the lock held. Write times older than any load that may still be cached are forgotten.
+        self._written_at[key] = now
+        self._written_at.move_to_end(key)
+        while next(iter(self._written_at.values())) < now - CACHE_MAX_LOAD_SECONDS:
+            self._written_at.popitem(last=False)
+
+    def _remove(self, key: Hashable) -> None:
+        # Must be called with the lock held
+        entry = self._entries.pop(key, None)
+        if entry is not None and self.on_remove is not None:
+            self.on_remove(key, entry[1])
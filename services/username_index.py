@@ -0,0 +1,165 @@
+import asyncio
+import bisect
+import os
+import threading
+from itertools import chain, islice
+from typing import List, Optional
+from firebase_configuration import db
+from services.bloom import BloomFilter
+
+#
+# In-memory index of usernames for case-insensitive user search.
+# Usernames are normalized and kept in one sorted array, so prefix searches are binary searches.
+# The index is loaded by streaming the users collection at startup, reloaded every so often to pick up
+# changes made by other instances, and kept current by this instance's own account endpoints in between.
+#
+
+# How often the whole index is reloaded from Firestore
+USERNAME_INDEX_RELOAD_SECONDS = float(os.getenv('USERNAME_INDEX_RELOAD_SECONDS', '600'))
+
+# Number of usernames the Bloom filter is sized for, before it is rebuilt larger on the next reload
+USERNAME_BLOOM_CAPACITY = int(os.getenv('USERNAME_BLOOM_CAPACITY', '100000'))
+
+
+def normalize_username(username: str) -> str:
+    """
+    Helper function to return the form of a username used for case-insensitive comparisons
+    """
+    return username.strip().casefold()
+
+
+class UsernameIndex:
+    """
+    Sorted (normalized username, user ID) pairs, with the reverse mapping for renames and deletes.
+    A Bloom filter of every username seen since the last load answers availability checks without a search.
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._names_by_user = {}
+        self._bloom = BloomFilter(USERNAME_BLOOM_CAPACITY)
+        self._lock = threading.Lock()
+        self.ready = False
+
+    def replace_all(self, users) -> None:
+        """
+        Swap in a freshly loaded set of (user ID, username) pairs
+        """
+        names_by_user = {user_id: normalize_username(username) for user_id, username in users if username}
+        entries = sorted((name, user_id) for user_id, name in names_by_user.items())
+
+        # Rebuilding the filter also drops the usernames that were freed since the last load
+        bloom = BloomFilter(max(USERNAME_BLOOM_CAPACITY, 2 * len(entries)))
+        for name, _ in entries:
+            bloom.add(name)
+
+        with self._lock:
+            self._entries = entries
+            self._names_by_user = names_by_user
+            self._bloom = bloom
+            self.ready = True
+
+    def add(self, user_id: str, username: str) -> None:
+        """
+        Record a user's current username, replacing their previous one
+        """
+        name = normalize_username(username)
+        with self._lock:
+            self._remove(user_id)
+            self._names_by_user[user_id] = name
+            bisect.insort(self._entries, (name, user_id))
+            self._bloom.add(name)
+
+    def remove(self, user_id: str) -> None:
+        with self._lock:
+            self._remove(user_id)
+
+    def might_be_taken(self, username: str) -> bool:
+        """
+        Return False only when the username is definitely not taken by any user known to the index
+        """
+        name = normalize_username(username)
+        with self._lock:
+            return not self.ready or name in self._bloom
+
+    def lookup(self, username: str) -> Optional[str]:
+        """
+        Return the ID of the user with exactly this username, ignoring case
+        """
+        name = normalize_username(username)
+        with self._lock:
+            position = bisect.bisect_left(self._entries, (name,))
+            if position < len(self._entries) and self._entries[position][0] == name:
+                return self._entries[position][1]
+        return None
+
+    def search(self, query: str, limit: int) -> List[str]:
+        """
+        Return the IDs of up to limit users whose username contains the query, ranked as:
+        exact match, then prefix matches (shortest first), then other matches (earliest match first)
+        """
+        name = normalize_username(query)
+        if not name or limit <= 0:
+            return []
+
+        with self._lock:
+            # Prefix matches are one contiguous run of the sorted entries
+            low = bisect.bisect_left(self._entries, (name,))
+            high = bisect.bisect_left(self._entries, (name + '\uffff',))
+            prefix_matches = sorted(self._entries[low:high], key=lambda entry: (len(entry[0]), entry))
+            user_ids = [user_id for _, user_id in prefix_matches[:limit]]
+            if len(user_ids) == limit:
+                return user_ids
+
+            # Infix matches need a scan, which only runs when the prefixes do not fill the page
+            infix_matches = [
+                (entry[0].find(name), len(entry[0]), entry)
+                for entry in chain(islice(self._entries, low), islice(self._entries, high, None))
+                if name in entry[0]
+            ]
+
+        infix_matches.sort()
+        user_ids.extend(user_id for _, _, (_, user_id) in infix_matches[:limit - len(user_ids)])
+        return user_ids
+
+    def _remove(self, user_id: str) -> None:
+        # Must be called with the lock held
+        name = self._names_by_user.pop(user_id, None)
+        if name is None:
+            return
+        position = bisect.bisect_left(self._entries, (name, user_id))
+        if position < len(self._entries) and self._entries[position] == (name, user_id):
+            del self._entries[position]
+
+
+def load_usernames() -> int:
+    """
+    Helper function to stream every username from Firestore into the index, returning the number loaded
+    """
+    users = []
+    for user_doc in db.collection('users').select(['username', 'deleted']).stream():
+        user_data = user_doc.to_dict() or {}
+        if not user_data.get('deleted'):
+            users.append((user_doc.id, user_data.get('username')))
+
+    username_index.replace_all(users)
+    return len(users)
+
+
+async def run_username_index_loader() -> None:
+    """
+    Background loop that loads the index at startup and reloads it periodically, off the event loop
+    """
+    loop = asyncio.get_event_loop()
+    while True:
+        try:
+            count = await loop.run_in_executor(None, load_usernames)
+            print(f"Loaded {count} usernames into the username index")
+        except Exception as e:
+            print(f"Failed to load the username index: {e}")
+
+        await asyncio.sleep(USERNAME_INDEX_RELOAD_SECONDS)
+
+
+# Shared instance used by the routers
+username_index = UsernameIndex()
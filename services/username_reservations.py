@@ -0,0 +1,52 @@
+import hashlib
+from firebase_admin import firestore
+from firebase_configuration import db
+from services.username_index import normalize_username, username_index
+
+#
+# Unique usernames.
+# Each taken username has a reservation document in the usernames collection, keyed by a hash of its normalized
+# form, which account writes read and write in the same transaction as the user document. The availability check
+# answers from the in-memory Bloom filter when it can, and only reads Firestore on a possible collision.
+#
+
+USERNAMES_COLLECTION = 'usernames'
+
+
+def reservation_ref(username: str):
+    """
+    Helper function to get the reference to a username's reservation document.
+    The ID is a hash, since usernames may contain characters that are not allowed in document IDs.
+    """
+    reservation_id = hashlib.sha256(normalize_username(username).encode('utf-8')).hexdigest()
+    return db.collection(USERNAMES_COLLECTION).document(reservation_id)
+
+
+def reservation_data(username: str, user_id: str) -> dict:
+    return {
+        'userId': user_id,
+        'username': normalize_username(username),
+        'reserved_at': firestore.SERVER_TIMESTAMP,
+    }
+
+
+def is_username_available(username: str) -> bool:
+    """
+    Helper function to check whether a username is free, ignoring case
+    """
+    if not normalize_username(username):
+        return False
+
+    # A username the filter has never seen is not taken, since names reserved on this instance are added to it
+    # right away; one reserved through another instance since the last reload is still caught by the transaction
+    if not username_index.might_be_taken(username):
+        return True
+
+    # Possible collision, so check the reservation and then the index itself
+    if reservation_ref(username).get().exists:
+        return False
+    if username_index.lookup(username) is not None:
+        return False
+
+    # Users created before reservations existed may only be found by their exact username
+    return not db.collection('users').where('username', '==', username).limit(1).get()
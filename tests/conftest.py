@@ -0,0 +1,39 @@
+import atexit
+import json
+import os
+import tempfile
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+#
+# The modules under test import firebase_configuration, which needs a service account file at import time,
+# although the tests never talk to Firestore. A throwaway account is generated for the session unless one is set.
+#
+
+
+def _write_test_service_account() -> str:
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+
+    service_account = {
+        'type': 'service_account',
+        'project_id': 'test-project',
+        'private_key_id': 'test',
+        'private_key': pem,
+        'client_email': 'test@test-project.iam.gserviceaccount.com',
+        'client_id': '0',
+        'token_uri': 'https://oauth2.googleapis.com/token',
+    }
+    file = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+    with file:
+        json.dump(service_account, file)
+    atexit.register(os.remove, file.name)
+    return file.name
+
+
+if not os.getenv('GOOGLE_APPLICATION_CREDENTIALS'):
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = _write_test_service_account()
+
+os.environ.setdefault('CURSOR_SECRET', 'test-cursor-secret')
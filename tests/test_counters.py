@@ -0,0 +1,118 @@
+from types import SimpleNamespace
+import pytest
+from services import counters
+from services.ttl_cache import TTLCache
+
+
+class FakeRef:
+    def __init__(self, path, writes):
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+        self.writes = writes
+
+    def collection(self, name):
+        return SimpleNamespace(document=lambda doc_id: FakeRef(f'{self.path}/{name}/{doc_id}', self.writes))
+
+    def update(self, data):
+        self.writes.append(('update', self.path, data))
+
+    def set(self, data, merge=False):
+        self.writes.append(('set', self.path, data))
+
+
+class FakeBatch:
+    def __init__(self):
+        self.writes = []
+
+    def update(self, ref, data):
+        self.writes.append(('update', ref.path, data))
+
+    def set(self, ref, data, merge=False):
+        self.writes.append(('set', ref.path, data))
+
+
+def snapshot(ref, data, exists=True):
+    return SimpleNamespace(reference=ref, id=ref.id, exists=exists, to_dict=lambda: dict(data))
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches(monkeypatch):
+    monkeypatch.setattr(counters, '_shard_sums', TTLCache(100, 60))
+    monkeypatch.setattr(counters, '_shard_counts', TTLCache(100, 3600))
+    monkeypatch.setattr(counters, '_recent_increments', TTLCache(100, 60))
+    monkeypatch.setattr(counters, 'COUNTER_HOT_INCREMENTS_PER_MINUTE', 3)
+
+
+@pytest.fixture
+def post_ref():
+    return FakeRef('posts/p1', [])
+
+
+def test_cold_document_is_incremented_on_itself(post_ref):
+    batch = FakeBatch()
+    counters.increment(post_ref, 'likes_count', 1, batch, snapshot(post_ref, {'likes_count': 4}))
+
+    assert [(operation, path, list(data)) for operation, path, data in batch.writes] == [
+        ('update', 'posts/p1', ['likes_count'])
+    ]
+
+
+def test_sharded_document_is_incremented_on_a_shard(post_ref):
+    batch = FakeBatch()
+    counters.increment(post_ref, 'likes_count', 1, batch, snapshot(post_ref, {counters.SHARD_COUNT_FIELD: 4}))
+
+    [(operation, path, _)] = batch.writes
+    assert operation == 'set'
+    assert path.startswith('posts/p1/counterShards/')
+    assert int(path.rsplit('/', 1)[-1]) in range(4)
+
+
+def test_without_a_snapshot_the_document_is_incremented_on_itself(post_ref):
+    counters._shard_counts.put(post_ref.path, 4)
+    batch = FakeBatch()
+    counters.increment(post_ref, 'likes_count', 1, batch)
+
+    assert [write[:2] for write in batch.writes] == [('update', 'posts/p1')]
+
+
+def test_hot_document_gets_its_shard_count_set_once(post_ref):
+    for _ in range(5):
+        counters.note_increment(post_ref, 'likes_count', 1)
+
+    assert post_ref.writes == [('update', 'posts/p1', {counters.SHARD_COUNT_FIELD: counters.COUNTER_SHARDS})]
+
+
+def test_document_seen_sharded_is_not_switched_again(post_ref):
+    counters.increment(post_ref, 'likes_count', 1, FakeBatch(), snapshot(post_ref, {counters.SHARD_COUNT_FIELD: 4}))
+    for _ in range(5):
+        counters.note_increment(post_ref, 'likes_count', 1)
+
+    assert post_ref.writes == []
+
+
+def test_totals_add_shard_sums_to_the_document_counts(monkeypatch, post_ref):
+    cold_ref = FakeRef('posts/p2', [])
+    shard_data = {'0': {'likes_count': 2}, '1': {'likes_count': 3, 'comments_count': 1}}
+
+    def get_all(refs):
+        refs = list(refs)
+        assert all(ref.path.startswith('posts/p1/counterShards/') for ref in refs)
+        return [
+            SimpleNamespace(
+                exists=ref.id in shard_data,
+                reference=SimpleNamespace(parent=SimpleNamespace(parent=post_ref)),
+                to_dict=lambda ref=ref: shard_data[ref.id],
+            )
+            for ref in refs
+        ]
+
+    monkeypatch.setattr(counters, 'db', SimpleNamespace(get_all=get_all))
+    totals = counters.get_totals([
+        snapshot(post_ref, {'likes_count': 10, 'comments_count': 0, counters.SHARD_COUNT_FIELD: 4}),
+        snapshot(cold_ref, {'likes_count': 7}),
+    ], ('likes_count', 'comments_count'))
+
+    assert totals == {
+        'p1': {'likes_count': 15, 'comments_count': 1},
+        'p2': {'likes_count': 7, 'comments_count': 0},
+    }
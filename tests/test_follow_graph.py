@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+from services import follow_graph
+from services.follow_graph import FollowSetCache, IdSet
+
+
+def make_set(count: int) -> IdSet:
+    return IdSet([f'user{number:03d}' for number in range(count)])
+
+
+def test_page_from_the_start():
+    assert make_set(5).page(None, 3) == ['user000', 'user001', 'user002']
+
+
+def test_pages_cover_the_set_once():
+    user_ids = make_set(10)
+    pages = []
+    after = None
+    while True:
+        page = user_ids.page(after, 3)
+        if not page:
+            break
+        pages.append(page)
+        after = page[-1]
+
+    assert [len(page) for page in pages] == [3, 3, 3, 1]
+    assert [user_id for page in pages for user_id in page] == list(user_ids)
+
+
+def test_page_after_an_id_that_is_not_in_the_set():
+    # Paging continues from where a removed user would have been
+    assert make_set(5).page('user001x', 2) == ['user002', 'user003']
+
+
+def test_page_after_the_last_id_is_empty():
+    assert make_set(5).page('user004', 3) == []
+    assert make_set(5).page('zzz', 3) == []
+
+
+def test_page_of_an_empty_set():
+    assert IdSet([]).page(None, 3) == []
+
+
+def test_page_smaller_than_the_limit_at_the_end():
+    assert make_set(5).page('user002', 10) == ['user003', 'user004']
+
+
+def test_with_and_without_id_return_new_sets():
+    user_ids = make_set(3)
+
+    added = user_ids.with_id('user001a')
+    removed = user_ids.without_id('user001')
+
+    assert list(added) == ['user000', 'user001', 'user001a', 'user002']
+    assert list(removed) == ['user000', 'user002']
+    assert list(user_ids) == ['user000', 'user001', 'user002']
+    assert 'user001a' in added and 'user001a' not in user_ids
+    assert user_ids.with_id('user001') is user_ids
+    assert user_ids.without_id('missing') is user_ids
+
+
+class FakeCollection:
+    def __init__(self, ids):
+        self.ids = set(ids)
+
+    def document(self, doc_id):
+        return SimpleNamespace(id=doc_id, exists=doc_id in self.ids)
+
+
+def test_members_reads_only_the_page_when_the_set_is_not_cached(monkeypatch):
+    reads = []
+
+    def get_all(refs):
+        reads.append([ref.id for ref in refs])
+        return refs
+
+    cache = FollowSetCache('following', 10, 60)
+    monkeypatch.setattr(cache, 'collection', lambda user_id: FakeCollection(['b', 'd']))
+    monkeypatch.setattr(follow_graph, 'db', SimpleNamespace(get_all=get_all))
+
+    assert cache.members('me', ['a', 'b', 'c', 'd']) == {'b', 'd'}
+    assert reads == [['a', 'b', 'c', 'd']]
+    assert cache.peek('me') is None
+    assert cache.members('me', []) == set()
+    assert len(reads) == 1
+
+
+def test_members_uses_the_cached_set(monkeypatch):
+    cache = FollowSetCache('following', 10, 60)
+    cache._sets.put('me', IdSet(['b', 'c']))
+    monkeypatch.setattr(follow_graph, 'db', None)
+
+    assert cache.members('me', ['a', 'b', 'c']) == {'b', 'c'}
@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+from services import following_feed
+
+
+class FakePost:
+    def __init__(self, post_id, user_id, timestamp):
+        self.id = post_id
+        self._data = {'userId': user_id, 'timestamp': timestamp}
+
+    def get(self, field):
+        return self._data[field]
+
+
+class FakeQuery:
+    """
+    Posts query that supports what the feed uses: an 'in' filter on userId, newest-first order, start_after and limit
+    """
+
+    def __init__(self, posts, queries, author_ids=None, position=None, limit=None):
+        self.posts = posts
+        self.queries = queries
+        self.author_ids = author_ids
+        self.position = position
+        self.row_limit = limit
+
+    def _copy(self, **changes):
+        values = dict(author_ids=self.author_ids, position=self.position, limit=self.row_limit)
+        values.update(changes)
+        return FakeQuery(self.posts, self.queries, **values)
+
+    def where(self, field, operator, values):
+        assert (field, operator) == ('userId', 'in') and len(values) <= following_feed.IN_QUERY_LIMIT
+        return self._copy(author_ids=set(values))
+
+    def order_by(self, field, direction=None):
+        return self
+
+    def start_after(self, position):
+        return self._copy(position=(position['timestamp'], position['__name__']))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def stream(self):
+        self.queries.append(self)
+        rows = [post for post in self.posts if post.get('userId') in self.author_ids]
+        if self.position is not None:
+            rows = [post for post in rows if (post.get('timestamp'), post.id) < self.position]
+        rows.sort(key=lambda post: (post.get('timestamp'), post.id), reverse=True)
+        return iter(rows[:self.row_limit])
+
+
+@pytest.fixture
+def feed(monkeypatch):
+    start = datetime(2024, 1, 1)
+    author_ids = [f'author{number:02d}' for number in range(70)]
+    posts = []
+    for number in range(300):
+        # Interleave the authors, with some posts sharing a timestamp
+        author_id = author_ids[(number * 11) % len(author_ids)]
+        posts.append(FakePost(f'post{number:03d}', author_id, start + timedelta(minutes=number // 3)))
+
+    queries = []
+    monkeypatch.setattr(following_feed, 'db', SimpleNamespace(collection=lambda name: FakeQuery(posts, queries)))
+    return author_ids, posts, queries
+
+
+def expected_order(posts):
+    return [post.id for post in sorted(posts, key=lambda post: (post.get('timestamp'), post.id), reverse=True)]
+
+
+def test_chunks():
+    assert following_feed._chunks(list(range(7)), 3) == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_merged_page_is_ordered_across_chunks(feed):
+    author_ids, posts, queries = feed
+
+    page = following_feed.fetch_merged_page(author_ids, 25)
+
+    assert [post.id for post in page] == expected_order(posts)[:25]
+    assert len(queries) == 3
+    assert all(query.row_limit == 25 for query in queries)
+
+
+def test_pages_from_a_position_cover_every_post_once(feed):
+    author_ids, posts, _ = feed
+
+    seen = []
+    position = None
+    while True:
+        page = following_feed.fetch_merged_page(author_ids, 40, position)
+        seen.extend(post.id for post in page)
+        if len(page) < 40:
+            break
+        position = (page[-1].get('timestamp'), page[-1].id)
+
+    assert seen == expected_order(posts)
+
+
+def test_merged_page_only_includes_the_given_authors(feed):
+    author_ids, posts, _ = feed
+    followed = author_ids[:2]
+
+    page = following_feed.fetch_merged_page(followed, 100)
+
+    assert [post.id for post in page] == expected_order([post for post in posts if post.get('userId') in followed])
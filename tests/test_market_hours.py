@@ -0,0 +1,23 @@
+from datetime import datetime
+import pytz
+from services.market_hours import MARKET_TIMEZONE, seconds_until_next_market_day
+
+
+def market_time(*args) -> datetime:
+    return MARKET_TIMEZONE.localize(datetime(*args))
+
+
+def test_seconds_until_next_market_day():
+    assert seconds_until_next_market_day(market_time(2024, 3, 4, 23, 0)) == 3600
+    assert seconds_until_next_market_day(market_time(2024, 3, 4, 0, 0)) == 86400
+
+
+def test_seconds_until_next_market_day_from_utc():
+    # 03:30 UTC is 22:30 of the previous day in New York
+    now = pytz.UTC.localize(datetime(2024, 3, 5, 3, 30))
+    assert seconds_until_next_market_day(now) == 90 * 60
+
+
+def test_seconds_until_next_market_day_across_a_clock_change():
+    # The clocks go forward at 02:00 on 2024-03-10, so that day is 23 hours long
+    assert seconds_until_next_market_day(market_time(2024, 3, 10, 0, 0)) == 23 * 3600
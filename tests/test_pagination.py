@@ -0,0 +1,75 @@
+from datetime import datetime
+import pytest
+import pytz
+from fastapi import HTTPException
+from services import pagination
+from services.pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    timestamp = datetime(2024, 5, 17, 13, 45, 12, 123456, tzinfo=pytz.UTC)
+
+    assert decode_cursor(encode_cursor(timestamp, 'abc123')) == (timestamp, 'abc123')
+
+
+def test_cursor_keeps_separators_in_document_ids():
+    timestamp = datetime(2024, 5, 17, tzinfo=pytz.UTC)
+
+    assert decode_cursor(encode_cursor(timestamp, 'a:b.c')) == (timestamp, 'a:b.c')
+
+
+def test_cursor_keeps_timestamps_before_the_epoch():
+    timestamp = datetime(1969, 12, 31, 23, 59, 59, 999999, tzinfo=pytz.UTC)
+
+    assert decode_cursor(encode_cursor(timestamp, 'old')) == (timestamp, 'old')
+
+
+def test_cursor_is_opaque():
+    cursor = encode_cursor(datetime(2024, 5, 17, tzinfo=pytz.UTC), 'abc123')
+
+    assert 'abc123' not in cursor
+    assert '=' not in cursor
+
+
+def assert_rejected(cursor: str) -> None:
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_cursor_with_a_changed_payload_is_rejected():
+    cursor = encode_cursor(datetime(2024, 5, 17, tzinfo=pytz.UTC), 'abc123')
+    signature = cursor.split('.')[1]
+    other_payload = encode_cursor(datetime(2024, 5, 18, tzinfo=pytz.UTC), 'abc123').split('.')[0]
+
+    assert_rejected(f'{other_payload}.{signature}')
+
+
+def test_cursor_with_a_changed_signature_is_rejected():
+    cursor = encode_cursor(datetime(2024, 5, 17, tzinfo=pytz.UTC), 'abc123')
+    payload, signature = cursor.split('.')
+    flipped = ('A' if signature[0] != 'A' else 'B') + signature[1:]
+
+    assert_rejected(f'{payload}.{flipped}')
+
+
+def test_cursor_signed_with_another_secret_is_rejected(monkeypatch):
+    cursor = encode_cursor(datetime(2024, 5, 17, tzinfo=pytz.UTC), 'abc123')
+    monkeypatch.setattr(pagination, 'CURSOR_SECRET', 'another-secret')
+
+    assert_rejected(cursor)
+
+
+@pytest.mark.parametrize('cursor', ['', 'not-a-cursor', '.', 'a.b.c', '%%%.%%%'])
+def test_malformed_cursor_is_rejected(cursor):
+    assert_rejected(cursor)
+
+
+def test_missing_secret_fails_when_a_cursor_is_used(monkeypatch):
+    cursor = encode_cursor(datetime(2024, 5, 17, tzinfo=pytz.UTC), 'abc123')
+    monkeypatch.setattr(pagination, 'CURSOR_SECRET', None)
+
+    with pytest.raises(ValueError):
+        encode_cursor(datetime(2024, 5, 17, tzinfo=pytz.UTC), 'abc123')
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
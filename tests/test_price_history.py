@@ -0,0 +1,194 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from services.price_history import COLUMNS, PriceHistoryStore, TickerHistory, _frame_to_bars
+
+
+def make_bars(timestamps, close_offset=0.0):
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    closes = timestamps.astype(np.float64) + close_offset
+    return {
+        'timestamp': timestamps,
+        'open': closes - 1,
+        'high': closes + 1,
+        'low': closes - 2,
+        'close': closes,
+        'volume': np.full(len(timestamps), 100.0),
+    }
+
+
+@pytest.fixture
+def history(tmp_path):
+    return TickerHistory.create(str(tmp_path / 'TEST.bars'), 16)
+
+
+def test_create_starts_empty(history):
+    assert history.count == 0
+    assert history.capacity == 16
+    assert all(len(column) == 0 for column in history.view().values())
+
+
+def test_write_appends_bars(history):
+    assert history.write(make_bars([10, 20, 30])) == 3
+    assert history.write(make_bars([40, 50])) == 2
+
+    assert history.count == 5
+    assert list(history.view()['timestamp']) == [10, 20, 30, 40, 50]
+    assert list(history.view()['close']) == [10.0, 20.0, 30.0, 40.0, 50.0]
+
+
+def test_write_replaces_the_latest_bar(history):
+    history.write(make_bars([10, 20, 30]))
+
+    # The latest bar comes back with a new close, followed by a new bar
+    assert history.write(make_bars([20, 30, 40], close_offset=0.5)) == 2
+
+    assert history.count == 4
+    assert list(history.view()['timestamp']) == [10, 20, 30, 40]
+    assert list(history.view()['close']) == [10.0, 20.0, 30.5, 40.5]
+
+
+def test_write_ignores_bars_that_are_not_newer(history):
+    history.write(make_bars([10, 20, 30]))
+
+    assert history.write(make_bars([5, 10])) == 0
+    assert history.count == 3
+
+
+def test_bars_survive_reopening(history):
+    history.write(make_bars([10, 20, 30]))
+
+    reopened = TickerHistory(history.path)
+    assert reopened.count == 3
+    assert list(reopened.view()['timestamp']) == [10, 20, 30]
+
+
+def test_open_rejects_other_files(tmp_path):
+    path = tmp_path / 'OTHER.bars'
+    path.write_bytes(b'\0' * 1024)
+
+    with pytest.raises(ValueError):
+        TickerHistory(str(path))
+
+
+def test_view_slices_by_timestamp(history):
+    history.write(make_bars([10, 20, 30, 40, 50]))
+
+    assert list(history.view(start=20, end=40)['timestamp']) == [20, 30, 40]
+    assert list(history.view(start=15, end=35)['timestamp']) == [20, 30]
+    assert list(history.view(start=60)['timestamp']) == []
+
+
+def test_view_downsamples_with_a_stride_ending_on_the_latest_bar(history):
+    history.write(make_bars(range(1, 11)))
+
+    view = history.view(points=3)
+    assert list(view['timestamp']) == [2, 6, 10]
+    assert list(view['close']) == [float(timestamp) for timestamp in view['timestamp']]
+
+
+def test_view_downsamples_within_a_range(history):
+    history.write(make_bars(range(1, 11)))
+
+    view = history.view(start=3, end=8, points=2)
+    assert list(view['timestamp']) == [5, 8]
+
+
+def test_view_does_not_copy_the_columns(history):
+    history.write(make_bars(range(1, 11)))
+
+    view = history.view(points=3)
+    for name in COLUMNS:
+        assert np.shares_memory(view[name], history.columns[name])
+
+
+def test_frame_to_bars_sorts_and_drops_bars_without_a_close():
+    index = pd.DatetimeIndex(['2024-01-03', '2024-01-01', '2024-01-02'], tz='America/New_York')
+    frame = pd.DataFrame({
+        'Open': [3.0, 1.0, 2.0],
+        'High': [3.5, 1.5, 2.5],
+        'Low': [2.5, 0.5, 1.5],
+        'Close': [3.0, 1.0, None],
+        'Volume': [300, 100, None],
+    }, index=index)
+
+    bars, length = _frame_to_bars(frame)
+
+    assert length == 2
+    assert list(bars['close']) == [1.0, 3.0]
+    assert list(bars['timestamp']) == [
+        int(pd.Timestamp('2024-01-01 05:00', tz='UTC').timestamp()),
+        int(pd.Timestamp('2024-01-03 05:00', tz='UTC').timestamp()),
+    ]
+
+
+def open_fds() -> int:
+    return len(os.listdir('/proc/self/fd'))
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason="needs /proc to count file descriptors")
+def test_a_history_holds_one_file_descriptor(tmp_path):
+    before = open_fds()
+    histories = [TickerHistory.create(str(tmp_path / f'T{number}.bars'), 16) for number in range(5)]
+
+    assert open_fds() - before == 5
+
+    for history in histories:
+        history.close()
+    del histories
+    assert open_fds() == before
+
+
+def test_closed_history_maps_the_file_again(history):
+    history.write(make_bars([10, 20]))
+    history.close()
+
+    assert history.count == 2
+    assert list(history.view()['timestamp']) == [10, 20]
+
+
+def make_store(tmp_path, monkeypatch, max_open):
+    store = PriceHistoryStore(str(tmp_path), max_open)
+    fetches = []
+
+    def refresh(key, history):
+        fetches.append(key)
+        if history is None:
+            history = store._grow(key, None, 4)
+        history.write(make_bars([10, 20]))
+        return history
+
+    monkeypatch.setattr(store, '_refresh', refresh)
+    return store, fetches
+
+
+def test_store_keeps_a_bounded_number_of_histories_open(tmp_path, monkeypatch):
+    store, fetches = make_store(tmp_path, monkeypatch, max_open=2)
+
+    first = store.get('AAA')
+    store.get('BBB')
+    store.get('CCC')
+
+    # The least recently used history was closed, and is reopened from its file without a fetch
+    assert len(store._histories) == 2
+    assert first._maps is None
+    assert store.get('aaa').count == 2
+    assert fetches == ['AAA', 'BBB', 'CCC']
+
+
+def test_store_drops_ticker_locks_once_unused(tmp_path, monkeypatch):
+    store, _ = make_store(tmp_path, monkeypatch, max_open=2)
+
+    for ticker in ('AAA', 'BBB', 'CCC'):
+        store.get(ticker)
+
+    assert store._locks == {}
+
+
+def test_store_rejects_invalid_tickers(tmp_path, monkeypatch):
+    store, fetches = make_store(tmp_path, monkeypatch, max_open=2)
+
+    with pytest.raises(KeyError):
+        store.get('../etc/passwd')
+    assert fetches == []
@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+import pytest
+from fastapi import HTTPException
+from routers import stock
+from services.ticker_index import TickerIndex, is_symbol_shaped
+
+
+@pytest.fixture
+def index():
+    index = TickerIndex()
+    index.add_many([
+        ('AAPL', 'Apple Inc.'),
+        ('AA', 'Alcoa Corporation'),
+        ('AAL', 'American Airlines Group Inc.'),
+        ('MSFT', 'Microsoft Corporation'),
+        ('BRK.B', 'Berkshire Hathaway Inc.'),
+    ])
+    return index
+
+
+def test_search_ranks_exact_symbol_then_shortest_prefix(index):
+    assert [symbol for symbol, _ in index.search('aa')] == ['AA', 'AAL', 'AAPL']
+
+
+def test_search_matches_company_names(index):
+    assert index.search('microsoft') == [('MSFT', 'Microsoft Corporation')]
+
+
+def test_search_falls_back_to_close_symbols(index):
+    assert [symbol for symbol, _ in index.search('MSFY')] == ['MSFT']
+
+
+def test_add_keeps_the_first_name_and_clears_unknown(index):
+    index.mark_unknown('nvda')
+    assert index.is_unknown('NVDA')
+
+    index.add('nvda', 'NVIDIA Corporation')
+    index.add('NVDA', 'Other')
+    assert index.name('NVDA') == 'NVIDIA Corporation'
+    assert not index.is_unknown('NVDA')
+
+
+def test_is_symbol_shaped():
+    assert is_symbol_shaped('brk.b')
+    assert not is_symbol_shaped('apple inc')
+
+
+class FakeQuoteCache:
+    def __init__(self, quotes):
+        self.quotes = quotes
+        self.requests = []
+
+    def get_many(self, tickers):
+        self.requests.append(list(tickers))
+        return {ticker: self.quotes.get(ticker) for ticker in tickers}
+
+
+def quote(symbol, name='N/A', price=1.0):
+    return SimpleNamespace(symbol=symbol, name=name, price=price)
+
+
+@pytest.fixture
+def search(index, monkeypatch):
+    quotes = FakeQuoteCache({
+        'AAPL': quote('AAPL', 'Apple Inc.', 200.0),
+        'NVDA': quote('NVDA', 'NVIDIA Corporation', 100.0),
+        'ZZZZ': quote('N/A'),
+    })
+    monkeypatch.setattr(stock, 'ticker_index', index)
+    monkeypatch.setattr(stock, 'quote_cache', quotes)
+    return quotes
+
+
+def test_search_with_matches_does_not_look_up_the_query(search):
+    results = stock.search_stock('apple', limit=5)
+
+    assert [(result.symbol, result.price) for result in results] == [('AAPL', 200.0)]
+    assert search.requests == [['AAPL']]
+
+
+def test_search_without_matches_adds_a_confirmed_symbol(search):
+    assert [result.symbol for result in stock.search_stock('NVDA', limit=5)] == ['NVDA']
+    assert [result.symbol for result in stock.search_stock('NVDA', limit=5)] == ['NVDA']
+    assert search.requests == [['NVDA'], ['NVDA']]
+
+
+def test_search_remembers_unknown_symbols(search):
+    for _ in range(3):
+        with pytest.raises(HTTPException):
+            stock.search_stock('ZZZZ', limit=5)
+    assert search.requests == [['ZZZZ']]
+
+
+def test_search_does_not_remember_failed_lookups(search):
+    for _ in range(2):
+        with pytest.raises(HTTPException):
+            stock.search_stock('QQQQ', limit=5)
+    assert search.requests == [['QQQQ'], ['QQQQ']]
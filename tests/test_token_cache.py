@@ -0,0 +1,89 @@
+import time
+import pytest
+from services import token_cache as token_cache_module
+from services.token_cache import TokenCache
+
+
+@pytest.fixture
+def verified(monkeypatch):
+    # token -> decoded claims returned by the stubbed verification, and the number of verifications
+    tokens = {}
+    calls = []
+
+    def verify_id_token(token, check_revoked=False):
+        calls.append(token)
+        return dict(tokens[token])
+
+    monkeypatch.setattr(token_cache_module.auth, 'verify_id_token', verify_id_token)
+    return tokens, calls
+
+
+def claims(uid, iat, lifetime=3600):
+    return {'uid': uid, 'iat': iat, 'exp': iat + lifetime}
+
+
+def test_verified_token_is_cached(verified):
+    tokens, calls = verified
+    tokens['a'] = claims('alice', int(time.time()))
+    cache = TokenCache(10)
+
+    assert cache.verify('a') == 'alice'
+    assert cache.verify('a') == 'alice'
+    assert calls == ['a']
+
+
+def test_token_close_to_expiry_is_not_cached(verified):
+    tokens, calls = verified
+    tokens['a'] = claims('alice', int(time.time()) - 3590)
+    cache = TokenCache(10)
+
+    cache.verify('a')
+    cache.verify('a')
+    assert calls == ['a', 'a']
+
+
+def test_revoke_user_rejects_tokens_issued_up_to_the_revocation(verified):
+    tokens, _ = verified
+    now = int(time.time())
+    tokens['old'] = claims('alice', now - 60)
+    tokens['same-second'] = claims('alice', now)
+    tokens['other-user'] = claims('bob', now - 60)
+    cache = TokenCache(10)
+    cache.verify('old')
+    cache.verify('other-user')
+
+    cache.revoke_user('alice')
+
+    with pytest.raises(ValueError):
+        cache.verify('old')
+    with pytest.raises(ValueError):
+        cache.verify('same-second')
+    assert cache.verify('other-user') == 'bob'
+
+
+def test_tokens_issued_after_revocation_are_accepted(verified):
+    tokens, _ = verified
+    cache = TokenCache(10)
+    cache.revoke_user('alice')
+
+    tokens['new'] = claims('alice', int(time.time()) + 1)
+    assert cache.verify('new') == 'alice'
+
+
+def test_revocations_are_bounded(verified):
+    cache = TokenCache(2)
+    for uid in ('alice', 'bob', 'carol'):
+        cache.revoke_user(uid)
+
+    assert len(cache._revoked_before) == 2
+
+
+def test_revoke_token_forces_verification(verified):
+    tokens, calls = verified
+    tokens['a'] = claims('alice', int(time.time()))
+    cache = TokenCache(10)
+    cache.verify('a')
+
+    cache.revoke_token('a')
+    cache.verify('a')
+    assert calls == ['a', 'a']
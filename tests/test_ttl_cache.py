@@ -0,0 +1,123 @@
+import pytest
+from services import ttl_cache
+from services.ttl_cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ttl_cache.time, 'monotonic', clock.monotonic)
+    return clock
+
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = TTLCache(10, 5)
+    cache.put('a', 1)
+    cache.put('b', 2, ttl_seconds=20)
+
+    clock.now += 5
+    assert cache.get('a') == 1
+
+    clock.now += 1
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    assert cache.items() == [('b', 2)]
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    removed = []
+    cache = TTLCache(2, 60, on_remove=lambda key, value: removed.append((key, value)))
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+
+    cache.put('c', 3)
+    assert cache.peek('b') is None
+    assert cache.peek('a') == 1 and cache.peek('c') == 3
+    assert removed == [('b', 2)]
+    assert cache.stats()['evictions'] == 1
+
+
+def test_on_remove_is_called_on_expiry_replace_and_discard(clock):
+    removed = []
+    cache = TTLCache(10, 5, on_remove=lambda key, value: removed.append((key, value)))
+    cache.put('a', 1)
+    cache.put('a', 2)
+    cache.put('b', 3)
+    cache.discard('a')
+
+    clock.now += 6
+    cache.get('b')
+    assert removed == [('a', 1), ('a', 2), ('b', 3)]
+
+
+def test_load_started_before_a_write_is_not_cached(clock):
+    cache = TTLCache(10, 60)
+    load_token = cache.load_token()
+
+    clock.now += 1
+    cache.invalidate('a')
+
+    clock.now += 1
+    assert not cache.put('a', 'stale', load_token)
+    assert cache.peek('a') is None
+
+
+def test_load_started_after_a_write_is_cached(clock):
+    cache = TTLCache(10, 60)
+    cache.put('a', 'written')
+
+    clock.now += 1
+    load_token = cache.load_token()
+    assert cache.put('a', 'loaded', load_token)
+    assert cache.peek('a') == 'loaded'
+
+
+def test_a_write_to_one_key_does_not_reject_loads_of_others(clock):
+    cache = TTLCache(10, 60)
+    load_token = cache.load_token()
+
+    clock.now += 1
+    cache.update('a', lambda value: value + 1)
+    assert cache.put('b', 'loaded', load_token)
+
+
+def test_slow_loads_are_not_cached(clock):
+    cache = TTLCache(10, 60)
+    load_token = cache.load_token()
+
+    clock.now += ttl_cache.CACHE_MAX_LOAD_SECONDS + 1
+    assert not cache.put('a', 'slow', load_token)
+
+
+def test_update_replaces_the_value_and_keeps_the_expiry(clock):
+    cache = TTLCache(10, 5)
+    cache.put('a', [1])
+    original = cache.peek('a')
+
+    clock.now += 3
+    cache.update('a', lambda value: value + [2])
+    assert cache.peek('a') == [1, 2]
+    assert original == [1]
+
+    clock.now += 3
+    assert cache.peek('a') is None
+
+
+def test_stats_count_hits_and_misses(clock):
+    cache = TTLCache(10, 60)
+    cache.put('a', 1)
+    cache.get('a')
+    cache.get('b')
+    cache.peek('b')
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, 0.5)
@@ -0,0 +1,103 @@
+import pytest
+from services import username_reservations
+from services.bloom import BloomFilter
+from services.username_index import UsernameIndex
+
+
+@pytest.fixture
+def index():
+    index = UsernameIndex()
+    index.replace_all([
+        ('u1', 'Sam'),
+        ('u2', 'samantha'),
+        ('u3', 'samuel'),
+        ('u4', 'sammy'),
+        ('u5', 'Isamu'),
+        ('u6', 'jessam'),
+        ('u7', 'bob'),
+        ('u8', None),
+    ])
+    return index
+
+
+def test_search_ranks_exact_then_shortest_prefix_then_earliest_infix(index):
+    assert index.search('sam', 10) == ['u1', 'u4', 'u3', 'u2', 'u5', 'u6']
+
+
+def test_search_ignores_case_and_surrounding_whitespace(index):
+    assert index.search('  SAMU ', 10) == ['u3', 'u5']
+
+
+def test_search_stops_at_the_limit(index):
+    assert index.search('sam', 2) == ['u1', 'u4']
+    assert index.search('sam', 5) == ['u1', 'u4', 'u3', 'u2', 'u5']
+
+
+def test_search_without_matches_or_query(index):
+    assert index.search('zed', 10) == []
+    assert index.search('', 10) == []
+    assert index.search('sam', 0) == []
+
+
+def test_lookup_finds_exact_usernames_only(index):
+    assert index.lookup('SAM') == 'u1'
+    assert index.lookup('sa') is None
+
+
+def test_add_replaces_a_renamed_username(index):
+    index.add('u7', 'Samwise')
+
+    assert index.lookup('bob') is None
+    assert index.lookup('samwise') == 'u7'
+    assert index.search('samw', 10) == ['u7']
+
+
+def test_remove_drops_the_user(index):
+    index.remove('u1')
+
+    assert index.lookup('sam') is None
+    assert index.search('sam', 10) == ['u4', 'u3', 'u2', 'u5', 'u6']
+
+
+def test_might_be_taken(index):
+    assert index.might_be_taken('SAM')
+    assert not index.might_be_taken('definitely-free-name')
+
+    index.add('u9', 'newcomer')
+    assert index.might_be_taken('Newcomer')
+
+
+def test_might_be_taken_before_the_index_is_loaded():
+    assert UsernameIndex().might_be_taken('anything')
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000)
+    values = [f'user{number}' for number in range(1000)]
+    for value in values:
+        bloom.add(value)
+
+    assert all(value in bloom for value in values)
+
+
+def test_bloom_filter_false_positive_rate_is_near_its_target():
+    bloom = BloomFilter(1000, false_positive_rate=0.01)
+    for number in range(1000):
+        bloom.add(f'user{number}')
+
+    false_positives = sum(f'other{number}' in bloom for number in range(10000))
+    assert false_positives < 300
+
+
+def test_a_bloom_filter_miss_is_trusted_without_a_read(index, monkeypatch):
+    def reservation_ref(username):
+        raise AssertionError("a Bloom filter miss should not read Firestore")
+
+    monkeypatch.setattr(username_reservations, 'username_index', index)
+    monkeypatch.setattr(username_reservations, 'reservation_ref', reservation_ref)
+    assert username_reservations.is_username_available('definitely-free-name')
+
+    # A name reserved on this instance reaches the filter right away
+    index.add('u9', 'newcomer')
+    with pytest.raises(AssertionError):
+        username_reservations.is_username_available('newcomer')